@@ -0,0 +1,317 @@
+"""Alertas a partir das leituras do polling periódico, enviados aos chats configurados.
+
+Regras avaliadas em cada leitura do polling:
+- offline: a impressora não respondeu em `offline_ciclos` polls seguidos;
+- toner: um suprimento de toner ou tinta ficou abaixo de `toner_minimo`%;
+- contador: o contador voltou para trás ou avançou mais de `paginas_hora` páginas por hora desde
+  a leitura anterior (outra impressora no mesmo IP, placa trocada, leitura corrompida).
+
+Os limites padrão podem ser trocados por setor ou por impressora (alertas.json); 0 desativa uma
+regra. A avaliação é incremental: o avaliador guarda por IP só o necessário da amostra anterior
+(polls seguidos sem resposta, último contador, suprimentos em alerta), e uma leitura igual à
+anterior termina na comparação com ela, sem consultar o histórico.
+
+Cada alerta é notificado uma vez ao disparar e uma vez ao normalizar. Um alerta que volta a
+disparar menos de `intervalo_minimo` segundos depois da última notificação fica registrado, mas
+não é notificado de novo, para que uma impressora oscilando não inunde os chats.
+"""
+from collections import deque
+from dataclasses import dataclass, field, fields, replace
+import json
+import time
+
+from mensagens import dividir_texto, enviar_com_espera
+from registro import normalizar
+
+# Suprimentos avaliados pela regra de toner, pela descrição informada pela impressora
+PADROES_TONER = ('toner', 'tinta', 'ink', 'cartucho', 'cartridge')
+
+# Um suprimento em alerta só volta ao normal acima do limite mais esta margem, em pontos percentuais
+HISTERESE_TONER = 5
+
+# Intervalo mínimo considerado no cálculo de páginas por hora, em segundos
+INTERVALO_MINIMO_CONTADOR = 60
+
+
+class AlertasError(ValueError):
+    """Configuração de alertas inválida."""
+
+
+@dataclass(frozen=True, slots=True)
+class Regras:
+    """Limites das regras de uma impressora (0 desativa a regra) e os chats que recebem os alertas."""
+    offline_ciclos: int = 3
+    toner_minimo: float = 0.0
+    paginas_hora: int = 5000
+    chats: tuple = ()
+
+    def com(self, ajustes, origem):
+        """Cópia com os valores de `ajustes`, um dicionário lido do alertas.json."""
+        if not isinstance(ajustes, dict):
+            raise AlertasError(f"{origem} deve ser um objeto com as regras.")
+        desconhecidas = set(ajustes) - {campo.name for campo in fields(self)}
+        if desconhecidas:
+            raise AlertasError(f"Regra desconhecida em {origem}: {', '.join(sorted(desconhecidas))}")
+        try:
+            valores = {
+                nome: tuple(int(chat) for chat in valor) if nome == 'chats' else type(getattr(self, nome))(valor)
+                for nome, valor in ajustes.items()
+            }
+        except (TypeError, ValueError) as e:
+            raise AlertasError(f"Valor inválido em {origem}: {e}")
+        return replace(self, **valores)
+
+
+@dataclass(slots=True)
+class Alerta:
+    """Notificação de um alerta que disparou ou normalizou."""
+    ip: str
+    regra: str
+    texto: str
+    chats: tuple
+    resolvido: bool = False
+
+
+@dataclass(slots=True)
+class _EstadoIp:
+    setor: str | None = None
+    regras: Regras | None = None
+    amostra: tuple | None = None  # (contador, suprimentos) da última leitura com resposta
+    polls_offline: int = 0
+    contador: int | None = None
+    contador_em: float | None = None
+    ativos: dict = field(default_factory=dict)  # (regra, detalhe) -> (desde, texto, notificado)
+    notificados: dict = field(default_factory=dict)  # (regra, detalhe) -> última notificação
+
+
+class AvaliadorAlertas:
+    """Avalia as regras a cada leitura do polling e acumula as notificações a enviar.
+
+    `setores` e `impressoras` são os ajustes do alertas.json por nome de setor e por IP; os da
+    impressora têm precedência sobre os do setor, que têm precedência sobre `padrao`.
+    """
+
+    def __init__(self, padrao=Regras(), setores=None, impressoras=None, intervalo_minimo=3600.0):
+        # Valida os ajustes já na criação, em vez de na primeira leitura de cada impressora
+        for setor, ajustes in (setores or {}).items():
+            padrao.com(ajustes, f"setores.{setor}")
+        for ip, ajustes in (impressoras or {}).items():
+            padrao.com(ajustes, f"impressoras.{ip}")
+        self.padrao = padrao
+        self.setores = {normalizar(setor): ajustes for setor, ajustes in (setores or {}).items()}
+        self.impressoras = dict(impressoras or {})
+        self.intervalo_minimo = intervalo_minimo
+        self._estados = {}
+        self._pendentes = []
+        self._total_ativos = 0
+
+    @classmethod
+    def de_arquivo(cls, caminho, padrao=Regras(), intervalo_minimo=3600.0):
+        """Lê os ajustes por setor e por impressora do JSON; sem o arquivo, valem só os padrões.
+
+        Formato: {"setores": {"<setor>": {"toner_minimo": 20, "chats": [123]}},
+                  "impressoras": {"<ip>": {"offline_ciclos": 0}}}
+        """
+        try:
+            with open(caminho, encoding='utf-8') as f:
+                dados = json.load(f)
+        except FileNotFoundError:
+            dados = {}
+        except (OSError, json.JSONDecodeError) as e:
+            raise AlertasError(f"Não foi possível ler {caminho}: {e}")
+        if not isinstance(dados, dict):
+            raise AlertasError(f"{caminho} deve conter um objeto com 'setores' e/ou 'impressoras'.")
+        return cls(padrao, dados.get('setores'), dados.get('impressoras'), intervalo_minimo)
+
+    def regras(self, ip, setor=None):
+        """Limites efetivos da impressora: padrão, depois os do setor, depois os do IP."""
+        regras = self.padrao
+        ajustes = self.setores.get(normalizar(setor)) if setor else None
+        if ajustes:
+            regras = regras.com(ajustes, f"setores.{setor}")
+        if ip in self.impressoras:
+            regras = regras.com(self.impressoras[ip], f"impressoras.{ip}")
+        return regras
+
+    def _todas_regras(self):
+        yield self.padrao
+        for ajustes in list(self.setores.values()) + list(self.impressoras.values()):
+            yield self.padrao.com(ajustes, 'alertas.json')
+
+    @property
+    def notifica(self):
+        """Indica se algum chat recebe alertas (sem chats, o polling não avalia as regras)."""
+        return any(regras.chats for regras in self._todas_regras())
+
+    @property
+    def le_suprimentos(self):
+        """Indica se a regra de toner está ativa em alguma impressora, o que exige ler os suprimentos."""
+        return any(regras.toner_minimo > 0 for regras in self._todas_regras())
+
+    def avaliar(self, leitura, setor=None, nome=None):
+        """Compara a leitura do polling com a anterior do mesmo IP e registra os alertas que mudaram."""
+        ip = leitura.ip
+        nome = nome or ip
+        estado = self._estados.get(ip)
+        if estado is None:
+            estado = self._estados[ip] = _EstadoIp()
+        if estado.regras is None or estado.setor != setor:
+            estado.setor, estado.regras = setor, self.regras(ip, setor)
+        regras = estado.regras
+
+        if not leitura.online:
+            estado.polls_offline += 1
+            if regras.offline_ciclos and estado.polls_offline == regras.offline_ciclos:
+                self._disparar(estado, ip, ('offline', None),
+                               f"{nome} não responde há {estado.polls_offline} polls: {leitura.erro}")
+            return
+        if estado.polls_offline:
+            self._normalizar(estado, ip, ('offline', None), f"{nome} voltou a responder após {estado.polls_offline} polls")
+            estado.polls_offline = 0
+
+        amostra = (leitura.contador, tuple(leitura.suprimentos))
+        if amostra == estado.amostra:
+            estado.contador_em = leitura.coletada_em
+            return
+        estado.amostra = amostra
+        if leitura.contador is not None:
+            self._avaliar_contador(estado, ip, nome, leitura)
+        for descricao, percentual in leitura.suprimentos:
+            self._avaliar_toner(estado, ip, nome, descricao, percentual)
+
+    def _avaliar_contador(self, estado, ip, nome, leitura):
+        anterior, anterior_em = estado.contador, estado.contador_em
+        estado.contador, estado.contador_em = leitura.contador, leitura.coletada_em
+        if anterior is None or not estado.regras.paginas_hora:
+            return
+        paginas = leitura.contador - anterior
+        if paginas < 0:
+            self._evento(estado, ip, ('contador', None), f"{nome}: o contador voltou de {anterior} para {leitura.contador}")
+            return
+        horas = max(leitura.coletada_em - anterior_em, INTERVALO_MINIMO_CONTADOR) / 3600
+        if paginas / horas > estado.regras.paginas_hora:
+            self._evento(estado, ip, ('contador', None),
+                         f"{nome}: o contador avançou {paginas} páginas em {horas * 60:.0f} min (de {anterior} para {leitura.contador})")
+
+    def _avaliar_toner(self, estado, ip, nome, descricao, percentual):
+        if percentual is None or not any(padrao in descricao.lower() for padrao in PADROES_TONER):
+            return
+        chave = ('toner', descricao)
+        minimo = estado.regras.toner_minimo
+        if chave in estado.ativos:
+            if percentual >= minimo + HISTERESE_TONER:
+                self._normalizar(estado, ip, chave, f"{nome}: {descricao} em {percentual}%")
+        elif minimo and percentual < minimo:
+            self._disparar(estado, ip, chave, f"{nome}: {descricao} em {percentual}%")
+
+    def _notificar(self, estado, ip, chave, texto, resolvido=False):
+        self._pendentes.append(Alerta(ip, chave[0], texto, estado.regras.chats, resolvido))
+
+    def _disparar(self, estado, ip, chave, texto):
+        if chave in estado.ativos:
+            return
+        agora = time.time()
+        ultima = estado.notificados.get(chave)
+        notificar = ultima is None or agora - ultima >= self.intervalo_minimo
+        estado.ativos[chave] = (agora, texto, notificar)
+        self._total_ativos += 1
+        if notificar:
+            estado.notificados[chave] = agora
+            self._notificar(estado, ip, chave, texto)
+
+    def _normalizar(self, estado, ip, chave, texto):
+        ativo = estado.ativos.pop(chave, None)
+        if ativo is None:
+            return
+        self._total_ativos -= 1
+        # Um disparo que não foi notificado também não tem o fim notificado
+        if ativo[2]:
+            self._notificar(estado, ip, chave, texto, resolvido=True)
+
+    def _evento(self, estado, ip, chave, texto):
+        """Alerta pontual, sem estado ativo: notificado no máximo uma vez por intervalo_minimo."""
+        agora = time.time()
+        ultima = estado.notificados.get(chave)
+        if ultima is None or agora - ultima >= self.intervalo_minimo:
+            estado.notificados[chave] = agora
+            self._notificar(estado, ip, chave, texto)
+
+    def coletar(self):
+        """Retorna e esvazia a lista de notificações acumuladas desde a última coleta."""
+        pendentes, self._pendentes = self._pendentes, []
+        return pendentes
+
+    def ativos(self):
+        """Lista de (ip, regra, desde, texto) dos alertas ativos, dos mais antigos aos mais recentes."""
+        ativos = [(ip, chave[0], desde, texto)
+                  for ip, estado in self._estados.items()
+                  for chave, (desde, texto, _) in estado.ativos.items()]
+        return sorted(ativos, key=lambda ativo: ativo[2])
+
+    @property
+    def total_ativos(self):
+        return self._total_ativos
+
+    def remover(self, ip):
+        """Esquece o estado de um IP que saiu do cadastro (sem notificar os alertas dele)."""
+        estado = self._estados.pop(ip, None)
+        if estado is not None:
+            self._total_ativos -= len(estado.ativos)
+
+
+class LimiteEnvio:
+    """No máximo `maximo` mensagens por chat a cada `janela` segundos (0 = sem limite)."""
+
+    def __init__(self, maximo, janela=3600.0):
+        self.maximo = maximo
+        self.janela = janela
+        self._envios = {}  # chat -> deque com o momento de cada mensagem na janela
+
+    def disponiveis(self, chat):
+        if self.maximo <= 0:
+            return float('inf')
+        envios = self._envios.setdefault(chat, deque())
+        limite = time.monotonic() - self.janela
+        while envios and envios[0] <= limite:
+            envios.popleft()
+        return max(self.maximo - len(envios), 0)
+
+    def registrar(self, chat):
+        if self.maximo > 0:
+            self._envios.setdefault(chat, deque()).append(time.monotonic())
+
+
+def formatar_alerta(alerta):
+    return f"{'Normalizado' if alerta.resolvido else 'Alerta'} - {alerta.texto}"
+
+
+async def notificar(bot, alertas, limite):
+    """Envia os alertas agrupados em poucas mensagens por chat, respeitando o limite de cada chat.
+
+    Quando o limite não comporta todas as mensagens, a última enviada avisa quantos alertas
+    ficaram de fora (os ativos continuam em /alertas). Retorna o número de mensagens enviadas.
+    """
+    por_chat = {}
+    for alerta in alertas:
+        for chat in alerta.chats:
+            por_chat.setdefault(chat, []).append(formatar_alerta(alerta))
+
+    enviadas = 0
+    for chat, linhas in por_chat.items():
+        textos = dividir_texto(linhas)
+        disponiveis = limite.disponiveis(chat)
+        if disponiveis < len(textos):
+            omitidos = sum(texto.count('\n') + 1 for texto in textos[max(disponiveis - 1, 0):])
+            print(f"Limite de alertas do chat {chat} atingido: {omitidos} alerta(s) não enviados")
+            if disponiveis == 0:
+                continue
+            textos = textos[:disponiveis - 1] + [f"... e mais {omitidos} alerta(s) não enviados pelo limite de mensagens (veja /alertas)."]
+        for texto in textos:
+            try:
+                await enviar_com_espera(bot.send_message, chat_id=chat, text=texto)
+            except Exception as e:
+                print(f"Falha ao enviar alertas ao chat {chat}: {e}")
+                break
+            limite.registrar(chat)
+            enviadas += 1
+    return enviadas
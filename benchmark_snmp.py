@@ -0,0 +1,313 @@
+"""Benchmark do polling SNMP do bot contra a frota simulada de simulador_snmp.py.
+
+Inicia o simulador em outro processo, cria um printers.json temporário apontando para os
+agentes e importa o bot com SNMP_PORTA apontando para eles, sem token real nem rede de
+impressoras. Em cada rodada são medidos quatro caminhos:
+
+- partida_fria: a mesma varredura com um cliente SNMP (ou pool) recém-criado, sem nada que a
+  varredura anterior deixou pronto, como a primeira depois de iniciar o bot;
+- varredura: consultar_impressoras em todas as impressoras (o que o polling periódico faz);
+- contadores: o handler /contadores agora, com um Update falso que só guarda as mensagens;
+- get_snmp_data: chamadas bloqueantes em sequência para uma amostra de impressoras.
+
+Para cada um são informados o tempo total, p50/p99 da latência por impressora, falhas, tempo
+de CPU e memória do processo do bot. Com --trabalhadores N, a varredura e o /contadores usam o
+polling distribuído em N processos (o tempo de CPU informado é só o do processo do bot).
+
+Uso:
+    python benchmark_snmp.py --impressoras 300 --rodadas 3 --latencia 0.05 --perda 0.01 --mortas 0.1
+    python benchmark_snmp.py --json resultado.json   # guarda os números para comparar depois
+    python benchmark_snmp.py --impressoras 2000 --trabalhadores 4
+"""
+from contextlib import redirect_stdout
+import argparse
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from simulador_snmp import endereco_agente
+from snmp_client import SnmpClient
+from trabalhadores import PoolSnmp
+
+try:
+    import resource  # Indisponível no Windows
+except ImportError:
+    resource = None
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+
+
+class MensagemFalsa:
+    """Substitui update.message: guarda as respostas em vez de enviá-las ao Telegram."""
+
+    def __init__(self, texto):
+        self.text = texto
+        self.enviadas = 0
+        self.editadas = 0
+        self.documentos = 0
+
+    async def reply_text(self, texto, **kwargs):
+        self.enviadas += 1
+        return self
+
+    async def edit_text(self, texto, **kwargs):
+        self.editadas += 1
+        return self
+
+    async def reply_document(self, *args, **kwargs):
+        self.documentos += 1
+        return self
+
+
+class UpdateFalso:
+    def __init__(self, texto):
+        self.message = MensagemFalsa(texto)
+
+
+class ContextoFalso:
+    def __init__(self, args):
+        self.args = list(args)
+
+
+def percentil(valores, fracao):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[int(fracao * (len(ordenados) - 1))]
+
+
+def memoria_atual_mb():
+    """Memória residente atual do processo (Linux), ou None."""
+    try:
+        with open('/proc/self/statm') as arquivo:
+            return int(arquivo.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def memoria_pico_mb():
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss é em KB no Linux e em bytes no macOS
+    return pico / 2 ** 20 if sys.platform == 'darwin' else pico / 1024
+
+
+def iniciar_simulador(opcoes):
+    """Inicia simulador_snmp.py em outro processo e espera os agentes ficarem prontos."""
+    comando = [
+        sys.executable, os.path.join(DIRETORIO, 'simulador_snmp.py'),
+        '--impressoras', str(opcoes.impressoras), '--porta', str(opcoes.porta), '--prefixo', opcoes.prefixo,
+        '--latencia', str(opcoes.latencia), '--variacao', str(opcoes.variacao), '--perda', str(opcoes.perda),
+        '--mortas', str(opcoes.mortas), '--semente', str(opcoes.semente),
+    ]
+    processo = subprocess.Popen(comando, stdout=subprocess.PIPE, text=True)
+    for linha in processo.stdout:
+        if linha.startswith('Simulador pronto'):
+            print(linha.strip())
+            return processo
+    processo.wait()
+    raise RuntimeError(f"O simulador terminou antes de ficar pronto (código {processo.returncode}).")
+
+
+def preparar_bot(opcoes, diretorio):
+    """Importa o bot em um diretório temporário, com o cadastro apontando para os agentes simulados."""
+    impressoras = {endereco_agente(indice, opcoes.prefixo): [f"Setor {indice % 20}", str(1000 + indice)]
+                   for indice in range(opcoes.impressoras)}
+    with open(os.path.join(diretorio, 'printers.json'), 'w') as arquivo:
+        json.dump(impressoras, arquivo, indent=4)
+
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', 'benchmark')
+    os.environ.update({
+        'SNMP_PORTA': str(opcoes.porta),
+        'SNMP_TIMEOUT': str(opcoes.timeout),
+        'SNMP_RETRIES': str(opcoes.retries),
+        'SNMP_CONCORRENCIA': str(opcoes.concorrencia),
+        'HISTORICO_DB': os.path.join(diretorio, 'historico.db'),
+        'POLL_INTERVALO': '0',
+        'POLL_TRABALHADORES': str(opcoes.trabalhadores),
+        'POLL_PARTICAO': opcoes.particao,
+    })
+    os.chdir(diretorio)
+    sys.path.insert(0, DIRETORIO)
+    import telegram_bot
+    telegram_bot.preparar()
+    telegram_bot.iniciar_trabalhadores()
+    return telegram_bot
+
+
+async def medir(cliente, nome, corrotina, verboso=False):
+    """Executa a corrotina e retorna tempo, latências por impressora (do cliente SNMP ou pool), CPU e memória."""
+    consultas_antes = cliente.total_consultas
+    falhas_antes = cliente.total_falhas
+    cpu_antes = time.process_time()
+    inicio = time.perf_counter()
+    if verboso:
+        extra = await corrotina
+    else:
+        # As linhas impressas pelo bot (contadores, erros de timeout) não interessam aqui
+        with redirect_stdout(io.StringIO()):
+            extra = await corrotina
+    duracao = time.perf_counter() - inicio
+    cpu = time.process_time() - cpu_antes
+
+    consultas = cliente.total_consultas - consultas_antes
+    recentes = list(cliente.latencias)[-consultas:] if consultas else []
+    tempos = [segundos for _, segundos, sucesso in recentes if sucesso]
+    resultado = {
+        'caminho': nome,
+        'tempo_s': round(duracao, 3),
+        'consultas': consultas,
+        'falhas': cliente.total_falhas - falhas_antes,
+        'p50_ms': round(percentil(tempos, 0.50) * 1000, 1) if tempos else None,
+        'p99_ms': round(percentil(tempos, 0.99) * 1000, 1) if tempos else None,
+        'cpu_s': round(cpu, 3),
+        'memoria_mb': None,
+        'memoria_pico_mb': None,
+    }
+    memoria, pico = memoria_atual_mb(), memoria_pico_mb()
+    if memoria is not None:
+        resultado['memoria_mb'] = round(memoria, 1)
+    if pico is not None:
+        resultado['memoria_pico_mb'] = round(pico, 1)
+    resultado.update(extra or {})
+    return resultado
+
+
+async def varredura(bot):
+    online = 0
+    async for _, leitura in bot.consultar_impressoras(bot.printers.ips(), max_idade=0, respeitar_espera=False):
+        online += leitura.online
+    return {'online': online}
+
+
+def cliente_novo(bot, opcoes):
+    """Cliente SNMP (ou pool de trabalhadores) com a configuração do bot, ainda sem nenhuma consulta feita."""
+    configuracao = {
+        'community': 'public',
+        'port': opcoes.porta,
+        'timeout': opcoes.timeout,
+        'retries': opcoes.retries,
+        'concorrencia': opcoes.concorrencia,
+    }
+    if opcoes.trabalhadores > 0:
+        return PoolSnmp(opcoes.trabalhadores, particao=opcoes.particao, observador=bot.observar_consulta_snmp, **configuracao)
+    return SnmpClient(observador=bot.observar_consulta_snmp, **configuracao)
+
+
+async def partida_fria(bot, cliente):
+    """Varredura com o cliente novo no lugar do cliente do bot; o cliente é fechado ao final."""
+    atributo = 'pool_snmp' if isinstance(cliente, PoolSnmp) else 'snmp_client'
+    anterior = getattr(bot, atributo)
+    setattr(bot, atributo, cliente)
+    try:
+        return await varredura(bot)
+    finally:
+        setattr(bot, atributo, anterior)
+        cliente.fechar()
+
+
+async def contadores(bot):
+    update = UpdateFalso('/contadores agora')
+    await bot.contadores(update, ContextoFalso(['agora']))
+    mensagem = update.message
+    return {'mensagens': mensagem.enviadas, 'edicoes': mensagem.editadas}
+
+
+async def get_snmp_data(bot, amostra):
+    ips = bot.printers.ips()[:amostra]
+
+    def consultar():
+        return sum(bot.get_snmp_data(ip, bot.page_counter_oid) is not None for ip in ips)
+
+    return {'online': await asyncio.to_thread(consultar)}
+
+
+def imprimir(resultado):
+    campos = [f"{resultado['caminho']:<14}", f"{resultado['tempo_s']:>8.2f} s"]
+    campos.append(f"p50 {resultado['p50_ms']} ms, p99 {resultado['p99_ms']} ms" if resultado['p50_ms'] is not None else "sem respostas")
+    campos.append(f"{resultado['consultas']} consultas, {resultado['falhas']} falhas")
+    campos.append(f"CPU {resultado['cpu_s']:.2f} s")
+    if resultado['memoria_mb'] is not None:
+        campos.append(f"RSS {resultado['memoria_mb']} MB (pico {resultado['memoria_pico_mb']} MB)")
+    if 'mensagens' in resultado:
+        campos.append(f"{resultado['mensagens']} mensagens, {resultado['edicoes']} edições")
+    print(' | '.join(campos))
+
+
+async def executar(bot, opcoes):
+    resultados = []
+    for rodada in range(1, opcoes.rodadas + 1):
+        # Na primeira rodada, a varredura também inclui a criação do engine SNMP do bot
+        print(f"Rodada {rodada}{' (aquecimento)' if rodada == 1 else ''}:")
+        # Varreduras passam pelo pool, quando houver; get_snmp_data usa sempre o cliente local
+        varreduras = bot.pool_snmp or bot.snmp_client
+        fria = cliente_novo(bot, opcoes)
+        for nome, cliente, corrotina in (
+            ('partida_fria', fria, partida_fria(bot, fria)),
+            ('varredura', varreduras, varredura(bot)),
+            ('contadores', varreduras, contadores(bot)),
+            ('get_snmp_data', bot.snmp_client, get_snmp_data(bot, opcoes.amostra)),
+        ):
+            resultado = await medir(cliente, nome, corrotina, opcoes.verboso)
+            resultado['rodada'] = rodada
+            imprimir(resultado)
+            resultados.append(resultado)
+    return resultados
+
+
+def argumentos():
+    parser = argparse.ArgumentParser(description="Mede o polling SNMP do bot contra impressoras simuladas.")
+    parser.add_argument('--impressoras', type=int, default=300, help="quantidade de impressoras simuladas")
+    parser.add_argument('--rodadas', type=int, default=3, help="repetições de cada medição")
+    parser.add_argument('--amostra', type=int, default=20, help="impressoras consultadas uma a uma com get_snmp_data")
+    parser.add_argument('--latencia', type=float, default=0.05, help="atraso de resposta dos agentes, em segundos")
+    parser.add_argument('--variacao', type=float, default=0.02, help="atraso extra aleatório dos agentes")
+    parser.add_argument('--perda', type=float, default=0.0, help="fração de pacotes descartados pelos agentes")
+    parser.add_argument('--mortas', type=float, default=0.1, help="fração de impressoras que nunca respondem")
+    parser.add_argument('--semente', type=int, default=1)
+    parser.add_argument('--porta', type=int, default=16100)
+    parser.add_argument('--prefixo', default='127.42')
+    parser.add_argument('--timeout', type=float, default=1.0, help="SNMP_TIMEOUT do bot")
+    parser.add_argument('--retries', type=int, default=1, help="SNMP_RETRIES do bot")
+    parser.add_argument('--concorrencia', type=int, default=32, help="SNMP_CONCORRENCIA do bot")
+    parser.add_argument('--trabalhadores', type=int, default=0, help="POLL_TRABALHADORES do bot (0 = um processo)")
+    parser.add_argument('--particao', default='hash', choices=('hash', 'sub-rede'), help="POLL_PARTICAO do bot")
+    parser.add_argument('--json', help="arquivo para gravar os resultados")
+    parser.add_argument('--verboso', action='store_true', help="mostra as mensagens impressas pelo bot")
+    return parser.parse_args()
+
+
+def main():
+    opcoes = argumentos()
+    diretorio_inicial = os.getcwd()
+    simulador = iniciar_simulador(opcoes)
+    try:
+        with tempfile.TemporaryDirectory(prefix='benchmark-snmp-') as diretorio:
+            bot = preparar_bot(opcoes, diretorio)
+            try:
+                resultados = asyncio.run(executar(bot, opcoes))
+            finally:
+                if bot.pool_snmp is not None:
+                    bot.pool_snmp.fechar()
+                bot.arquivo_impressoras.fechar()
+                bot.snmp_client.fechar()
+                bot.historico.fechar()
+                os.chdir(diretorio_inicial)
+    finally:
+        simulador.terminate()
+        simulador.wait()
+
+    if opcoes.json:
+        with open(opcoes.json, 'w') as arquivo:
+            json.dump({'opcoes': vars(opcoes), 'resultados': resultados}, arquivo, indent=4)
+        print(f"Resultados gravados em {opcoes.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""Descoberta de impressoras em uma sub-rede (/descobrir).
+
+Todos os endereços da rede recebem um único GET SNMPv1 com sysObjectID, sysDescr, sysName,
+hrDeviceType, o número de série e o contador de páginas da Printer-MIB. O SnmpClient do polling
+não serve aqui: cada consulta pelo engine do pysnmp custa milissegundos de CPU na thread do
+dispatcher (alvos no LCD, caches do processamento de mensagens), e com mil endereços as respostas
+expiram na fila. A SondaSnmp usa um socket UDP do asyncio: a mensagem de cada conjunto de OIDs é
+codificada uma única vez, as respostas são associadas pelo IP de origem e pelo request-id, e só
+as respostas recebidas são decodificadas. Com concorrência alta, taxa limitada e timeout curto,
+uma /22 é varrida em segundos, com os endereços sem agente expirando em paralelo.
+
+Os dispositivos que se identificam como impressora são comparados com o cadastro: impressoras
+fora dele viram propostas de /adicionar e, quando o número de série já foi visto (pelo polling ou
+por uma descoberta anterior) em um IP cadastrado que não responde mais com ele, a proposta é de
+/atualizarIP. Uma impressora nova cujo número de série não bate com nenhum conhecido, quando há
+impressoras cadastradas na rede sem resposta e sem série conhecida, é listada como possível
+mudança de IP, com essas impressoras como candidatas, em vez de virar um /adicionar direto.
+"""
+from dataclasses import dataclass, field
+import asyncio
+import ipaddress
+
+from pyasn1.error import PyAsn1Error
+
+SYS_DESCR_OID = '1.3.6.1.2.1.1.1.0'
+SYS_OBJECT_ID_OID = '1.3.6.1.2.1.1.2.0'
+SYS_NAME_OID = '1.3.6.1.2.1.1.5.0'
+HR_DEVICE_TYPE_OID = '1.3.6.1.2.1.25.3.2.1.2.1'  # hrDeviceType do primeiro dispositivo
+SERIE_OID = '1.3.6.1.2.1.43.5.1.1.17.1'  # prtGeneralSerialNumber
+CONTADOR_OID = '1.3.6.1.2.1.43.10.2.1.4.1.1'  # prtMarkerLifeCount
+
+OIDS_DESCOBERTA = (SYS_OBJECT_ID_OID, SYS_DESCR_OID, SYS_NAME_OID, HR_DEVICE_TYPE_OID, SERIE_OID, CONTADOR_OID)
+
+# Código de erro noSuchName do SNMPv1: uma das OIDs do PDU não existe no dispositivo
+NO_SUCH_NAME = 2
+
+# hrDevicePrinter (HOST-RESOURCES-TYPES)
+HR_DEVICE_PRINTER = '1.3.6.1.2.1.25.3.1.5'
+
+# Fabricante pelo número de empresa do sysObjectID (1.3.6.1.4.1.<número>...)
+FABRICANTES = {
+    11: 'HP', 236: 'Samsung', 253: 'Xerox', 367: 'Ricoh', 641: 'Lexmark', 1248: 'Epson',
+    1347: 'Kyocera', 1602: 'Canon', 2435: 'Brother', 2699: 'Printer-MIB', 18334: 'Konica Minolta',
+}
+
+
+class DescobertaError(ValueError):
+    """Rede inválida ou grande demais para a descoberta."""
+
+
+@dataclass(slots=True)
+class DispositivoEncontrado:
+    ip: str
+    sys_object_id: str | None = None
+    descricao: str | None = None
+    nome: str | None = None
+    serie: str | None = None
+    impressora: bool = False
+
+    @property
+    def fabricante(self):
+        prefixo = '1.3.6.1.4.1.'
+        if not self.sys_object_id or not self.sys_object_id.startswith(prefixo):
+            return None
+        numero = self.sys_object_id[len(prefixo):].split('.', 1)[0]
+        return FABRICANTES.get(int(numero)) if numero.isdigit() else None
+
+
+@dataclass
+class Proposta:
+    """Resultado da comparação da varredura com o cadastro."""
+    novas: list = field(default_factory=list)  # DispositivoEncontrado de impressoras fora do cadastro
+    mudancas_ip: list = field(default_factory=list)  # (Impressora, DispositivoEncontrado)
+    # (DispositivoEncontrado, impressoras candidatas): série desconhecida, pode ser uma impressora que mudou de IP
+    possiveis_mudancas: list = field(default_factory=list)
+    sem_resposta: list = field(default_factory=list)  # Impressoras cadastradas na rede que não responderam
+    cadastradas: int = 0  # Impressoras encontradas no IP cadastrado
+
+
+class _LimiteTaxa:
+    """Espaça os envios para no máximo `taxa` por segundo (0 = sem limite)."""
+
+    def __init__(self, taxa):
+        self.intervalo = 1 / taxa if taxa > 0 else 0
+        self._proximo = 0.0
+
+    async def aguardar(self):
+        if not self.intervalo:
+            return
+        agora = asyncio.get_running_loop().time()
+        espera = self._proximo - agora
+        self._proximo = max(agora, self._proximo) + self.intervalo
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+
+class _ProtocoloSonda(asyncio.DatagramProtocol):
+    def __init__(self, sonda):
+        self.sonda = sonda
+
+    def datagram_received(self, data, addr):
+        self.sonda._resposta(data, addr)
+
+
+class SondaSnmp:
+    """GETs SNMPv1 para muitos endereços por um único socket UDP, sem o engine do pysnmp.
+
+    Oferece o mesmo get_many do SnmpClient. Uso:
+
+        async with SondaSnmp(porta=161, timeout=0.5) as sonda:
+            valores = await sonda.get_many('192.168.0.10', [SYS_DESCR_OID])
+    """
+
+    def __init__(self, community='public', porta=161, timeout=0.5, retries=1, concorrencia=256, taxa_maxima=500):
+        self.community = community
+        self.porta = porta
+        self.timeout = timeout
+        self.retries = retries
+        # A codificação do pysnmp só é importada quando uma descoberta começa, não na inicialização
+        from pyasn1.codec.ber import decoder, encoder
+        from pysnmp.proto import api
+        self._modulo = api.protoModules[api.protoVersion1]
+        self._codificar = encoder.encode
+        self._decodificar = decoder.decode
+        self._vagas = asyncio.Semaphore(concorrencia)
+        self._taxa = _LimiteTaxa(taxa_maxima)
+        self._mensagens = {}  # tupla de OIDs -> (request-id, mensagem codificada)
+        self._aguardando = {}  # ip -> (request-id, future)
+        self._transporte = None
+
+    async def __aenter__(self):
+        self._transporte, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: _ProtocoloSonda(self), local_addr=('0.0.0.0', 0))
+        return self
+
+    async def __aexit__(self, *excecao):
+        self.fechar()
+
+    def fechar(self):
+        if self._transporte is not None:
+            self._transporte.close()
+            self._transporte = None
+
+    def _mensagem(self, oids):
+        """Mensagem GET codificada para o conjunto de OIDs (a mesma para todos os endereços)."""
+        chave = tuple(oids)
+        if chave not in self._mensagens:
+            modulo = self._modulo
+            request_id = len(self._mensagens) + 1
+            pdu = modulo.GetRequestPDU()
+            modulo.apiPDU.setDefaults(pdu)
+            modulo.apiPDU.setRequestID(pdu, request_id)
+            modulo.apiPDU.setVarBinds(pdu, [(oid, modulo.Null('')) for oid in oids])
+            mensagem = modulo.Message()
+            modulo.apiMessage.setDefaults(mensagem)
+            modulo.apiMessage.setCommunity(mensagem, self.community)
+            modulo.apiMessage.setPDU(mensagem, pdu)
+            self._mensagens[chave] = (request_id, self._codificar(mensagem))
+        return self._mensagens[chave]
+
+    def _resposta(self, data, addr):
+        esperado = self._aguardando.get(addr[0])
+        if esperado is None or addr[1] != self.porta or esperado[1].done():
+            return
+        modulo = self._modulo
+        try:
+            mensagem, _ = self._decodificar(data, asn1Spec=modulo.Message())
+            pdu = modulo.apiMessage.getPDU(mensagem)
+        except PyAsn1Error:
+            return
+        # Respostas atrasadas de um pedido anterior (com outras OIDs) são descartadas
+        if int(modulo.apiPDU.getRequestID(pdu)) == esperado[0]:
+            esperado[1].set_result(pdu)
+
+    async def _get(self, ip, oids):
+        """Um GET com retries; retorna o PDU de resposta ou None."""
+        request_id, dados = self._mensagem(oids)
+        futuro = asyncio.get_running_loop().create_future()
+        self._aguardando[ip] = (request_id, futuro)
+        try:
+            for _ in range(self.retries + 1):
+                await self._taxa.aguardar()
+                if self._transporte is None:
+                    return None
+                self._transporte.sendto(dados, (ip, self.porta))
+                try:
+                    return await asyncio.wait_for(asyncio.shield(futuro), self.timeout)
+                except asyncio.TimeoutError:
+                    continue
+            return None
+        finally:
+            self._aguardando.pop(ip, None)
+
+    async def get_many(self, ip, oids):
+        """Dicionário oid -> valor (None para OIDs que o dispositivo não possui), ou None sem resposta."""
+        modulo = self._modulo
+        pendentes = list(oids)
+        resultado = {}
+        async with self._vagas:
+            while pendentes:
+                pdu = await self._get(ip, pendentes)
+                if pdu is None:
+                    return resultado or None
+                status = int(modulo.apiPDU.getErrorStatus(pdu))
+                indice = int(modulo.apiPDU.getErrorIndex(pdu))
+                if status == NO_SUCH_NAME and 0 < indice <= len(pendentes):
+                    # No SNMPv1 uma OID inexistente invalida o PDU inteiro: descarta a OID e reenvia o restante
+                    resultado[pendentes.pop(indice - 1)] = None
+                    continue
+                if status:
+                    # Outro erro (genErr, tooBig...): o agente existe, mas as OIDs restantes ficam sem valor
+                    resultado.update(dict.fromkeys(pendentes))
+                    return resultado
+                for oid, (_, valor) in zip(pendentes, modulo.apiPDU.getVarBinds(pdu)):
+                    resultado[oid] = valor
+                return resultado
+        return resultado
+
+
+def expandir_rede(cidr, max_enderecos):
+    """Lista os endereços de host de uma rede no formato CIDR (ex.: 192.168.0.0/22)."""
+    try:
+        rede = ipaddress.IPv4Network(cidr, strict=False)
+    except ValueError:
+        raise DescobertaError(f"Rede inválida: {cidr}. Use o formato 192.168.0.0/24.")
+    if rede.num_addresses > max_enderecos:
+        raise DescobertaError(
+            f"A rede {rede} tem {rede.num_addresses} endereços; o máximo por descoberta é {max_enderecos}.")
+    # Em uma /31 ou /32 todos os endereços são hosts
+    hosts = list(rede.hosts()) or [rede.network_address]
+    return rede, [str(ip) for ip in hosts]
+
+
+def texto_snmp(valor):
+    """Texto de um valor SNMP (do pysnmp ou já convertido para str por um trabalhador), ou None se vazio."""
+    if valor is None:
+        return None
+    if isinstance(valor, str):
+        texto = valor
+    else:
+        try:
+            texto = str(valor)
+        except UnicodeDecodeError:
+            texto = valor.prettyPrint()
+    texto = texto.replace('\x00', '').strip()
+    return texto or None
+
+
+def identificar(ip, valores):
+    """Monta o DispositivoEncontrado a partir das OIDs respondidas por um IP."""
+    dispositivo = DispositivoEncontrado(
+        ip,
+        sys_object_id=texto_snmp(valores.get(SYS_OBJECT_ID_OID)),
+        descricao=texto_snmp(valores.get(SYS_DESCR_OID)),
+        nome=texto_snmp(valores.get(SYS_NAME_OID)),
+        serie=texto_snmp(valores.get(SERIE_OID)),
+    )
+    # Impressora: o primeiro dispositivo é do tipo hrDevicePrinter ou o agente implementa a Printer-MIB
+    dispositivo.impressora = (
+        texto_snmp(valores.get(HR_DEVICE_TYPE_OID)) == HR_DEVICE_PRINTER
+        or valores.get(CONTADOR_OID) is not None
+        or dispositivo.serie is not None
+    )
+    return dispositivo
+
+
+async def varrer(cliente, ips):
+    """Consulta todos os IPs pela sonda (ou um SnmpClient) e entrega (ip, dispositivo ou None) conforme respondem."""
+
+    async def consultar(ip):
+        valores = await cliente.get_many(ip, OIDS_DESCOBERTA)
+        return ip, (identificar(ip, valores) if valores is not None else None)
+
+    for tarefa in asyncio.as_completed([consultar(ip) for ip in ips]):
+        yield await tarefa
+
+
+def _na_rede(ip, rede):
+    try:
+        return ipaddress.IPv4Address(ip) in rede
+    except ValueError:
+        # IP mal formado no printers.json
+        return False
+
+
+def propor(encontrados, registro, series, rede):
+    """Compara as impressoras encontradas com o cadastro.
+
+    `encontrados` é a lista de DispositivoEncontrado que responderam; `series` é o dicionário
+    ip -> número de série visto pelo polling ou em descobertas anteriores (do mais antigo ao mais
+    recente).
+    """
+    respondeu = {dispositivo.ip: dispositivo for dispositivo in encontrados}
+    ip_por_serie = {serie: ip for ip, serie in series.items() if ip in registro}
+    proposta = Proposta()
+    movidas = set()
+    novas = []
+    for dispositivo in sorted(encontrados, key=lambda d: ipaddress.IPv4Address(d.ip)):
+        if not dispositivo.impressora:
+            continue
+        if dispositivo.ip in registro:
+            proposta.cadastradas += 1
+            continue
+        antigo = ip_por_serie.get(dispositivo.serie) if dispositivo.serie else None
+        # Mudança de IP: o número de série já foi visto em um IP cadastrado que não responde mais com ele
+        # (se ainda responde com a mesma série, é outra interface da mesma impressora)
+        if antigo is not None and antigo not in movidas and (
+                antigo not in respondeu or respondeu[antigo].serie != dispositivo.serie):
+            movidas.add(antigo)
+            proposta.mudancas_ip.append((registro.por_ip(antigo), dispositivo))
+        else:
+            novas.append(dispositivo)
+    sem_resposta = [
+        impressora for impressora in registro
+        if impressora.ip not in respondeu and impressora.ip not in movidas
+        and _na_rede(impressora.ip, rede)
+    ]
+    # Sem série conhecida no IP antigo, a mudança não é confirmada: as impressoras sem resposta nessa
+    # situação são candidatas para cada impressora nova (uma com série conhecida teria sido reconhecida)
+    candidatas = [impressora for impressora in sem_resposta if impressora.ip not in series]
+    for dispositivo in novas:
+        if candidatas:
+            proposta.possiveis_mudancas.append((dispositivo, candidatas))
+        else:
+            proposta.novas.append(dispositivo)
+    proposta.sem_resposta = [impressora for impressora in sem_resposta
+                             if not proposta.possiveis_mudancas or impressora.ip in series]
+    return proposta
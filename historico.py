@@ -0,0 +1,339 @@
+"""Histórico persistente das leituras das impressoras.
+
+As leituras feitas pelo polling periódico (e pelos comandos) são gravadas em um banco SQLite
+local, com índices por IP, NID, setor e data, para que os comandos respondam a partir da última
+leitura gravada e para que relatórios consultem intervalos de datas sem varrer a tabela inteira.
+
+Além das leituras, o banco mantém um resumo diário de páginas por impressora, atualizado a cada
+gravação, para que relatórios de meses ou anos somem poucas linhas por impressora em vez de
+percorrer todas as amostras. O resumo é indexado pelo NID, e não pelo IP, para que a contagem
+continue após uma mudança de IP e não misture impressoras diferentes que usaram o mesmo IP; se o
+número de série mudar, a leitura seguinte começa uma nova base de contagem.
+
+O número de série visto em cada IP pelo polling e pela descoberta (/descobrir) também fica no
+banco, para reconhecer uma impressora cadastrada que passou a responder em outro IP.
+"""
+from datetime import datetime
+import json
+import sqlite3
+import threading
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS leituras (
+    id INTEGER PRIMARY KEY,
+    ip TEXT NOT NULL,
+    nid TEXT,
+    setor TEXT,
+    coletada_em REAL NOT NULL,
+    contador INTEGER,
+    contador_mono INTEGER,
+    contador_cor INTEGER,
+    status TEXT,
+    online INTEGER NOT NULL,
+    paginas INTEGER,
+    serie TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_leituras_ip ON leituras (ip, coletada_em);
+CREATE INDEX IF NOT EXISTS idx_leituras_nid ON leituras (nid, coletada_em);
+CREATE INDEX IF NOT EXISTS idx_leituras_setor ON leituras (setor COLLATE NOCASE, coletada_em);
+CREATE INDEX IF NOT EXISTS idx_leituras_data ON leituras (coletada_em);
+
+CREATE TABLE IF NOT EXISTS consumo_diario (
+    nid TEXT NOT NULL,
+    dia TEXT NOT NULL,
+    paginas INTEGER NOT NULL,
+    amostras INTEGER NOT NULL,
+    reinicios INTEGER NOT NULL,
+    primeira REAL NOT NULL,
+    ultima REAL NOT NULL,
+    contador_inicial INTEGER,
+    contador_final INTEGER,
+    PRIMARY KEY (nid, dia)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS numeros_serie (
+    ip TEXT PRIMARY KEY,
+    serie TEXT NOT NULL,
+    visto_em REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_numeros_serie ON numeros_serie (serie);
+"""
+
+COLUNAS = ('ip', 'nid', 'setor', 'coletada_em', 'contador', 'contador_mono', 'contador_cor', 'status', 'online')
+
+ATUALIZAR_CONSUMO = """
+INSERT INTO consumo_diario (nid, dia, paginas, amostras, reinicios, primeira, ultima, contador_inicial, contador_final)
+VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?)
+ON CONFLICT (nid, dia) DO UPDATE SET
+    paginas = paginas + excluded.paginas,
+    amostras = amostras + 1,
+    reinicios = reinicios + excluded.reinicios,
+    ultima = excluded.ultima,
+    contador_final = excluded.contador_final
+"""
+
+# Reconstrói o resumo diário a partir das leituras (bancos criados antes do resumo existir, ou
+# com o resumo indexado por IP). Uma troca de número de série descarta a leitura anterior como base.
+RECONSTRUIR_CONSUMO = """
+INSERT INTO consumo_diario (nid, dia, paginas, amostras, reinicios, primeira, ultima, contador_inicial, contador_final)
+SELECT nid, dia, SUM(paginas), COUNT(*), SUM(reinicio), MIN(coletada_em), MAX(coletada_em),
+       MAX(contador_inicial), MAX(contador_final)
+FROM (
+    SELECT nid, dia, coletada_em, paginas, reinicio,
+           FIRST_VALUE(base) OVER (PARTITION BY nid, dia ORDER BY coletada_em) AS contador_inicial,
+           FIRST_VALUE(contador) OVER (PARTITION BY nid, dia ORDER BY coletada_em DESC) AS contador_final
+    FROM (
+        SELECT nid, coletada_em, contador,
+               date(coletada_em, 'unixepoch', 'localtime') AS dia,
+               COALESCE(anterior, contador) AS base,
+               CASE WHEN anterior IS NULL THEN 0 WHEN contador >= anterior THEN contador - anterior ELSE contador END AS paginas,
+               CASE WHEN anterior IS NOT NULL AND contador < anterior THEN 1 ELSE 0 END AS reinicio
+        FROM (
+            SELECT nid, coletada_em, contador,
+                   CASE WHEN serie <> serie_anterior THEN NULL ELSE anterior END AS anterior
+            FROM (
+                SELECT nid, coletada_em, contador, serie,
+                       LAG(contador) OVER (PARTITION BY nid ORDER BY coletada_em) AS anterior,
+                       LAG(serie) OVER (PARTITION BY nid ORDER BY coletada_em) AS serie_anterior
+                FROM leituras WHERE online = 1 AND contador IS NOT NULL AND nid IS NOT NULL
+            )
+        )
+    )
+)
+GROUP BY nid, dia
+"""
+
+# Páginas impressas por impressora entre dois dias (inclusive), somando o resumo diário.
+# A diferença de cada leitura é contada a partir da leitura anterior, mesmo que ela seja de um dia
+# fora do período, então lacunas no polling não perdem páginas; se o contador diminuir (troca de
+# placa, reinício do contador), considera-se que ele voltou a zero.
+CONSULTA_CONSUMO = """
+WITH alvos(nid) AS (
+    SELECT value FROM json_each(:nids)
+),
+dias AS (
+    SELECT c.*,
+           ROW_NUMBER() OVER (PARTITION BY c.nid ORDER BY c.dia) AS ordem,
+           ROW_NUMBER() OVER (PARTITION BY c.nid ORDER BY c.dia DESC) AS ordem_inversa
+    FROM alvos
+    JOIN consumo_diario c ON c.nid = alvos.nid AND c.dia BETWEEN :inicio AND :fim
+)
+SELECT nid,
+       SUM(amostras) AS amostras,
+       MIN(primeira) AS primeira,
+       MAX(ultima) AS ultima,
+       MAX(CASE WHEN ordem = 1 THEN contador_inicial END) AS contador_inicial,
+       MAX(CASE WHEN ordem_inversa = 1 THEN contador_final END) AS contador_final,
+       SUM(paginas) AS paginas,
+       SUM(reinicios) AS reinicios
+FROM dias
+GROUP BY nid
+"""
+
+
+# Número de série visto em um IP; uma gravação mais antiga que a registrada não a substitui
+GRAVAR_SERIE = """
+INSERT INTO numeros_serie (ip, serie, visto_em) VALUES (?, ?, ?)
+ON CONFLICT (ip) DO UPDATE SET serie = excluded.serie, visto_em = excluded.visto_em
+WHERE excluded.visto_em >= numeros_serie.visto_em
+"""
+
+
+class HistoricoError(ValueError):
+    """Operação recusada pelo histórico."""
+
+
+class HistoricoLeituras:
+    """Acesso ao banco de leituras. Pode ser usado a partir de qualquer thread."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._conexao = sqlite3.connect(caminho, check_same_thread=False)
+        self._conexao.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._ultimos_contadores = {}  # nid -> (coletada_em, contador, serie) da última leitura bem-sucedida
+        with self._lock:
+            # WAL permite consultas enquanto o polling grava; NORMAL evita um fsync por transação
+            self._conexao.execute("PRAGMA journal_mode=WAL")
+            self._conexao.execute("PRAGMA synchronous=NORMAL")
+            self._migrar()
+            self._conexao.executescript(ESQUEMA)
+            self._reconstruir_consumo()
+
+    def _migrar(self):
+        """Atualiza bancos criados por versões anteriores.
+
+        Acrescenta as colunas paginas e serie às leituras e descarta o resumo diário indexado por
+        IP, que é reconstruído por NID a partir das leituras.
+        """
+        colunas = [linha['name'] for linha in self._conexao.execute("PRAGMA table_info(leituras)")]
+        if colunas and 'paginas' not in colunas:
+            self._conexao.execute("ALTER TABLE leituras ADD COLUMN paginas INTEGER")
+        if colunas and 'serie' not in colunas:
+            self._conexao.execute("ALTER TABLE leituras ADD COLUMN serie TEXT")
+        colunas = [linha['name'] for linha in self._conexao.execute("PRAGMA table_info(consumo_diario)")]
+        if 'ip' in colunas:
+            self._conexao.execute("DROP TABLE consumo_diario")
+
+    def _reconstruir_consumo(self):
+        if self._conexao.execute("SELECT 1 FROM consumo_diario LIMIT 1").fetchone():
+            return
+        if not self._conexao.execute("SELECT 1 FROM leituras LIMIT 1").fetchone():
+            return
+        with self._conexao:
+            self._conexao.execute(RECONSTRUIR_CONSUMO)
+
+    def _ultimo_contador(self, nid):
+        if nid not in self._ultimos_contadores:
+            linha = self._conexao.execute(
+                "SELECT coletada_em, contador, serie FROM leituras WHERE nid = ? AND online = 1 AND contador IS NOT NULL"
+                " ORDER BY coletada_em DESC LIMIT 1",
+                (nid,)
+            ).fetchone()
+            self._ultimos_contadores[nid] = tuple(linha) if linha else None
+        return self._ultimos_contadores[nid]
+
+    def registrar(self, leituras):
+        """Grava várias leituras em uma única transação e atualiza o resumo diário.
+
+        Cada leitura é um dicionário (ou sequência na ordem de COLUNAS) com ip, nid, setor,
+        coletada_em (timestamp Unix), contador, contador_mono, contador_cor, status e online. Um
+        dicionário pode trazer também a serie, gravada na leitura e como o número de série visto no IP.
+        """
+        linhas = [tuple(leitura[coluna] for coluna in COLUNAS) + (leitura.get('serie'),) if isinstance(leitura, dict)
+                  else tuple(leitura) + (None,)
+                  for leitura in leituras]
+        if not linhas:
+            return
+        series = [(linha[0], linha[9], linha[3]) for linha in linhas if linha[9]]
+        with self._lock, self._conexao:
+            gravadas = []
+            consumo = []
+            for linha in sorted(linhas, key=lambda linha: linha[3]):
+                nid, coletada_em, contador, online, serie = linha[1], linha[3], linha[4], linha[8], linha[9]
+                paginas = None
+                if online and contador is not None and nid is not None:
+                    anterior = self._ultimo_contador(nid)
+                    # Leituras fora de ordem são gravadas, mas não entram no resumo
+                    if anterior is None or coletada_em > anterior[0]:
+                        # Outra impressora com o mesmo NID (troca do equipamento): a contagem recomeça aqui
+                        if anterior is not None and serie and anterior[2] and serie != anterior[2]:
+                            anterior = None
+                        reiniciou = anterior is not None and contador < anterior[1]
+                        if anterior is not None:
+                            paginas = contador if reiniciou else contador - anterior[1]
+                        consumo.append((
+                            nid, datetime.fromtimestamp(coletada_em).strftime('%Y-%m-%d'), paginas or 0,
+                            int(reiniciou), coletada_em, coletada_em,
+                            anterior[1] if anterior is not None else contador, contador
+                        ))
+                        self._ultimos_contadores[nid] = (coletada_em, contador, serie)
+                gravadas.append(linha[:9] + (paginas, serie))
+            self._conexao.executemany(
+                f"INSERT INTO leituras ({', '.join(COLUNAS)}, paginas, serie) VALUES ({', '.join('?' * (len(COLUNAS) + 2))})",
+                gravadas
+            )
+            self._conexao.executemany(ATUALIZAR_CONSUMO, consumo)
+            self._conexao.executemany(GRAVAR_SERIE, series)
+
+    def _consultar(self, sql, parametros=()):
+        with self._lock:
+            return self._conexao.execute(sql, parametros).fetchall()
+
+    def ultimas_leituras(self, ips, somente_online=True):
+        """Última leitura gravada de cada um dos IPs (apenas as bem-sucedidas, por padrão).
+
+        Uma consulta por IP, servida pelo índice (ip, coletada_em): o custo não cresce com o
+        tamanho da tabela, ao contrário de agrupar todas as leituras por IP.
+        """
+        sql = (f"SELECT * FROM leituras WHERE ip = ?{' AND online = 1' if somente_online else ''}"
+               f" ORDER BY coletada_em DESC LIMIT 1")
+        with self._lock:
+            linhas = (self._conexao.execute(sql, (ip,)).fetchone() for ip in ips)
+            return [linha for linha in linhas if linha is not None]
+
+    def remover_antigas(self, limite, lote=10000):
+        """Apaga as leituras anteriores ao timestamp limite, em lotes, e retorna quantas foram apagadas.
+
+        O resumo diário é mantido, então os relatórios continuam cobrindo o período apagado. Entre
+        um lote e outro o banco fica livre para as gravações do polling.
+        """
+        total = 0
+        while True:
+            with self._lock, self._conexao:
+                apagadas = self._conexao.execute(
+                    "DELETE FROM leituras WHERE id IN (SELECT id FROM leituras WHERE coletada_em < ? LIMIT ?)",
+                    (limite, lote)
+                ).rowcount
+            total += apagadas
+            if apagadas < lote:
+                return total
+
+    def leituras_por_ip(self, ip, inicio, fim):
+        """Leituras de uma impressora entre os timestamps inicio e fim, em ordem cronológica."""
+        return self._consultar(
+            "SELECT * FROM leituras WHERE ip = ? AND coletada_em BETWEEN ? AND ? ORDER BY coletada_em",
+            (ip, inicio, fim)
+        )
+
+    def leituras_por_nid(self, nid, inicio, fim):
+        """Leituras de uma impressora (pelo NID) entre inicio e fim, em ordem cronológica."""
+        return self._consultar(
+            "SELECT * FROM leituras WHERE nid = ? AND coletada_em BETWEEN ? AND ? ORDER BY coletada_em",
+            (nid, inicio, fim)
+        )
+
+    def leituras_por_nids(self, nids, inicio, fim):
+        """Leituras de várias impressoras (pelos NIDs) entre inicio e fim, por NID e data."""
+        return self._consultar(
+            "SELECT l.* FROM json_each(?) alvos JOIN leituras l ON l.nid = alvos.value"
+            " WHERE l.coletada_em BETWEEN ? AND ? ORDER BY l.nid, l.coletada_em",
+            (json.dumps(list(nids)), inicio, fim)
+        )
+
+    def consumo_por_impressora(self, nids, dia_inicial, dia_final):
+        """Páginas impressas por cada NID entre dia_inicial e dia_final (objetos date, inclusive).
+
+        Retorna uma linha por NID com amostras, primeira, ultima, contador_inicial, contador_final,
+        paginas e reinicios. NIDs sem nenhuma leitura no período não aparecem no resultado.
+        """
+        return self._consultar(CONSULTA_CONSUMO, {
+            'nids': json.dumps(list(nids)),
+            'inicio': dia_inicial.isoformat(),
+            'fim': dia_final.isoformat(),
+        })
+
+    def tem_historico(self, nid):
+        """Indica se há leituras ou consumo gravados para o NID."""
+        return bool(self._consultar(
+            "SELECT 1 FROM leituras WHERE nid = ? UNION ALL SELECT 1 FROM consumo_diario WHERE nid = ? LIMIT 1",
+            (nid, nid)
+        ))
+
+    def renomear_nid(self, antigo, novo):
+        """Transfere as leituras e o resumo diário de um NID para o novo NID da mesma impressora.
+
+        Recusa (HistoricoError) um novo NID que já tem histórico, por exemplo de uma impressora
+        removida: juntar os dois misturaria o consumo de impressoras diferentes.
+        """
+        if self.tem_historico(novo):
+            raise HistoricoError(f"O NID {novo} já tem histórico de leituras gravado.")
+        with self._lock, self._conexao:
+            self._conexao.execute("UPDATE leituras SET nid = ? WHERE nid = ?", (novo, antigo))
+            self._conexao.execute("UPDATE consumo_diario SET nid = ? WHERE nid = ?", (novo, antigo))
+            self._ultimos_contadores.pop(antigo, None)
+            self._ultimos_contadores.pop(novo, None)
+
+    def registrar_series(self, series):
+        """Grava o número de série visto em cada IP: lista de (ip, serie, visto_em)."""
+        with self._lock, self._conexao:
+            self._conexao.executemany(GRAVAR_SERIE, series)
+
+    def series(self):
+        """Dicionário ip -> último número de série visto, do mais antigo para o mais recente."""
+        return {linha['ip']: linha['serie']
+                for linha in self._consultar("SELECT ip, serie FROM numeros_serie ORDER BY visto_em")}
+
+    def fechar(self):
+        with self._lock:
+            self._conexao.close()
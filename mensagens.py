@@ -0,0 +1,132 @@
+"""Envio de respostas longas no Telegram sem esbarrar nos limites de tamanho e de frequência.
+
+Resultados de varreduras (como o /contadores) chegam aos poucos; em vez de uma mensagem por
+impressora, as linhas são agrupadas em mensagens de até 4096 caracteres, uma mensagem de
+progresso é editada no lugar e, opcionalmente, o resultado completo segue como um CSV anexo.
+Quando o Telegram responde com RetryAfter (flood control), o envio espera o tempo pedido e tenta
+de novo, em vez de falhar.
+"""
+from datetime import timedelta
+import asyncio
+import csv
+import io
+import time
+
+from telegram.error import BadRequest, RetryAfter
+
+# Tamanho máximo do texto de uma mensagem do Telegram
+LIMITE_MENSAGEM = 4096
+
+
+async def enviar_com_espera(funcao, *args, tentativas=5, **kwargs):
+    """Chama um método da API do Telegram, esperando e repetindo quando ele responde RetryAfter."""
+    for tentativa in range(tentativas):
+        try:
+            return await funcao(*args, **kwargs)
+        except RetryAfter as e:
+            if tentativa == tentativas - 1:
+                raise
+            espera = e.retry_after
+            segundos = espera.total_seconds() if isinstance(espera, timedelta) else espera
+            print(f"Limite de envio do Telegram atingido, aguardando {segundos:.0f} s")
+            await asyncio.sleep(segundos + 0.5)
+
+
+def dividir_texto(linhas, separador="\n", limite=LIMITE_MENSAGEM):
+    """Agrupa as linhas em textos de até `limite` caracteres (linhas maiores são quebradas)."""
+    textos = []
+    atual = ""
+    for linha in linhas:
+        while len(linha) > limite:
+            if atual:
+                textos.append(atual)
+                atual = ""
+            textos.append(linha[:limite])
+            linha = linha[limite:]
+        if atual and len(atual) + len(separador) + len(linha) > limite:
+            textos.append(atual)
+            atual = ""
+        atual = f"{atual}{separador}{linha}" if atual else linha
+    if atual:
+        textos.append(atual)
+    return textos
+
+
+async def responder_em_lotes(message, linhas, separador="\n"):
+    """Responde com as linhas agrupadas no menor número possível de mensagens."""
+    for texto in dividir_texto(linhas, separador):
+        await enviar_com_espera(message.reply_text, texto)
+
+
+class RespostaEmLotes:
+    """Resposta de um comando cujo resultado chega aos poucos.
+
+    As linhas acrescentadas são enviadas em mensagens de até 4096 caracteres assim que uma
+    mensagem enche; a mensagem de progresso é editada no máximo a cada `intervalo_progresso`
+    segundos; entre duas mensagens novas há pelo menos `intervalo_envio` segundos, para ficar
+    abaixo do limite de frequência do Telegram.
+    """
+
+    def __init__(self, message, separador="\n", intervalo_progresso=3.0, intervalo_envio=1.0):
+        self.message = message
+        self.separador = separador
+        self.intervalo_progresso = intervalo_progresso
+        self.intervalo_envio = intervalo_envio
+        self._progresso = None  # Mensagem de progresso, editada no lugar
+        self._texto_progresso = None
+        self._ultimo_progresso = 0.0
+        self._ultimo_envio = 0.0
+        self._atual = ""
+
+    async def iniciar(self, texto):
+        """Envia a mensagem de progresso."""
+        self._progresso = await enviar_com_espera(self.message.reply_text, texto)
+        self._texto_progresso = texto
+        self._ultimo_progresso = self._ultimo_envio = time.monotonic()
+
+    async def progresso(self, texto, forcar=False):
+        """Atualiza a mensagem de progresso (no máximo a cada intervalo_progresso segundos)."""
+        if self._progresso is None or texto == self._texto_progresso:
+            return
+        if not forcar and time.monotonic() - self._ultimo_progresso < self.intervalo_progresso:
+            return
+        self._texto_progresso = texto
+        self._ultimo_progresso = time.monotonic()
+        try:
+            await enviar_com_espera(self._progresso.edit_text, texto)
+        except BadRequest as e:
+            # Editar com o mesmo texto não é erro para quem acompanha a resposta
+            if 'not modified' not in str(e).lower():
+                raise
+
+    async def adicionar(self, linha):
+        """Acrescenta uma linha ao resultado, enviando a mensagem atual se ela ficar cheia."""
+        for texto in dividir_texto([linha]):
+            if self._atual and len(self._atual) + len(self.separador) + len(texto) > LIMITE_MENSAGEM:
+                await self._enviar_atual()
+            self._atual = f"{self._atual}{self.separador}{texto}" if self._atual else texto
+
+    async def _enviar_atual(self):
+        espera = self.intervalo_envio - (time.monotonic() - self._ultimo_envio)
+        if espera > 0:
+            await asyncio.sleep(espera)
+        texto, self._atual = self._atual, ""
+        await enviar_com_espera(self.message.reply_text, texto)
+        self._ultimo_envio = time.monotonic()
+
+    async def concluir(self, texto=None):
+        """Envia as linhas restantes e, se informado, o texto final da mensagem de progresso."""
+        if self._atual:
+            await self._enviar_atual()
+        if texto is not None:
+            await self.progresso(texto, forcar=True)
+
+    async def anexar_csv(self, linhas, colunas, nome_arquivo):
+        """Envia as linhas (dicionários) como um CSV separado por ';'."""
+        saida = io.StringIO()
+        escritor = csv.DictWriter(saida, fieldnames=colunas, delimiter=';', extrasaction='ignore')
+        escritor.writeheader()
+        escritor.writerows(linhas)
+        # BOM para o Excel reconhecer a acentuação
+        await enviar_com_espera(self.message.reply_document, document=saida.getvalue().encode('utf-8-sig'),
+                                filename=nome_arquivo)
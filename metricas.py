@@ -0,0 +1,235 @@
+"""Métricas do bot no formato de texto do Prometheus, servidas em http://<host>:<porta>/metrics.
+
+Sem dependências externas: contadores, medidores e histogramas simples, protegidos por um lock
+porque são atualizados tanto pelo event loop quanto pela thread do dispatcher SNMP. O mesmo
+servidor HTTP atende /perfil, que liga o cProfile durante a próxima varredura de impressoras.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cProfile
+import io
+import threading
+import time
+
+# Limites padrão dos histogramas de duração, em segundos
+LIMITES_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatar_rotulos(nomes, valores, extra=()):
+    pares = [f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)]
+    pares += [f'{nome}="{_escapar(valor)}"' for nome, valor in extra]
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _formatar_numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, registro, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._lock = registro.lock
+        self._series = {}
+        registro.metricas.append(self)
+
+    def _chave(self, rotulos):
+        return tuple(rotulos.get(nome, '') for nome in self.rotulos)
+
+    def remover(self, **rotulos):
+        """Descarta a série dos rótulos informados (por exemplo, de uma impressora removida)."""
+        filtro = {self.rotulos.index(nome): valor for nome, valor in rotulos.items()}
+        with self._lock:
+            for chave in [chave for chave in self._series if all(chave[i] == v for i, v in filtro.items())]:
+                del self._series[chave]
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+        with self._lock:
+            series = list(self._series.items())
+        for chave, valor in series:
+            linhas.extend(self._linhas(chave, valor))
+        return linhas
+
+
+class Contador(_Metrica):
+    tipo = 'counter'
+
+    def inc(self, valor=1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._series[chave] = self._series.get(chave, 0) + valor
+
+    def _linhas(self, chave, valor):
+        return [f"{self.nome}{_formatar_rotulos(self.rotulos, chave)} {_formatar_numero(valor)}"]
+
+
+class Medidor(_Metrica):
+    tipo = 'gauge'
+
+    def definir(self, valor, **rotulos):
+        with self._lock:
+            self._series[self._chave(rotulos)] = valor
+
+    def _linhas(self, chave, valor):
+        return [f"{self.nome}{_formatar_rotulos(self.rotulos, chave)} {_formatar_numero(valor)}"]
+
+
+class Histograma(_Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, registro, nome, ajuda, rotulos=(), limites=LIMITES_PADRAO):
+        super().__init__(registro, nome, ajuda, rotulos)
+        self.limites = tuple(sorted(limites))
+
+    def observar(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                # Contagem por faixa (não acumulada), soma e total
+                serie = self._series[chave] = [[0] * len(self.limites), 0.0, 0]
+            for posicao, limite in enumerate(self.limites):
+                if valor <= limite:
+                    serie[0][posicao] += 1
+                    break
+            serie[1] += valor
+            serie[2] += 1
+
+    def _linhas(self, chave, serie):
+        faixas, soma, total = serie
+        linhas = []
+        acumulado = 0
+        for limite, quantidade in zip(self.limites, faixas):
+            acumulado += quantidade
+            linhas.append(f"{self.nome}_bucket{_formatar_rotulos(self.rotulos, chave, [('le', _formatar_numero(float(limite)))])} {acumulado}")
+        linhas.append(f"{self.nome}_bucket{_formatar_rotulos(self.rotulos, chave, [('le', '+Inf')])} {total}")
+        linhas.append(f"{self.nome}_sum{_formatar_rotulos(self.rotulos, chave)} {_formatar_numero(soma)}")
+        linhas.append(f"{self.nome}_count{_formatar_rotulos(self.rotulos, chave)} {total}")
+        return linhas
+
+    def medir(self, **rotulos):
+        """Context manager que observa o tempo decorrido dentro do bloco."""
+        return _Cronometro(self, rotulos)
+
+
+class _Cronometro:
+    def __init__(self, histograma, rotulos):
+        self.histograma = histograma
+        self.rotulos = rotulos
+        self.inicio = None
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *excecao):
+        self.histograma.observar(time.perf_counter() - self.inicio, **self.rotulos)
+        return False
+
+
+class RegistroMetricas:
+    """Conjunto de métricas exportadas juntas."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metricas = []
+
+    def contador(self, nome, ajuda, rotulos=()):
+        return Contador(self, nome, ajuda, rotulos)
+
+    def medidor(self, nome, ajuda, rotulos=()):
+        return Medidor(self, nome, ajuda, rotulos)
+
+    def histograma(self, nome, ajuda, rotulos=(), limites=LIMITES_PADRAO):
+        return Histograma(self, nome, ajuda, rotulos, limites)
+
+    def exportar(self):
+        """Texto no formato de exposição do Prometheus (versão 0.0.4)."""
+        linhas = []
+        for metrica in self.metricas:
+            linhas.extend(metrica.exportar())
+        return '\n'.join(linhas) + '\n'
+
+
+class PerfilVarredura:
+    """Liga o cProfile durante uma única varredura, quando solicitado.
+
+    O perfil cobre a thread do event loop (handlers, montagem das leituras, histórico); o
+    dispatcher SNMP roda em outra thread e aparece apenas como espera. O resultado é gravado em
+    um arquivo .prof (para snakeviz, pstats etc.) e as funções mais caras são impressas no log.
+    """
+
+    def __init__(self, prefixo='perfil_varredura'):
+        self.prefixo = prefixo
+        self._armado = False
+        self._perfil = None
+
+    def armar(self):
+        self._armado = True
+
+    def iniciar(self):
+        """Começa o perfil se ele foi pedido; retorna True quando esta varredura será perfilada."""
+        if not self._armado or self._perfil is not None:
+            return False
+        self._armado = False
+        self._perfil = cProfile.Profile()
+        self._perfil.enable()
+        return True
+
+    def concluir(self):
+        perfil, self._perfil = self._perfil, None
+        if perfil is None:
+            return None
+        perfil.disable()
+        return gravar_perfil(perfil, self.prefixo, 'Perfil da varredura')
+
+
+def gravar_perfil(perfil, prefixo, titulo):
+    """Grava o perfil em <prefixo>_<data>.prof e imprime as funções mais caras; retorna o arquivo."""
+    import pstats
+    arquivo = f"{prefixo}_{time.strftime('%Y%m%d_%H%M%S')}.prof"
+    perfil.dump_stats(arquivo)
+    resumo = io.StringIO()
+    pstats.Stats(perfil, stream=resumo).sort_stats('cumulative').print_stats(20)
+    print(f"{titulo} gravado em {arquivo}\n{resumo.getvalue()}")
+    return arquivo
+
+
+def iniciar_servidor(registro, porta, host='127.0.0.1', perfil=None):
+    """Serve /metrics (e /perfil, se informado) em uma thread própria. Retorna o servidor."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] == '/metrics':
+                corpo = registro.exportar().encode()
+                tipo = 'text/plain; version=0.0.4; charset=utf-8'
+            elif self.path.split('?')[0] == '/perfil' and perfil is not None:
+                perfil.armar()
+                corpo = 'O cProfile será ligado durante a próxima varredura.\n'.encode()
+                tipo = 'text/plain; charset=utf-8'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', tipo)
+            self.send_header('Content-Length', str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, formato, *args):
+            # Sem uma linha de log a cada coleta do Prometheus
+            pass
+
+    servidor = ThreadingHTTPServer((host, porta), Handler)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name='metricas-http', daemon=True).start()
+    return servidor
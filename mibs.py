@@ -0,0 +1,101 @@
+"""MIBs do engine SNMP pré-compiladas, para a primeira consulta não compilar código-fonte.
+
+O engine do pysnmp carrega os módulos de MIB do próprio protocolo (SNMPv2-MIB, SNMP-TARGET-MIB
+etc.) executando os arquivos .py de pysnmp/smi/mibs, e recompila cada um a cada execução, porque
+o leitor de .pyc do pysnmp 4 não reconhece o formato atual do Python. Este módulo guarda o
+bytecode apenas dos módulos que o engine usa em um único arquivo (marshal), gerado na primeira
+execução ou no build do PyInstaller, e o coloca na frente das fontes de MIB do engine; qualquer
+outro módulo continua vindo das fontes normais.
+
+O bot não carrega nenhuma MIB de impressora: as OIDs da Printer-MIB e da Host-Resources-MIB que
+ele lê já estão numéricas no código, e o compilador de MIBs (pysmi) nunca é usado.
+
+Uso: python mibs.py  (gera o arquivo de novo, por exemplo depois de atualizar o pysnmp)
+"""
+import importlib.util
+import marshal
+import os
+import sys
+
+# Módulos carregados pelo engine de um gerador de comandos SNMPv1/v2c
+MODULOS = (
+    'ASN1', 'ASN1-ENUMERATION', 'ASN1-REFINEMENT', 'SNMPv2-SMI', 'SNMPv2-CONF', 'SNMPv2-TC',
+    'SNMPv2-TM', 'SNMPv2-MIB', 'SNMP-FRAMEWORK-MIB', 'SNMP-MPD-MIB', 'SNMP-TARGET-MIB',
+    'SNMP-COMMUNITY-MIB', 'SNMP-USER-BASED-SM-MIB', 'PYSNMP-MIB', 'PYSNMP-SOURCE-MIB',
+    '__SNMP-FRAMEWORK-MIB', '__SNMPv2-MIB',
+)
+
+# No executável do PyInstaller o arquivo vem junto, na pasta extraída do pacote
+ARQUIVO_PADRAO = os.path.join(getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__))), 'mibs_engine.bin')
+
+
+def _assinatura():
+    """O bytecode só serve para a mesma versão do Python e do pysnmp."""
+    import pysnmp
+    return importlib.util.MAGIC_NUMBER + pysnmp.__version__.encode()
+
+
+def fontes():
+    """Caminho do arquivo .py de cada módulo de MODULOS, dentro do pysnmp instalado."""
+    import pysnmp.smi.mibs
+    pasta = os.path.dirname(pysnmp.smi.mibs.__file__)
+    return {nome: os.path.join(pasta, 'instances' if nome.startswith('__') else '', nome + '.py') for nome in MODULOS}
+
+
+def compilar(arquivo=ARQUIVO_PADRAO):
+    """Compila os módulos do engine e grava o arquivo; retorna o dicionário nome -> código."""
+    modulos = {}
+    for nome, caminho in fontes().items():
+        with open(caminho, encoding='utf-8') as f:
+            modulos[nome] = compile(f.read(), caminho, 'exec')
+    temporario = f"{arquivo}.tmp"
+    with open(temporario, 'wb') as f:
+        f.write(marshal.dumps((_assinatura(), modulos)))
+    os.replace(temporario, arquivo)
+    return modulos
+
+
+def carregar(arquivo=ARQUIVO_PADRAO):
+    """Lê os módulos pré-compilados, gerando o arquivo se ele não existir ou estiver desatualizado.
+
+    Retorna None se não for possível (por exemplo, pasta sem permissão de escrita); nesse caso o
+    engine simplesmente compila as MIBs como de costume.
+    """
+    try:
+        with open(arquivo, 'rb') as f:
+            assinatura, modulos = marshal.loads(f.read())
+        if assinatura == _assinatura():
+            return modulos
+    except (OSError, ValueError, EOFError, TypeError):
+        pass
+    try:
+        return compilar(arquivo)
+    except OSError as e:
+        print(f"Não foi possível gravar as MIBs pré-compiladas em {arquivo}: {e}")
+        return None
+
+
+def criar_engine(arquivo=ARQUIVO_PADRAO):
+    """SnmpEngine cujo MibBuilder procura primeiro os módulos pré-compilados."""
+    from pysnmp.entity.engine import SnmpEngine
+    from pysnmp.proto.rfc3412 import MsgAndPduDispatcher
+    from pysnmp.smi import builder, instrum
+
+    class FontePrecompilada(builder.DirMibSource):
+        def _listdir(self):
+            return tuple(modulos)
+
+        def read(self, f):
+            if f not in modulos:
+                raise IOError(f"{f} não está entre as MIBs pré-compiladas")
+            return modulos[f], '.py'
+
+    mib_builder = builder.MibBuilder()
+    modulos = carregar(arquivo)
+    if modulos:
+        mib_builder.setMibSources(FontePrecompilada(arquivo), *mib_builder.getMibSources())
+    return SnmpEngine(msgAndPduDsp=MsgAndPduDispatcher(instrum.MibInstrumController(mib_builder)))
+
+
+if __name__ == '__main__':
+    print(f"{len(compilar())} módulos de MIB pré-compilados em {ARQUIVO_PADRAO}")
@@ -0,0 +1,308 @@
+"""Cadastro das impressoras (printers.json) com índices por IP, NID e setor.
+
+O arquivo continua no formato {"<IP>": ["<SETOR>", "<NID>"]}; em memória cada impressora vira um
+registro compacto, e o cadastro mantém índices atualizados a cada alteração, para que buscas por
+NID ou por parte do nome do setor não precisem percorrer todas as impressoras.
+
+A gravação do arquivo fica em ArquivoImpressoras: alterações em sequência são agrupadas em uma
+única gravação, feita fora do event loop em um arquivo temporário que substitui o original de uma
+vez, para que uma falha no meio da escrita nunca deixe o printers.json truncado.
+"""
+from collections import defaultdict
+from dataclasses import dataclass
+import asyncio
+import json
+import os
+import re
+import stat
+import tempfile
+import threading
+import unicodedata
+
+
+class RegistroError(ValueError):
+    """Operação inválida no cadastro (IP ou NID duplicado, impressora inexistente)."""
+
+
+@dataclass(slots=True)
+class Impressora:
+    ip: str
+    setor: str
+    nid: str
+
+
+def normalizar(texto):
+    """Minúsculas e sem acentos, para comparar nomes de setor."""
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(caractere for caractere in texto if not unicodedata.combining(caractere))
+
+
+def tokens(texto):
+    """Palavras normalizadas de um nome de setor."""
+    return [token for token in re.split(r'\W+', normalizar(texto)) if token]
+
+
+class PrinterRegistry:
+    """Impressoras cadastradas, indexadas por IP, NID e palavras do setor."""
+
+    def __init__(self):
+        self._por_ip = {}
+        self._por_nid = {}
+        self._por_token = defaultdict(set)  # palavra normalizada do setor -> IPs
+
+    @classmethod
+    def de_dicionario(cls, dados):
+        """Cria o cadastro a partir do conteúdo de printers.json.
+
+        Entradas com NID repetido são ignoradas (com aviso), mantendo a primeira.
+        """
+        registro = cls()
+        for ip, (setor, nid) in dados.items():
+            try:
+                registro.adicionar(ip, setor, str(nid))
+            except RegistroError as e:
+                print(f"printers.json: {e} Entrada {ip} ignorada.")
+        return registro
+
+    def para_dicionario(self):
+        """Conteúdo no formato de printers.json."""
+        return {impressora.ip: [impressora.setor, impressora.nid] for impressora in self._por_ip.values()}
+
+    def __len__(self):
+        return len(self._por_ip)
+
+    def __iter__(self):
+        return iter(list(self._por_ip.values()))
+
+    def __contains__(self, ip):
+        return ip in self._por_ip
+
+    def ips(self):
+        """Lista (cópia) dos IPs cadastrados."""
+        return list(self._por_ip)
+
+    def por_ip(self, ip):
+        return self._por_ip.get(ip)
+
+    def por_nid(self, nid):
+        return self._por_nid.get(nid)
+
+    def _indexar_setor(self, impressora):
+        for token in tokens(impressora.setor):
+            self._por_token[token].add(impressora.ip)
+
+    def _desindexar_setor(self, impressora):
+        for token in tokens(impressora.setor):
+            ips = self._por_token.get(token)
+            if ips is not None:
+                ips.discard(impressora.ip)
+                if not ips:
+                    del self._por_token[token]
+
+    def adicionar(self, ip, setor, nid):
+        """Cadastra uma impressora; IP e NID precisam ser únicos."""
+        if ip in self._por_ip:
+            raise RegistroError(f"Já existe uma impressora cadastrada com o IP {ip}.")
+        if nid in self._por_nid:
+            raise RegistroError(f"Já existe uma impressora cadastrada com o NID {nid}.")
+        impressora = Impressora(ip, setor, nid)
+        self._por_ip[ip] = impressora
+        self._por_nid[nid] = impressora
+        self._indexar_setor(impressora)
+        return impressora
+
+    def remover(self, ip):
+        """Remove a impressora do IP e retorna o registro removido."""
+        impressora = self._por_ip.pop(ip, None)
+        if impressora is None:
+            raise RegistroError(f"Impressora com IP {ip} não encontrada.")
+        del self._por_nid[impressora.nid]
+        self._desindexar_setor(impressora)
+        return impressora
+
+    def alterar_nid(self, impressora, novo_nid):
+        if novo_nid != impressora.nid and novo_nid in self._por_nid:
+            raise RegistroError(f"Já existe uma impressora cadastrada com o NID {novo_nid}.")
+        del self._por_nid[impressora.nid]
+        impressora.nid = novo_nid
+        self._por_nid[novo_nid] = impressora
+
+    def alterar_ip(self, impressora, novo_ip):
+        if novo_ip != impressora.ip and novo_ip in self._por_ip:
+            raise RegistroError(f"Já existe uma impressora cadastrada com o IP {novo_ip}.")
+        self._desindexar_setor(impressora)
+        del self._por_ip[impressora.ip]
+        impressora.ip = novo_ip
+        self._por_ip[novo_ip] = impressora
+        self._indexar_setor(impressora)
+
+    def alterar_setor(self, impressora, novo_setor):
+        self._desindexar_setor(impressora)
+        impressora.setor = novo_setor
+        self._indexar_setor(impressora)
+
+    def buscar_setor(self, termo):
+        """Impressoras cujo setor contém o termo (sem diferenciar maiúsculas e acentos).
+
+        Usa o índice de palavras para chegar aos candidatos: a maior palavra do termo precisa
+        estar dentro de alguma palavra do setor, e só esses candidatos são comparados por inteiro.
+        """
+        termo_normalizado = normalizar(termo).strip()
+        palavras = tokens(termo)
+        if not palavras:
+            return []
+        maior = max(palavras, key=len)
+        candidatos = set()
+        # Cópia, pois o relatório faz a busca fora do event loop enquanto comandos alteram o cadastro
+        for token, ips in list(self._por_token.items()):
+            if maior in token:
+                candidatos.update(ips)
+        impressoras = (self._por_ip.get(ip) for ip in candidatos)
+        resultado = [impressora for impressora in impressoras
+                     if impressora is not None and termo_normalizado in normalizar(impressora.setor)]
+        return sorted(resultado, key=lambda impressora: (normalizar(impressora.setor), impressora.nid))
+
+
+class ArquivoImpressoras:
+    """Leitura e gravação do printers.json.
+
+    agendar() guarda o conteúdo mais recente e grava depois de `atraso` segundos, de modo que
+    vários comandos seguidos resultam em uma única escrita. Com `diario=True`, as alterações são
+    acrescentadas a um diário (<arquivo>.diario, uma linha JSON por IP alterado) e o arquivo
+    completo só é reescrito quando o diário passa de `max_diario` linhas ou no encerramento.
+    """
+
+    def __init__(self, caminho, atraso=2.0, diario=False, max_diario=500):
+        self.caminho = caminho
+        self.caminho_diario = caminho + '.diario'
+        self.atraso = atraso
+        self.diario = diario
+        self.max_diario = max_diario
+        self._lock = threading.Lock()  # Uma gravação por vez
+        self._lock_pendente = threading.Lock()  # Protege _pendente, sem esperar a gravação em andamento
+        self._pendente = None  # Conteúdo ainda não gravado
+        self._gravado = {}  # Conteúdo que já está no disco (arquivo + diário)
+        self._linhas_diario = 0
+        self._agendamento = None
+        self._tarefa = None
+
+    def carregar(self):
+        """Lê o printers.json e aplica as alterações do diário, se houver."""
+        with open(self.caminho, 'r') as file:
+            dados = json.load(file)
+        if os.path.exists(self.caminho_diario):
+            validos = 0
+            with open(self.caminho_diario, 'rb') as file:
+                for linha in file:
+                    try:
+                        alteracao = json.loads(linha) if linha.endswith(b'\n') else None
+                    except ValueError:
+                        alteracao = None
+                    if alteracao is None:
+                        break
+                    if alteracao['impressora'] is None:
+                        dados.pop(alteracao['ip'], None)
+                    else:
+                        dados[alteracao['ip']] = alteracao['impressora']
+                    self._linhas_diario += 1
+                    validos += len(linha)
+            if validos < os.path.getsize(self.caminho_diario):
+                # Última linha incompleta (encerramento no meio da escrita): descarta antes de acrescentar outras
+                os.truncate(self.caminho_diario, validos)
+        self._gravado = {ip: list(valor) for ip, valor in dados.items()}
+        return dados
+
+    def agendar(self, dados):
+        """Agenda a gravação de `dados` (conteúdo completo do cadastro).
+
+        Deve ser chamado no event loop; fora dele a gravação é feita na hora.
+        """
+        with self._lock_pendente:
+            self._pendente = dados
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.gravar()
+            return
+        if self._agendamento is None:
+            self._agendamento = loop.call_later(self.atraso, self._disparar)
+
+    def _disparar(self):
+        self._agendamento = None
+        if self._tarefa is not None and not self._tarefa.done():
+            # Ainda gravando a alteração anterior: tenta de novo mais tarde
+            self._agendamento = asyncio.get_running_loop().call_later(self.atraso, self._disparar)
+            return
+        self._tarefa = asyncio.create_task(asyncio.to_thread(self.gravar))
+
+    def gravar(self, compactar=False):
+        """Grava o conteúdo pendente (no diário ou no arquivo completo). Bloqueante."""
+        with self._lock:
+            with self._lock_pendente:
+                dados, self._pendente = self._pendente, None
+            if dados is None and not (compactar and self._linhas_diario):
+                return
+            dados = dados if dados is not None else self._gravado
+            try:
+                if self.diario and not compactar and self._linhas_diario < self.max_diario:
+                    self._acrescentar_diario(dados)
+                else:
+                    self._escrever_completo(dados)
+                self._gravado = {ip: list(valor) for ip, valor in dados.items()}
+            except OSError as e:
+                print(f"Erro ao gravar {self.caminho}: {e}")
+                # Mantém o conteúdo para a próxima tentativa, se nada mais novo chegou
+                with self._lock_pendente:
+                    if self._pendente is None:
+                        self._pendente = dados
+
+    def _acrescentar_diario(self, dados):
+        alterados = [ip for ip, valor in dados.items() if self._gravado.get(ip) != list(valor)]
+        alterados += [ip for ip in self._gravado if ip not in dados]
+        if not alterados:
+            return
+        linhas = ''.join(json.dumps({'ip': ip, 'impressora': dados.get(ip)}) + '\n' for ip in alterados)
+        with open(self.caminho_diario, 'a') as file:
+            file.write(linhas)
+            file.flush()
+            os.fsync(file.fileno())
+        self._linhas_diario += len(alterados)
+
+    def _escrever_completo(self, dados):
+        diretorio = os.path.dirname(os.path.abspath(self.caminho))
+        descritor, temporario = tempfile.mkstemp(prefix='.printers-', suffix='.tmp', dir=diretorio)
+        try:
+            with os.fdopen(descritor, 'w') as file:
+                json.dump(dados, file, indent=4)
+                file.flush()
+                os.fsync(file.fileno())
+            # O mkstemp cria o arquivo só com leitura e escrita do dono (0600); mantém as permissões do atual
+            try:
+                os.chmod(temporario, stat.S_IMODE(os.stat(self.caminho).st_mode))
+            except FileNotFoundError:
+                pass
+            os.replace(temporario, self.caminho)
+        except BaseException:
+            try:
+                os.unlink(temporario)
+            except OSError:
+                pass
+            raise
+        # O arquivo completo já inclui o que estava no diário
+        if self._linhas_diario:
+            os.remove(self.caminho_diario)
+            self._linhas_diario = 0
+
+    def fechar(self):
+        """Grava o que estiver pendente (incorporando o diário ao arquivo) e sincroniza o diretório."""
+        if self._agendamento is not None:
+            self._agendamento.cancel()
+            self._agendamento = None
+        self.gravar(compactar=True)
+        if hasattr(os, 'O_DIRECTORY'):
+            # Garante que a troca do arquivo (os.replace) também chegou ao disco
+            descritor = os.open(os.path.dirname(os.path.abspath(self.caminho)), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(descritor)
+            finally:
+                os.close(descritor)
@@ -0,0 +1,89 @@
+"""Estado de saúde das impressoras: falhas seguidas, último sucesso e último erro.
+
+Substitui a antiga lista de impressoras com erro, que crescia a cada varredura e repetia IPs.
+Cada IP tem um único registro, o total de registros é limitado, e impressoras que falham várias
+vezes seguidas entram em espera com backoff exponencial: o polling deixa de consultá-las até a
+próxima tentativa, para que impressoras desligadas não consumam o timeout de toda varredura.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+import time
+
+# Tamanho máximo guardado do texto de erro
+MAX_MOTIVO = 200
+
+# Maior expoente do backoff; a espera já é limitada por `maximo` bem antes disso
+MAX_EXPOENTE = 32
+
+
+@dataclass(slots=True)
+class EstadoImpressora:
+    falhas_consecutivas: int = 0
+    ultimo_sucesso: float | None = None
+    ultima_falha: float | None = None
+    ultimo_erro: str | None = None
+    proxima_tentativa: float = 0.0  # Timestamp a partir do qual a impressora volta a ser consultada
+
+    @property
+    def em_espera(self):
+        return time.time() < self.proxima_tentativa
+
+
+class SaudeImpressoras:
+    """Registro de falhas por IP, com backoff exponencial para impressoras fora do ar.
+
+    A partir de `limiar` falhas seguidas, a próxima tentativa é adiada por
+    base * 2^(falhas - limiar) segundos, até o máximo de `maximo` segundos. Um sucesso zera a
+    contagem. Ao passar de `max_itens` IPs, o registro atualizado há mais tempo é descartado.
+    """
+
+    def __init__(self, base=300.0, maximo=3600.0, limiar=2, max_itens=5000):
+        self.base = base
+        self.maximo = maximo
+        self.limiar = limiar
+        self.max_itens = max_itens
+        self._estados = OrderedDict()
+
+    def _estado(self, ip):
+        estado = self._estados.get(ip)
+        if estado is None:
+            estado = self._estados[ip] = EstadoImpressora()
+            while len(self._estados) > self.max_itens:
+                self._estados.popitem(last=False)
+        else:
+            self._estados.move_to_end(ip)
+        return estado
+
+    def registrar_sucesso(self, ip):
+        estado = self._estado(ip)
+        estado.falhas_consecutivas = 0
+        estado.ultimo_sucesso = time.time()
+        estado.proxima_tentativa = 0.0
+
+    def registrar_falha(self, ip, motivo):
+        estado = self._estado(ip)
+        agora = time.time()
+        estado.falhas_consecutivas += 1
+        estado.ultima_falha = agora
+        estado.ultimo_erro = str(motivo)[:MAX_MOTIVO]
+        if estado.falhas_consecutivas >= self.limiar:
+            # Sem o limite, 2 ** n com n acima de ~1024 não cabe em um float (OverflowError)
+            expoente = min(estado.falhas_consecutivas - self.limiar, MAX_EXPOENTE)
+            espera = min(self.base * 2 ** expoente, self.maximo)
+            estado.proxima_tentativa = agora + espera
+
+    def disponivel(self, ip):
+        """Indica se a impressora pode ser consultada agora (não está em espera)."""
+        estado = self._estados.get(ip)
+        return estado is None or not estado.em_espera
+
+    def estado(self, ip):
+        return self._estados.get(ip)
+
+    def com_falha(self):
+        """Lista de (ip, estado) das impressoras cuja última consulta falhou, das que falham há mais tempo."""
+        falhas = [(ip, estado) for ip, estado in self._estados.items() if estado.falhas_consecutivas > 0]
+        return sorted(falhas, key=lambda item: -item[1].falhas_consecutivas)
+
+    def remover(self, ip):
+        self._estados.pop(ip, None)
@@ -0,0 +1,231 @@
+"""Frota de agentes SNMP simulados para testar o bot sem a rede de impressoras.
+
+Cada agente escuta em um endereço de loopback próprio (127.42.0.1, 127.42.0.2, ...) na mesma
+porta UDP e responde GET, GETNEXT (SNMPv1 e v2c) e GETBULK (v2c) com a identificação (sysObjectID,
+hrDeviceType, número de série), o contador de páginas, o status e a tabela de suprimentos de uma
+impressora. Latência, perda de pacotes e impressoras desligadas são configuráveis.
+
+Uso:
+    python simulador_snmp.py --impressoras 300 --latencia 0.05 --perda 0.01 --mortas 0.1
+
+Os endereços 127.x.x.x além de 127.0.0.1 funcionam sem configuração no Linux; em outros
+sistemas pode ser preciso adicioná-los à interface de loopback. Para centenas de agentes,
+verifique também o limite de arquivos abertos (ulimit -n).
+"""
+from pyasn1.codec.ber import decoder, encoder
+from pysnmp.proto import api
+from pysnmp.proto.rfc1902 import ObjectName
+import argparse
+import asyncio
+import bisect
+import random
+import time
+
+# OIDs respondidas (as mesmas lidas pelo bot e pela descoberta)
+SYS_DESCR_OID = '1.3.6.1.2.1.1.1.0'
+SYS_OBJECT_ID_OID = '1.3.6.1.2.1.1.2.0'
+SYS_NAME_OID = '1.3.6.1.2.1.1.5.0'
+HR_DEVICE_TYPE_OID = '1.3.6.1.2.1.25.3.2.1.2.1'
+SERIE_OID = '1.3.6.1.2.1.43.5.1.1.17.1'  # prtGeneralSerialNumber
+CONTADOR_OID = '1.3.6.1.2.1.43.10.2.1.4.1.1'  # prtMarkerLifeCount
+STATUS_DISPOSITIVO_OID = '1.3.6.1.2.1.25.3.2.1.5.1'  # hrDeviceStatus
+STATUS_IMPRESSORA_OID = '1.3.6.1.2.1.25.3.5.1.1.1'  # hrPrinterStatus
+SUPRIMENTOS_OID = '1.3.6.1.2.1.43.11.1.1'  # prtMarkerSuppliesEntry
+
+# Código de erro noSuchName do SNMPv1
+NO_SUCH_NAME = 2
+
+
+def endereco_agente(indice, prefixo='127.42'):
+    """Endereço de loopback do agente de número `indice` (0, 1, 2, ...)."""
+    return f"{prefixo}.{indice // 250}.{indice % 250 + 1}"
+
+
+def mib_impressora(indice):
+    """Valores fixos da impressora simulada; o contador é calculado a cada consulta."""
+    v2c = api.protoModules[api.protoVersion2c]
+    mib = {
+        SYS_DESCR_OID: v2c.OctetString(f'Impressora simulada {indice}'),
+        SYS_OBJECT_ID_OID: v2c.ObjectIdentifier('1.3.6.1.4.1.236.11.5.1'),  # Samsung
+        SYS_NAME_OID: v2c.OctetString(f'impressora-{indice}'),
+        HR_DEVICE_TYPE_OID: v2c.ObjectIdentifier('1.3.6.1.2.1.25.3.1.5'),  # hrDevicePrinter
+        SERIE_OID: v2c.OctetString(f'SIM{indice:06d}'),
+        STATUS_DISPOSITIVO_OID: v2c.Integer(2),  # em funcionamento
+        STATUS_IMPRESSORA_OID: v2c.Integer(3),  # ociosa
+    }
+    suprimentos = [('Toner Preto', 100, (indice * 7) % 100), ('Cilindro', 100, 80)]
+    for numero, (descricao, maximo, nivel) in enumerate(suprimentos, 1):
+        mib[f'{SUPRIMENTOS_OID}.6.1.{numero}'] = v2c.OctetString(descricao)
+        mib[f'{SUPRIMENTOS_OID}.8.1.{numero}'] = v2c.Integer(maximo)
+        mib[f'{SUPRIMENTOS_OID}.9.1.{numero}'] = v2c.Integer(nivel)
+    return mib
+
+
+class AgenteImpressora(asyncio.DatagramProtocol):
+    """Agente SNMP de uma impressora simulada."""
+
+    def __init__(self, indice, latencia=0.0, variacao=0.0, perda=0.0, morta=False, paginas_por_hora=60,
+                 community='public'):
+        self.latencia = latencia
+        self.variacao = variacao
+        self.perda = perda
+        self.morta = morta
+        self.community = community
+        self.contador_inicial = 10000 + indice * 37
+        self.paginas_por_hora = paginas_por_hora
+        self.inicio = time.time()
+        self.mib = {ObjectName(oid): valor for oid, valor in mib_impressora(indice).items()}
+        self.oid_contador = ObjectName(CONTADOR_OID)
+        self.mib[self.oid_contador] = None  # Valor calculado na resposta
+        self.oids = sorted(self.mib)
+        self.transporte = None
+        self.recebidas = 0
+        self.respondidas = 0
+
+    def connection_made(self, transport):
+        self.transporte = transport
+
+    def valor(self, oid):
+        if oid == self.oid_contador:
+            horas = (time.time() - self.inicio) / 3600
+            return api.protoModules[api.protoVersion2c].Counter32(
+                self.contador_inicial + int(horas * self.paginas_por_hora))
+        return self.mib[oid]
+
+    def proxima(self, oid):
+        posicao = bisect.bisect_right(self.oids, oid)
+        return self.oids[posicao] if posicao < len(self.oids) else None
+
+    def datagram_received(self, data, addr):
+        self.recebidas += 1
+        if self.morta or random.random() < self.perda:
+            return
+        try:
+            resposta = self.responder(data)
+        except Exception as e:
+            print(f"Pedido inválido de {addr}: {e}")
+            return
+        if resposta is None:
+            return
+        self.respondidas += 1
+        atraso = self.latencia + random.uniform(0, self.variacao)
+        if atraso > 0:
+            asyncio.get_running_loop().call_later(atraso, self.transporte.sendto, resposta, addr)
+        else:
+            self.transporte.sendto(resposta, addr)
+
+    def responder(self, data):
+        """Monta a resposta BER para o pedido recebido (None para pedidos ignorados)."""
+        versao = api.decodeMessageVersion(data)
+        modulo = api.protoModules[versao]
+        mensagem, _ = decoder.decode(data, asn1Spec=modulo.Message())
+        if str(modulo.apiMessage.getCommunity(mensagem)) != self.community:
+            return None
+        pedido = modulo.apiMessage.getPDU(mensagem)
+        resposta = modulo.apiPDU.getResponse(pedido)
+        varbinds = modulo.apiPDU.getVarBinds(pedido)
+        v1 = versao == api.protoVersion1
+        saida = []
+        erro = 0
+
+        if pedido.isSameTypeWith(modulo.GetRequestPDU()):
+            for posicao, (oid, _) in enumerate(varbinds, 1):
+                if oid in self.mib:
+                    saida.append((oid, self.valor(oid)))
+                elif v1:
+                    erro, saida = posicao, varbinds
+                    break
+                else:
+                    saida.append((oid, modulo.NoSuchObject()))
+        elif pedido.isSameTypeWith(modulo.GetNextRequestPDU()):
+            for posicao, (oid, _) in enumerate(varbinds, 1):
+                proxima = self.proxima(oid)
+                if proxima is not None:
+                    saida.append((proxima, self.valor(proxima)))
+                elif v1:
+                    erro, saida = posicao, varbinds
+                    break
+                else:
+                    saida.append((oid, modulo.EndOfMibView()))
+        elif not v1 and pedido.isSameTypeWith(modulo.GetBulkRequestPDU()):
+            nao_repetidores = modulo.apiBulkPDU.getNonRepeaters(pedido)
+            repeticoes = modulo.apiBulkPDU.getMaxRepetitions(pedido)
+            oids = [oid for oid, _ in varbinds]
+            for oid in oids[:nao_repetidores]:
+                proxima = self.proxima(oid)
+                saida.append((proxima, self.valor(proxima)) if proxima else (oid, modulo.EndOfMibView()))
+            atuais = oids[nao_repetidores:]
+            for _ in range(repeticoes):
+                if not atuais:
+                    break
+                seguintes = []
+                for oid in atuais:
+                    proxima = self.proxima(oid)
+                    if proxima is None:
+                        saida.append((oid, modulo.EndOfMibView()))
+                        seguintes.append(oid)
+                    else:
+                        saida.append((proxima, self.valor(proxima)))
+                        seguintes.append(proxima)
+                atuais = seguintes
+        else:
+            return None
+
+        if erro:
+            modulo.apiPDU.setErrorStatus(resposta, NO_SUCH_NAME)
+            modulo.apiPDU.setErrorIndex(resposta, erro)
+        modulo.apiPDU.setVarBinds(resposta, saida)
+        modulo.apiMessage.setPDU(mensagem, resposta)
+        return encoder.encode(mensagem)
+
+
+async def iniciar_agentes(quantidade, porta=16100, prefixo='127.42', latencia=0.0, variacao=0.0, perda=0.0,
+                          mortas=0.0, semente=1, paginas_por_hora=60):
+    """Abre um agente por endereço e retorna a lista de (endereço, agente, transporte)."""
+    sorteio = random.Random(semente)
+    indices_mortos = set(sorteio.sample(range(quantidade), round(quantidade * mortas)))
+    loop = asyncio.get_running_loop()
+    agentes = []
+    for indice in range(quantidade):
+        endereco = endereco_agente(indice, prefixo)
+        agente = AgenteImpressora(indice, latencia, variacao, perda, indice in indices_mortos, paginas_por_hora)
+        transporte, _ = await loop.create_datagram_endpoint(lambda agente=agente: agente, local_addr=(endereco, porta))
+        agentes.append((endereco, agente, transporte))
+    return agentes
+
+
+def argumentos():
+    parser = argparse.ArgumentParser(description="Simula impressoras SNMP em endereços de loopback.")
+    parser.add_argument('--impressoras', type=int, default=300, help="quantidade de agentes (padrão: 300)")
+    parser.add_argument('--porta', type=int, default=16100, help="porta UDP de todos os agentes (padrão: 16100)")
+    parser.add_argument('--prefixo', default='127.42', help="dois primeiros octetos dos endereços (padrão: 127.42)")
+    parser.add_argument('--latencia', type=float, default=0.05, help="atraso de cada resposta, em segundos")
+    parser.add_argument('--variacao', type=float, default=0.02, help="atraso extra aleatório, até este valor")
+    parser.add_argument('--perda', type=float, default=0.0, help="fração de pedidos descartados (0 a 1)")
+    parser.add_argument('--mortas', type=float, default=0.1, help="fração de impressoras que nunca respondem")
+    parser.add_argument('--semente', type=int, default=1, help="semente do sorteio das impressoras mortas")
+    parser.add_argument('--paginas-por-hora', type=int, default=60, help="crescimento do contador de cada impressora")
+    return parser.parse_args()
+
+
+async def principal(opcoes):
+    agentes = await iniciar_agentes(
+        opcoes.impressoras, opcoes.porta, opcoes.prefixo, opcoes.latencia, opcoes.variacao, opcoes.perda,
+        opcoes.mortas, opcoes.semente, opcoes.paginas_por_hora
+    )
+    mortas = sum(agente.morta for _, agente, _ in agentes)
+    # O benchmark espera por esta linha antes de começar
+    print(f"Simulador pronto: {len(agentes)} agentes ({mortas} sem resposta) de {agentes[0][0]} a "
+          f"{agentes[-1][0]}, porta {opcoes.porta}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for _, _, transporte in agentes:
+            transporte.close()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(principal(argumentos()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,383 @@
+"""Cliente SNMP de longa duração usado pelo bot.
+
+Em vez de criar um SnmpEngine, um CommunityData e um UdpTransportTarget a cada consulta,
+o cliente mantém um único engine, um único socket UDP e o dispatcher do pysnmp rodando em
+uma thread dedicada. As consultas são enfileiradas a partir de qualquer thread (ou do event
+loop do bot) e respondidas por futures, com várias impressoras em andamento ao mesmo tempo.
+
+Cada consulta leva várias OIDs em um único PDU GET, ou percorre uma subárvore com GETBULK,
+para que métricas extras não custem uma ida e volta UDP a mais por impressora.
+
+O engine tem um único alvo por versão do SNMP, cujo endereço é trocado pelo da impressora logo
+antes de cada envio. O pysnmp guarda os alvos na tabela da SNMP-TARGET-MIB e reconstrói os índices
+dela (e o mapa de endereços usado para aceitar as respostas) a cada alteração; com um alvo por IP,
+cada impressora nova custava tempo proporcional ao tamanho da frota, no meio da varredura, e as
+respostas que chegavam nesse meio tempo venciam o timeout.
+
+O pysnmp só é importado na primeira consulta, e o cliente usa direto os geradores de comando do
+engine em vez do hlapi: as OIDs já são numéricas, então não há nada a resolver na MIB, e o hlapi
+carregaria o compilador de MIBs (pysmi) e montaria a gramática dele na primeira consulta. As MIBs
+do próprio engine vêm pré-compiladas (veja mibs.py).
+"""
+from concurrent.futures import Future
+from collections import OrderedDict, deque
+import asyncio
+import queue
+import socket
+import threading
+import time
+
+import mibs
+
+# Código de erro noSuchName do SNMPv1: uma das OIDs do PDU não existe no dispositivo
+NO_SUCH_NAME = 2
+
+# Preenchidos por _importar_pysnmp() na primeira consulta
+config = cmdgen = udp = AsyncoreDispatcher = None
+ObjectName = EndOfMibView = NoSuchInstance = NoSuchObject = None
+
+
+def _importar_pysnmp():
+    """Importa o pysnmp, que pesa na inicialização do bot, só quando a primeira consulta é feita."""
+    global config, cmdgen, udp, AsyncoreDispatcher
+    global ObjectName, EndOfMibView, NoSuchInstance, NoSuchObject
+    if config is not None:
+        return
+    from pysnmp.carrier.asyncore.dgram import udp
+    from pysnmp.carrier.asyncore.dispatch import AsyncoreDispatcher
+    from pysnmp.entity import config
+    from pysnmp.entity.rfc3413 import cmdgen
+    from pysnmp.proto.rfc1902 import ObjectName
+    from pysnmp.proto.rfc1905 import EndOfMibView, NoSuchInstance, NoSuchObject
+
+
+class _Pedido:
+    """Consulta em andamento: GET de uma lista de OIDs ou GETBULK de uma subárvore."""
+    __slots__ = ('ip', 'oids', 'subarvore', 'max_repeticoes', 'futuro', 'inicio', 'resultado')
+
+    def __init__(self, ip, futuro, oids=None, subarvore=None, max_repeticoes=0):
+        self.ip = ip
+        self.oids = oids
+        self.subarvore = subarvore
+        self.max_repeticoes = max_repeticoes
+        self.futuro = futuro
+        self.inicio = None
+        # GET: dicionário oid -> valor; GETBULK: lista de (oid, valor) dentro da subárvore
+        self.resultado = {} if subarvore is None else []
+
+
+def _valor_ausente(valor):
+    """Indica se o valor retornado é um marcador SNMPv2 de OID inexistente ou fim da MIB."""
+    return isinstance(valor, (NoSuchObject, NoSuchInstance, EndOfMibView))
+
+
+def resumir_latencias(latencias, consultas, falhas):
+    """Quantidade de consultas e falhas, média, p50 e p99 das latências (ip, segundos, sucesso)."""
+    tempos = sorted(segundos for _, segundos, sucesso in latencias if sucesso)
+    if not tempos:
+        return {'consultas': consultas, 'falhas': falhas, 'media': None, 'p50': None, 'p99': None}
+    return {
+        'consultas': consultas,
+        'falhas': falhas,
+        'media': sum(tempos) / len(tempos),
+        'p50': tempos[int(0.50 * (len(tempos) - 1))],
+        'p99': tempos[int(0.99 * (len(tempos) - 1))],
+    }
+
+
+class SnmpClient:
+    """Mantém o engine SNMP, o transporte e os alvos entre as consultas."""
+
+    def __init__(self, community='public', port=161, timeout=1.0, retries=1, concorrencia=64,
+                 resolucao=0.05, historico_latencias=5000, max_erros=5000, observador=None):
+        self.port = port
+        self.timeout = timeout
+        self.retries = retries
+        self.concorrencia = concorrencia  # Consultas em andamento ao mesmo tempo, no máximo
+        self._resolucao = resolucao  # Intervalo do timer do dispatcher, em segundos
+        self._community = community
+
+        self._engine = None
+        self._get = None
+        self._bulk = None
+        self._enderecos = {}  # Endereço UDP já resolvido por IP
+        self._apontados = {}  # IP para o qual cada alvo do engine aponta no momento
+        self._coluna_endereco = None  # Instância da coluna snmpTargetAddrTAddress de cada alvo
+        self._SnmpUDPAddress = None
+        self._nomes = {}  # Cache de ObjectName por OID
+
+        self._entrada = queue.SimpleQueue()  # Pedidos vindos de outras threads
+        self._aguardando = deque()  # Pedidos aguardando vaga (acessado apenas pela thread do dispatcher)
+        self._em_andamento = 0
+        self._ativos = set()  # Pedidos enviados e ainda sem resposta
+        self._thread = None
+        self._lock = threading.Lock()
+        self._encerrar = False
+
+        # Latência das últimas consultas (ip, segundos, sucesso) para acompanhamento de desempenho
+        self.latencias = deque(maxlen=historico_latencias)
+        self.total_consultas = 0
+        self.total_falhas = 0
+        # Motivo da última falha por IP (limpo quando a impressora volta a responder)
+        self._erros = OrderedDict()
+        self._max_erros = max_erros
+        # Função chamada ao fim de cada consulta com (ip, segundos, sucesso, erro), para métricas.
+        # Roda na thread do dispatcher, então precisa ser rápida e thread-safe.
+        self.observador = observador
+
+    def _iniciar(self):
+        """Cria o engine e inicia a thread do dispatcher na primeira consulta."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            _importar_pysnmp()
+            self._engine = mibs.criar_engine()
+            self._get = cmdgen.GetCommandGenerator()
+            self._bulk = cmdgen.BulkCommandGenerator()
+
+            dispatcher = AsyncoreDispatcher()
+            self._engine.registerTransportDispatcher(dispatcher)
+            # A mesma community serve às duas versões; GETBULK não existe no SNMPv1
+            config.addV1System(self._engine, 'bot', self._community)
+            config.addTargetParams(self._engine, 'bot-v1', 'bot', 'noAuthNoPriv', mpModel=0)
+            config.addTargetParams(self._engine, 'bot-v2c', 'bot', 'noAuthNoPriv', mpModel=1)
+            config.addTransport(self._engine, udp.domainName, udp.UdpSocketTransport().openClientMode())
+            # Um alvo fixo por versão; o endereço é trocado a cada envio (veja _alvo).
+            # O engine conta o timeout em centésimos de segundo.
+            for parametros in ('bot-v1', 'bot-v2c'):
+                config.addTargetAddr(self._engine, parametros, udp.domainName, ('0.0.0.0', self.port), parametros,
+                                     int(self.timeout * 100), self.retries)
+            mib_builder = self._engine.msgAndPduDsp.mibInstrumController.mibBuilder
+            coluna, entrada = mib_builder.importSymbols('SNMP-TARGET-MIB', 'snmpTargetAddrTAddress', 'snmpTargetAddrEntry')
+            self._SnmpUDPAddress, = mib_builder.importSymbols('SNMPv2-TM', 'SnmpUDPAddress')
+            self._coluna_endereco = {
+                parametros: coluna.name + entrada.getInstIdFromIndices(parametros) for parametros in ('bot-v1', 'bot-v2c')
+            }
+            dispatcher.setTimerResolution(self._resolucao)
+            dispatcher.registerTimerCbFun(self._drenar_entrada)
+            # Mantém o dispatcher ativo mesmo sem consultas pendentes
+            dispatcher.jobStarted(id(self))
+
+            self._thread = threading.Thread(target=self._executar, name='snmp-dispatcher', daemon=True)
+            self._thread.start()
+
+    def _executar(self):
+        try:
+            self._engine.transportDispatcher.runDispatcher()
+        except Exception as e:
+            print(f"Falha no dispatcher SNMP: {e}")
+        finally:
+            self._engine.transportDispatcher.closeDispatcher()
+            # Qualquer pedido que sobrou é finalizado sem resultado
+            for pedido in self._ativos:
+                pedido.futuro.set_result(None)
+            self._ativos.clear()
+            while self._aguardando:
+                self._aguardando.popleft().futuro.set_result(None)
+            while True:
+                try:
+                    pedido = self._entrada.get_nowait()
+                except queue.Empty:
+                    break
+                if pedido is not None:
+                    pedido.futuro.set_result(None)
+
+    def _alvo(self, ip, parametros='bot-v1'):
+        """Aponta o alvo da versão para o IP e retorna o nome dele no engine.
+
+        O gerador de comandos lê o endereço do alvo no envio e o guarda para as retransmissões,
+        então o mesmo alvo pode ser reapontado para outra impressora logo em seguida. Só a coluna
+        do endereço é escrita: a tabela continua com dois alvos, e o que o pysnmp reconstrói depois
+        da alteração custa o mesmo para qualquer tamanho de frota.
+        """
+        if self._apontados.get(parametros) != ip:
+            endereco = self._enderecos.get(ip)
+            if endereco is None:
+                endereco = self._enderecos[ip] = self._SnmpUDPAddress(socket.getaddrinfo(
+                    ip, self.port, socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)[0][4][:2])
+            self._engine.msgAndPduDsp.mibInstrumController.writeVars(
+                ((self._coluna_endereco[parametros], endereco),)
+            )
+            self._apontados[parametros] = ip
+        return parametros
+
+    def _nome(self, oid):
+        nome = self._nomes.get(oid)
+        if nome is None:
+            nome = self._nomes[oid] = ObjectName(oid)
+        return nome
+
+    def _drenar_entrada(self, agora):
+        """Chamado pelo timer do dispatcher: move os pedidos novos para a fila e envia o que couber."""
+        while True:
+            try:
+                pedido = self._entrada.get_nowait()
+            except queue.Empty:
+                break
+            if pedido is None:
+                self._engine.transportDispatcher.jobFinished(id(self))
+                continue
+            self._aguardando.append(pedido)
+        self._enviar_pendentes()
+
+    def _enviar_pendentes(self):
+        while self._aguardando and self._em_andamento < self.concorrencia:
+            pedido = self._aguardando.popleft()
+            pedido.inicio = time.perf_counter()
+            self._em_andamento += 1
+            self._ativos.add(pedido)
+            self._enviar(pedido)
+
+    def _enviar(self, pedido):
+        """Envia (ou reenvia) o PDU do pedido; a resposta chega em _resposta_get ou _resposta_bulk."""
+        try:
+            if pedido.subarvore is None:
+                self._get.sendVarBinds(
+                    self._engine,
+                    self._alvo(pedido.ip),
+                    None, b'',
+                    [(self._nome(oid), None) for oid in pedido.oids if oid not in pedido.resultado],
+                    self._resposta_get,
+                    pedido
+                )
+            else:
+                # Continua a partir da última OID recebida, se a subárvore não coube em um único PDU
+                inicio = pedido.resultado[-1][0] if pedido.resultado else pedido.subarvore
+                self._bulk.sendVarBinds(
+                    self._engine,
+                    self._alvo(pedido.ip, 'bot-v2c'),
+                    None, b'',
+                    0, pedido.max_repeticoes,
+                    [(ObjectName(inicio), None)],
+                    self._resposta_bulk,
+                    pedido
+                )
+        except Exception as e:
+            print(f"Falha ao conectar com a impressora {pedido.ip}: {e}")
+            self._concluir(pedido, None, f"falha ao conectar: {e}")
+
+    def _resposta_get(self, snmpEngine, sendRequestHandle, errorIndication, errorStatus, errorIndex, varBinds, pedido):
+        if errorIndication:
+            print(f"Erro na impressora {pedido.ip}: {errorIndication}")
+            self._concluir(pedido, None, str(errorIndication))
+            return
+        enviadas = [oid for oid in pedido.oids if oid not in pedido.resultado]
+        if errorStatus:
+            if int(errorStatus) == NO_SUCH_NAME and 0 < int(errorIndex) <= len(enviadas) and len(enviadas) > 1:
+                # No SNMPv1 uma OID inexistente invalida o PDU inteiro: descarta a OID e reenvia o restante
+                pedido.resultado[enviadas[int(errorIndex) - 1]] = None
+                self._enviar(pedido)
+                return
+            print(f"Erro no status SNMP na impressora {pedido.ip} - {errorStatus.prettyPrint()}")
+            self._concluir(pedido, None, f"status SNMP {errorStatus.prettyPrint()}")
+            return
+        for oid, (_, valor) in zip(enviadas, varBinds):
+            pedido.resultado[oid] = None if _valor_ausente(valor) else valor
+        self._concluir(pedido, pedido.resultado)
+
+    def _resposta_bulk(self, snmpEngine, sendRequestHandle, errorIndication, errorStatus, errorIndex, varBindTable, pedido):
+        if errorIndication:
+            print(f"Erro na impressora {pedido.ip}: {errorIndication}")
+            self._concluir(pedido, None, str(errorIndication))
+            return
+        if errorStatus:
+            print(f"Erro no status SNMP na impressora {pedido.ip} - {errorStatus.prettyPrint()}")
+            self._concluir(pedido, None, f"status SNMP {errorStatus.prettyPrint()}")
+            return
+        prefixo = self._nome(pedido.subarvore)
+        ultima = ObjectName(pedido.resultado[-1][0]) if pedido.resultado else prefixo
+        for linha in varBindTable:
+            for oid, valor in linha:
+                # Termina ao sair da subárvore, no fim da MIB ou se o agente não avançar
+                if _valor_ausente(valor) or not prefixo.isPrefixOf(oid) or oid <= ultima:
+                    self._concluir(pedido, pedido.resultado)
+                    return
+                pedido.resultado.append((str(oid), valor))
+                ultima = oid
+        if not varBindTable:
+            self._concluir(pedido, pedido.resultado)
+            return
+        self._enviar(pedido)
+
+    def _concluir(self, pedido, resultado, erro=None):
+        self._em_andamento -= 1
+        self._ativos.discard(pedido)
+        segundos = time.perf_counter() - pedido.inicio
+        self._registrar(pedido.ip, segundos, resultado is not None)
+        if self.observador is not None:
+            try:
+                self.observador(pedido.ip, segundos, resultado is not None, erro)
+            except Exception as e:
+                print(f"Falha ao registrar a consulta SNMP de {pedido.ip}: {e}")
+        if resultado is None:
+            self._erros[pedido.ip] = erro
+            self._erros.move_to_end(pedido.ip)
+            while len(self._erros) > self._max_erros:
+                self._erros.popitem(last=False)
+        else:
+            self._erros.pop(pedido.ip, None)
+        pedido.futuro.set_result(resultado)
+        self._enviar_pendentes()
+
+    def _registrar(self, ip, segundos, sucesso):
+        self.latencias.append((ip, segundos, sucesso))
+        self.total_consultas += 1
+        if not sucesso:
+            self.total_falhas += 1
+
+    def _submeter(self, pedido):
+        if self._encerrar:
+            pedido.futuro.set_result(None)
+            return pedido.futuro
+        self._iniciar()
+        pedido.futuro.set_running_or_notify_cancel()
+        self._entrada.put(pedido)
+        return pedido.futuro
+
+    def submeter(self, ip, oids):
+        """Enfileira um GET com várias OIDs em um único PDU.
+
+        Retorna um concurrent.futures.Future com um dicionário oid -> valor (None para OIDs que o
+        dispositivo não possui), ou None se a impressora não respondeu.
+        """
+        return self._submeter(_Pedido(ip, Future(), oids=list(oids)))
+
+    def submeter_walk(self, ip, subarvore, max_repeticoes=25):
+        """Enfileira a leitura de uma subárvore com GETBULK (SNMPv2c).
+
+        Retorna um concurrent.futures.Future com a lista de (oid, valor), ou None em caso de falha.
+        """
+        return self._submeter(_Pedido(ip, Future(), subarvore=subarvore, max_repeticoes=max_repeticoes))
+
+    def get_sync(self, ip, oid):
+        """Versão bloqueante de get, para uso fora do event loop."""
+        valores = self.submeter(ip, [oid]).result()
+        return None if valores is None else valores.get(oid)
+
+    async def get(self, ip, oid):
+        """Consulta uma OID de uma impressora sem bloquear o event loop."""
+        valores = await self.get_many(ip, [oid])
+        return None if valores is None else valores.get(oid)
+
+    async def get_many(self, ip, oids):
+        """Consulta várias OIDs de uma impressora em um único PDU, sem bloquear o event loop."""
+        return await asyncio.wrap_future(self.submeter(ip, oids))
+
+    async def walk(self, ip, subarvore, max_repeticoes=25):
+        """Percorre uma subárvore (por exemplo, uma tabela da Printer-MIB) com GETBULK."""
+        return await asyncio.wrap_future(self.submeter_walk(ip, subarvore, max_repeticoes))
+
+    def ultimo_erro(self, ip):
+        """Motivo da última consulta sem resposta do IP (por exemplo, o timeout), ou None."""
+        return self._erros.get(ip)
+
+    def estatisticas(self):
+        """Resumo das latências registradas: quantidade, média, p50 e p99 (em segundos)."""
+        return resumir_latencias(self.latencias, self.total_consultas, self.total_falhas)
+
+    def fechar(self):
+        """Encerra o dispatcher e libera o socket UDP."""
+        self._encerrar = True
+        if self._thread is not None:
+            self._entrada.put(None)
+            self._thread.join(timeout=self.timeout * (self.retries + 1) + 1)
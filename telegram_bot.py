@@ -1,65 +1,604 @@
+# O relógio começa antes dos imports. Com PERFIL_INICIALIZACAO=1 no ambiente, o cProfile também
+# (só no processo do bot, não nos trabalhadores do polling) e vai até o bot ficar pronto
+import os
+import time
+INICIO_PROCESSO = time.perf_counter()
+perfil_inicializacao = None
+if os.getenv('PERFIL_INICIALIZACAO', '0') == '1' and __name__ == '__main__':
+    import cProfile
+    perfil_inicializacao = cProfile.Profile()
+    perfil_inicializacao.enable()
+
 from telegram import Update
 from telegram.ext import Application, CommandHandler, ContextTypes
-from pysnmp.hlapi import getCmd, SnmpEngine, CommunityData, UdpTransportTarget, ContextData, ObjectType, ObjectIdentity
+from telegram.request import HTTPXRequest
 from dotenv import load_dotenv
-import os
+from snmp_client import SnmpClient
+from historico import HistoricoError, HistoricoLeituras
+from registro import ArquivoImpressoras, PrinterRegistry, RegistroError
+from mensagens import RespostaEmLotes, responder_em_lotes
+from saude import SaudeImpressoras
+from metricas import PerfilVarredura, RegistroMetricas, gravar_perfil, iniciar_servidor
+from descoberta import DescobertaError, SondaSnmp, expandir_rede, propor, texto_snmp, varrer
+from trabalhadores import PoolSnmp
+from alertas import AvaliadorAlertas, LimiteEnvio, Regras, notificar
+from datetime import datetime, timedelta
+from dataclasses import dataclass, field
+from collections import OrderedDict
+import asyncio
+import contextvars
+import functools
+import multiprocessing
 import re
-import json
+import csv
+import io
 
 # Carrega as variáveis do arquivo .env
 load_dotenv()
 
-# Obtém o token do ambiente
+# Obtém o token do ambiente (verificado em main())
 TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 
-if not TOKEN:
-    raise ValueError("O token do bot não foi encontrado. Verifique seu arquivo .env.")
 
+# Gravação do printers.json: alterações feitas em até PRINTERS_ATRASO segundos são gravadas juntas;
+# com PRINTERS_DIARIO=1, cada gravação só acrescenta as alterações a printers.json.diario
+PRINTERS_ATRASO = float(os.getenv('PRINTERS_ATRASO', '2'))
+PRINTERS_DIARIO = os.getenv('PRINTERS_DIARIO', '0') == '1'
 
-# Dicionário com IPs das impressoras, seus respectivos locais e NID
-# Load printers from an external JSON file
-with open('printers.json', 'r') as file:
-    printers = json.load(file)
-    
-# Lista global para armazenar impressoras com erro
-impressoras_com_erro = []
+def salvar_impressoras():
+    """Agenda a gravação do cadastro no arquivo printers.json (fora do event loop)."""
+    arquivo_impressoras.agendar(printers.para_dicionario())
 
 # OID para o contador de páginas (verifique a OID correta para sua impressora)
 page_counter_oid = '1.3.6.1.2.1.43.10.2.1.4.1.1'  # Exemplo comum, pode variar de acordo com a MIB da impressora
 
+# OIDs lidas junto com o contador, no mesmo PDU (Host-Resources-MIB)
+device_status_oid = '1.3.6.1.2.1.25.3.2.1.5.1'  # hrDeviceStatus
+printer_status_oid = '1.3.6.1.2.1.25.3.5.1.1.1'  # hrPrinterStatus
+# Número de série (Printer-MIB), gravado no histórico para o /descobrir reconhecer mudanças de IP
+serial_number_oid = '1.3.6.1.2.1.43.5.1.1.17.1'  # prtGeneralSerialNumber
+# Contadores mono/colorido variam por fabricante; informe as OIDs no .env, se a impressora tiver
+mono_counter_oid = os.getenv('CONTADOR_MONO_OID')
+color_counter_oid = os.getenv('CONTADOR_COR_OID')
+# Tabela de suprimentos (toner, cilindro etc.) da Printer-MIB, lida com GETBULK
+supplies_oid = '1.3.6.1.2.1.43.11.1.1'  # prtMarkerSuppliesEntry
+supplies_description_col = '6'  # prtMarkerSuppliesDescription
+supplies_max_col = '8'  # prtMarkerSuppliesMaxCapacity
+supplies_level_col = '9'  # prtMarkerSuppliesLevel
+
+# Textos para os valores de hrDeviceStatus e hrPrinterStatus
+STATUS_DISPOSITIVO = {1: 'desconhecido', 2: 'em funcionamento', 3: 'com alerta', 4: 'em teste', 5: 'inoperante'}
+STATUS_IMPRESSORA = {1: 'outro', 2: 'desconhecido', 3: 'ociosa', 4: 'imprimindo', 5: 'aquecendo'}
+
+# Parâmetros do polling SNMP (podem ser ajustados pelo arquivo .env)
+SNMP_CONCORRENCIA = int(os.getenv('SNMP_CONCORRENCIA', '32'))  # Consultas simultâneas no máximo
+SNMP_TIMEOUT = float(os.getenv('SNMP_TIMEOUT', '1'))  # Timeout por tentativa, em segundos
+SNMP_RETRIES = int(os.getenv('SNMP_RETRIES', '1'))  # Novas tentativas após o timeout
+SNMP_PORTA = int(os.getenv('SNMP_PORTA', '161'))  # Porta UDP dos agentes SNMP
+# Polling distribuído (experimental, desligado por padrão): com POLL_TRABALHADORES > 0, as
+# varreduras são divididas entre esse número de processos (cada um com SNMP_CONCORRENCIA consultas
+# simultâneas), por hash do IP ou por sub-rede /24 (POLL_PARTICAO=hash ou sub-rede)
+POLL_TRABALHADORES = int(os.getenv('POLL_TRABALHADORES', '0'))
+POLL_PARTICAO = os.getenv('POLL_PARTICAO', 'hash')
+
+# Cache das leituras: até CACHE_TTL segundos a leitura é considerada atual; até CACHE_MAX_IDADE ela
+# ainda é usada na resposta enquanto uma nova leitura é feita em segundo plano
+CACHE_TTL = float(os.getenv('CACHE_TTL', '60'))
+CACHE_MAX_IDADE = float(os.getenv('CACHE_MAX_IDADE', '900'))
+CACHE_MAX_ITENS = int(os.getenv('CACHE_MAX_ITENS', '1000'))
+
+# Polling periódico: intervalo em segundos entre as leituras de todas as impressoras (0 desativa)
+POLL_INTERVALO = float(os.getenv('POLL_INTERVALO', '600'))
+# Banco SQLite com o histórico das leituras
+HISTORICO_DB = os.getenv('HISTORICO_DB', 'historico.db')
+# Leituras mais antigas que esse número de dias são apagadas uma vez por dia (0 mantém todas);
+# o resumo diário usado pelo /relatorio não é apagado
+HISTORICO_RETENCAO_DIAS = float(os.getenv('HISTORICO_RETENCAO_DIAS', '0'))
+# Impressoras com SAUDE_LIMIAR falhas seguidas deixam de ser consultadas pelo polling por
+# SAUDE_BACKOFF_BASE segundos, tempo que dobra a cada nova falha até SAUDE_BACKOFF_MAX
+SAUDE_LIMIAR = int(os.getenv('SAUDE_LIMIAR', '2'))
+SAUDE_BACKOFF_BASE = float(os.getenv('SAUDE_BACKOFF_BASE', '300'))
+SAUDE_BACKOFF_MAX = float(os.getenv('SAUDE_BACKOFF_MAX', '3600'))
+# Endpoint /metrics (formato Prometheus) em METRICAS_HOST:METRICAS_PORTA; 0 desativa
+METRICAS_PORTA = int(os.getenv('METRICAS_PORTA', '0'))
+METRICAS_HOST = os.getenv('METRICAS_HOST', '127.0.0.1')
+# PERFIL_VARREDURA=1 liga o cProfile durante a primeira varredura (depois, via GET /perfil)
+PERFIL_VARREDURA = os.getenv('PERFIL_VARREDURA', '0') == '1'
+# Descoberta (/descobrir): timeout curto, mais consultas simultâneas e no máximo DESCOBERTA_TAXA
+# pacotes enviados por segundo; redes maiores que DESCOBERTA_MAX_ENDERECOS são recusadas
+DESCOBERTA_CONCORRENCIA = int(os.getenv('DESCOBERTA_CONCORRENCIA', '256'))
+DESCOBERTA_TIMEOUT = float(os.getenv('DESCOBERTA_TIMEOUT', '0.5'))
+DESCOBERTA_RETRIES = int(os.getenv('DESCOBERTA_RETRIES', '1'))
+DESCOBERTA_TAXA = float(os.getenv('DESCOBERTA_TAXA', '500'))
+DESCOBERTA_MAX_ENDERECOS = int(os.getenv('DESCOBERTA_MAX_ENDERECOS', '4096'))
+
+# Alertas do polling periódico (veja alertas.py): desativados enquanto nenhum chat for configurado,
+# em ALERTA_CHATS (IDs separados por vírgula) ou por setor/impressora no ALERTAS_ARQUIVO
+ALERTA_CHATS = tuple(int(chat) for chat in os.getenv('ALERTA_CHATS', '').split(',') if chat.strip())
+ALERTA_OFFLINE_CICLOS = int(os.getenv('ALERTA_OFFLINE_CICLOS', '3'))
+# A regra de toner só é ligada a pedido: ela acrescenta a leitura dos suprimentos a cada poll
+ALERTA_TONER_MINIMO = float(os.getenv('ALERTA_TONER_MINIMO', '0'))
+ALERTA_PAGINAS_HORA = int(os.getenv('ALERTA_PAGINAS_HORA', '5000'))
+ALERTA_INTERVALO_MINIMO = float(os.getenv('ALERTA_INTERVALO_MINIMO', '3600'))
+ALERTA_MAX_MENSAGENS_HORA = int(os.getenv('ALERTA_MAX_MENSAGENS_HORA', '20'))
+ALERTAS_ARQUIVO = os.getenv('ALERTAS_ARQUIVO', 'alertas.json')
+
+# Estado do bot, criado por preparar() e não no import: com POLL_TRABALHADORES, cada processo
+# trabalhador (spawn) importa este arquivo de novo como __mp_main__, e não pode reaplicar o diário do
+# printers.json nem abrir o histórico ao mesmo tempo que o processo do bot
+arquivo_impressoras = printers = historico = saude = alertas = limite_alertas = None
+snmp_client = cache_leituras = None
+ALERTAS_ATIVOS = ALERTAS_SUPRIMENTOS = False
+# Métricas expostas em /metrics, criadas por criar_metricas()
+metricas = perfil_varredura = None
+metrica_snmp_latencia = metrica_snmp_consultas = metrica_snmp_falhas = None
+metrica_comando_duracao = metrica_comando_erros = metrica_telegram_envio = metrica_telegram_erros = None
+metrica_polling_duracao = metrica_online = metrica_em_espera = None
+metrica_alertas = metrica_alertas_ativos = metrica_inicializacao = None
+
+def criar_metricas():
+    """Cria o registro das métricas expostas em /metrics e o perfil sob demanda das varreduras."""
+    global metricas, perfil_varredura
+    global metrica_snmp_latencia, metrica_snmp_consultas, metrica_snmp_falhas
+    global metrica_comando_duracao, metrica_comando_erros, metrica_telegram_envio, metrica_telegram_erros
+    global metrica_polling_duracao, metrica_online, metrica_em_espera
+    global metrica_alertas, metrica_alertas_ativos, metrica_inicializacao
+    metricas = RegistroMetricas()
+    metrica_snmp_latencia = metricas.histograma(
+        'impressoras_snmp_latencia_segundos', 'Latência das consultas SNMP respondidas, por impressora.', ('ip',))
+    metrica_snmp_consultas = metricas.contador(
+        'impressoras_snmp_consultas_total', 'Consultas SNMP por resultado (ok, timeout, erro).', ('resultado',))
+    metrica_snmp_falhas = metricas.contador(
+        'impressoras_snmp_falhas_total', 'Consultas SNMP sem resposta, por impressora e motivo.', ('ip', 'motivo'))
+    metrica_comando_duracao = metricas.histograma(
+        'impressoras_comando_duracao_segundos', 'Duração dos comandos do bot.', ('comando',))
+    metrica_comando_erros = metricas.contador(
+        'impressoras_comando_erros_total', 'Comandos encerrados com erro.', ('comando',))
+    metrica_telegram_envio = metricas.histograma(
+        'impressoras_telegram_envio_segundos', 'Duração das chamadas à API do Telegram.', ('metodo',))
+    metrica_telegram_erros = metricas.contador(
+        'impressoras_telegram_erros_total', 'Chamadas à API do Telegram com erro (inclui flood control).', ('metodo',))
+    metrica_polling_duracao = metricas.histograma(
+        'impressoras_polling_duracao_segundos', 'Duração do polling periódico de todas as impressoras.')
+    metrica_online = metricas.medidor('impressoras_online', 'Impressoras que responderam no último polling.')
+    metrica_em_espera = metricas.medidor('impressoras_em_espera', 'Impressoras em espera após falhas seguidas no último polling.')
+    metrica_alertas = metricas.contador(
+        'impressoras_alertas_total', 'Alertas notificados, por regra e situação (disparado ou normalizado).', ('regra', 'situacao'))
+    metrica_alertas_ativos = metricas.medidor('impressoras_alertas_ativos', 'Alertas ativos após o último polling.')
+    metrica_inicializacao = metricas.medidor(
+        'impressoras_bot_inicializacao_segundos', 'Tempo do início do processo até o bot ficar pronto para atender comandos.')
+    perfil_varredura = PerfilVarredura()
+    if PERFIL_VARREDURA:
+        perfil_varredura.armar()
+
+def preparar():
+    """Carrega o cadastro, abre o histórico e cria alertas, métricas, cache e cliente SNMP do bot.
+
+    Chamada uma vez, por main() (ou por quem usa o bot como módulo, como o benchmark_snmp.py).
+    """
+    global arquivo_impressoras, printers, historico, saude, alertas, limite_alertas
+    global snmp_client, cache_leituras, ALERTAS_ATIVOS, ALERTAS_SUPRIMENTOS
+    if printers is not None:
+        return
+    criar_metricas()
+
+    arquivo_impressoras = ArquivoImpressoras('printers.json', atraso=PRINTERS_ATRASO, diario=PRINTERS_DIARIO)
+    # Cadastro das impressoras (IP, setor e NID), indexado por IP, NID e setor
+    printers = PrinterRegistry.de_dicionario(arquivo_impressoras.carregar())
+
+    historico = HistoricoLeituras(HISTORICO_DB)
+
+    # Falhas seguidas, último sucesso e último erro de cada impressora
+    saude = SaudeImpressoras(base=SAUDE_BACKOFF_BASE, maximo=SAUDE_BACKOFF_MAX, limiar=SAUDE_LIMIAR)
+
+    alertas = AvaliadorAlertas.de_arquivo(
+        ALERTAS_ARQUIVO,
+        Regras(ALERTA_OFFLINE_CICLOS, ALERTA_TONER_MINIMO, ALERTA_PAGINAS_HORA, ALERTA_CHATS),
+        intervalo_minimo=ALERTA_INTERVALO_MINIMO
+    )
+    limite_alertas = LimiteEnvio(ALERTA_MAX_MENSAGENS_HORA)
+    ALERTAS_ATIVOS = alertas.notifica
+    # A regra de toner precisa dos suprimentos, lidos no polling com um GETBULK a mais por impressora
+    ALERTAS_SUPRIMENTOS = ALERTAS_ATIVOS and alertas.le_suprimentos
+
+    cache_leituras = CacheLeituras(CACHE_MAX_ITENS)
+
+    # Cliente SNMP compartilhado: um único engine e socket UDP para todas as consultas
+    snmp_client = SnmpClient(
+        community='public',  # Utilize a comunidade correta ('public' é padrão para leitura)
+        port=SNMP_PORTA,
+        timeout=SNMP_TIMEOUT,
+        retries=SNMP_RETRIES,
+        concorrencia=SNMP_CONCORRENCIA,
+        observador=observar_consulta_snmp
+    )
+
+def observar_consulta_snmp(ip, segundos, sucesso, erro):
+    """Registra uma consulta SNMP nas métricas (chamada pela thread do dispatcher)."""
+    if sucesso:
+        metrica_snmp_latencia.observar(segundos, ip=ip)
+        metrica_snmp_consultas.inc(resultado='ok')
+        return
+    motivo = 'timeout' if erro and 'timeout' in erro.lower() else 'erro'
+    metrica_snmp_consultas.inc(resultado=motivo)
+    metrica_snmp_falhas.inc(ip=ip, motivo=motivo)
+
+# Processos trabalhadores das varreduras, iniciados com o bot quando POLL_TRABALHADORES > 0
+pool_snmp = None
+
+def iniciar_trabalhadores():
+    """Inicia o pool de trabalhadores SNMP, se configurado."""
+    global pool_snmp
+    if POLL_TRABALHADORES <= 0 or pool_snmp is not None:
+        return
+    pool_snmp = PoolSnmp(
+        POLL_TRABALHADORES,
+        particao=POLL_PARTICAO,
+        observador=observar_consulta_snmp,
+        community='public',
+        port=SNMP_PORTA,
+        timeout=SNMP_TIMEOUT,
+        retries=SNMP_RETRIES,
+        concorrencia=SNMP_CONCORRENCIA
+    )
+    print(f"Polling distribuído em {POLL_TRABALHADORES} processos (partição por {POLL_PARTICAO}; modo experimental)")
+
 def get_snmp_data(ip, oid):
-    """Função para coletar dados SNMP de uma impressora Samsung."""
-    try:
-        iterator = getCmd(
-            SnmpEngine(),
-            CommunityData('public', mpModel=0),  # Utilize a comunidade correta ('public' é padrão para leitura)
-            UdpTransportTarget((ip, 161)),
-            ContextData(),
-            ObjectType(ObjectIdentity(oid))
-        )
+    """Função para coletar dados SNMP de uma impressora Samsung (versão bloqueante)."""
+    return snmp_client.get_sync(ip, oid)
 
-        errorIndication, errorStatus, errorIndex, varBinds = next(iterator)
+@dataclass
+class LeituraImpressora:
+    """Dados de uma impressora obtidos em uma única consulta SNMP."""
+    ip: str
+    contador: int | None = None
+    contador_mono: int | None = None
+    contador_cor: int | None = None
+    status: str | None = None
+    status_impressora: str | None = None
+    suprimentos: list = field(default_factory=list)  # Lista de (descrição, percentual ou None)
+    serie: str | None = None  # Número de série, quando a impressora informa
+    online: bool = False
+    erro: str | None = None  # Motivo da falha, quando a impressora não respondeu
+    coletada_em: float = field(default_factory=time.time)
 
-        if errorIndication:
-            print(f"Erro na impressora {ip}: {errorIndication}")
-            return None
-        elif errorStatus:
-            print(f"Erro no status SNMP na impressora {ip} - {errorStatus.prettyPrint()}")
+    @property
+    def idade(self):
+        """Segundos desde que a leitura foi feita."""
+        return time.time() - self.coletada_em
+
+class CacheLeituras:
+    """Últimas leituras bem-sucedidas por IP, com descarte da menos usada (LRU) ao atingir o limite."""
+
+    def __init__(self, max_itens):
+        self.max_itens = max_itens
+        self._leituras = OrderedDict()
+        self._atualizacoes = {}  # Tarefas de atualização em segundo plano, por IP
+
+    def obter(self, ip, max_idade):
+        """Retorna a leitura do IP se ela tiver no máximo max_idade segundos, senão None."""
+        leitura = self._leituras.get(ip)
+        if leitura is None or leitura.idade > max_idade:
             return None
+        self._leituras.move_to_end(ip)
+        return leitura
+
+    def guardar(self, leitura):
+        if not leitura.online:
+            return
+        self._leituras[leitura.ip] = leitura
+        self._leituras.move_to_end(leitura.ip)
+        while len(self._leituras) > self.max_itens:
+            self._leituras.popitem(last=False)
+
+    def remover(self, ip):
+        """Descarta a leitura do IP e cancela a atualização em segundo plano dele, se houver.
+
+        Sem o cancelamento, uma atualização em andamento guardaria no cache e no histórico uma
+        leitura do IP que acabou de sair do cadastro (ou que mudou de dono).
+        """
+        self._leituras.pop(ip, None)
+        tarefa = self._atualizacoes.pop(ip, None)
+        if tarefa is not None:
+            tarefa.cancel()
+
+    def atualizar_em_segundo_plano(self, ip):
+        """Agenda uma nova leitura do IP, sem duplicar uma atualização que já está em andamento."""
+        if ip in self._atualizacoes:
+            return
+        tarefa = asyncio.create_task(coletar_e_guardar(ip))
+        self._atualizacoes[ip] = tarefa
+
+        def concluida(_):
+            # Uma tarefa cancelada por remover() não descarta a de uma atualização posterior do mesmo IP
+            if self._atualizacoes.get(ip) is tarefa:
+                del self._atualizacoes[ip]
+        tarefa.add_done_callback(concluida)
+
+def esquecer_impressora(ip):
+    """Descarta leitura em cache, estado de saúde e métricas de um IP que saiu do cadastro."""
+    cache_leituras.remover(ip)
+    saude.remover(ip)
+    metrica_snmp_latencia.remover(ip=ip)
+    metrica_snmp_falhas.remover(ip=ip)
+    alertas.remover(ip)
+
+def montar_suprimentos(linhas):
+    """Converte as linhas de prtMarkerSuppliesEntry em uma lista de (descrição, percentual)."""
+    colunas = {}
+    for oid, valor in linhas:
+        # OID = <supplies_oid>.<coluna>.<hrDeviceIndex>.<índice do suprimento>
+        coluna, indice = oid[len(supplies_oid) + 1:].split('.', 1)
+        colunas.setdefault(indice, {})[coluna] = valor
+
+    suprimentos = []
+    for indice, valores in colunas.items():
+        descricao = valores.get(supplies_description_col)
+        if descricao is None:
+            continue
+        maximo = int(valores.get(supplies_max_col, -1))
+        nivel = int(valores.get(supplies_level_col, -1))
+        # Valores negativos indicam nível desconhecido (-1 outro, -2 desconhecido, -3 há algum restante)
+        percentual = round(nivel * 100 / maximo) if maximo > 0 and nivel >= 0 else None
+        suprimentos.append((str(descricao), percentual))
+    return suprimentos
+
+# OIDs lidas em cada consulta de uma impressora, em um único PDU
+oids_leitura = [oid for oid in (page_counter_oid, device_status_oid, printer_status_oid,
+                                serial_number_oid, mono_counter_oid, color_counter_oid) if oid]
+
+async def coletar_leitura(ip, suprimentos=False):
+    """Lê contador e status de uma impressora em um único PDU e, opcionalmente, a tabela de suprimentos.
+
+    O GET e o GETBULK dos suprimentos seguem em paralelo, então a leitura completa custa uma
+    única ida e volta por impressora.
+    """
+    consultas = [snmp_client.get_many(ip, oids_leitura)]
+    if suprimentos:
+        consultas.append(snmp_client.walk(ip, supplies_oid))
+    resultados = await asyncio.gather(*consultas)
+    erro = snmp_client.ultimo_erro(ip) if resultados[0] is None else None
+    return montar_leitura(ip, resultados[0], resultados[1] if suprimentos else None, erro)
+
+def montar_leitura(ip, valores, linhas_suprimentos=None, erro=None):
+    """Monta a LeituraImpressora a partir da resposta SNMP e atualiza a saúde da impressora.
+
+    Os valores podem vir do cliente SNMP local ou, já convertidos para int/str, de um trabalhador
+    do polling distribuído.
+    """
+    leitura = LeituraImpressora(ip)
+    if valores is None:
+        leitura.erro = erro or 'sem resposta'
+        saude.registrar_falha(ip, leitura.erro)
+        return leitura
+
+    def inteiro(oid):
+        return int(valores[oid]) if oid and valores.get(oid) is not None else None
+
+    leitura.online = True
+    leitura.contador = inteiro(page_counter_oid)
+    leitura.contador_mono = inteiro(mono_counter_oid)
+    leitura.contador_cor = inteiro(color_counter_oid)
+    if inteiro(device_status_oid) is not None:
+        leitura.status = STATUS_DISPOSITIVO.get(inteiro(device_status_oid))
+    if inteiro(printer_status_oid) is not None:
+        leitura.status_impressora = STATUS_IMPRESSORA.get(inteiro(printer_status_oid))
+    leitura.serie = texto_snmp(valores.get(serial_number_oid))
+    if linhas_suprimentos is not None:
+        leitura.suprimentos = montar_suprimentos(linhas_suprimentos)
+    if leitura.contador is None:
+        saude.registrar_falha(ip, 'a impressora não informou o contador')
+    else:
+        saude.registrar_sucesso(ip)
+    return leitura
+
+def linha_historico(leitura):
+    """Converte uma leitura em uma linha do histórico, com o setor e o NID atuais da impressora."""
+    impressora = printers.por_ip(leitura.ip)
+    return {
+        'ip': leitura.ip,
+        'nid': impressora.nid if impressora else None,
+        'setor': impressora.setor if impressora else None,
+        'coletada_em': leitura.coletada_em,
+        'contador': leitura.contador,
+        'contador_mono': leitura.contador_mono,
+        'contador_cor': leitura.contador_cor,
+        'status': leitura.status,
+        'online': int(leitura.online),
+        'serie': leitura.serie,
+    }
+
+def leitura_do_historico(linha):
+    """Reconstrói uma LeituraImpressora a partir de uma linha gravada no histórico."""
+    return LeituraImpressora(
+        ip=linha['ip'],
+        contador=linha['contador'],
+        contador_mono=linha['contador_mono'],
+        contador_cor=linha['contador_cor'],
+        status=linha['status'],
+        online=bool(linha['online']),
+        coletada_em=linha['coletada_em'],
+    )
+
+async def registrar_leituras(leituras):
+    """Grava as leituras no histórico fora do event loop."""
+    linhas = [linha_historico(leitura) for leitura in leituras]
+    if linhas:
+        await asyncio.to_thread(historico.registrar, linhas)
+
+async def coletar_e_guardar(ip, suprimentos=False):
+    """Consulta a impressora e guarda a leitura no cache e no histórico."""
+    leitura = await coletar_leitura(ip, suprimentos)
+    cache_leituras.guardar(leitura)
+    await registrar_leituras([leitura])
+    return leitura
+
+def idade_reaproveitavel():
+    """Idade máxima de uma leitura para /contadores responder sem consultar a impressora.
+
+    Com o polling periódico ativo, a última leitura gravada é usada por padrão.
+    """
+    return max(CACHE_TTL, POLL_INTERVALO * 1.5) if POLL_INTERVALO > 0 else CACHE_TTL
+
+async def obter_leitura(ip):
+    """Retorna a leitura do cache quando possível (stale-while-revalidate), senão consulta a impressora.
+
+    Leituras com até CACHE_TTL segundos são usadas diretamente. Entre CACHE_TTL e CACHE_MAX_IDADE
+    a leitura antiga é devolvida na hora e uma nova é feita em segundo plano.
+    """
+    leitura = cache_leituras.obter(ip, CACHE_MAX_IDADE)
+    if leitura is not None:
+        if leitura.idade > CACHE_TTL:
+            cache_leituras.atualizar_em_segundo_plano(ip)
+        return leitura
+    return await coletar_e_guardar(ip)
+
+async def consultar_impressoras(ips, suprimentos=False, max_idade=CACHE_TTL, respeitar_espera=True):
+    """Consulta várias impressoras ao mesmo tempo, entregando (ip, leitura) conforme as respostas chegam.
+
+    A concorrência é limitada pelo cliente SNMP (SNMP_CONCORRENCIA), então uma varredura
+    completa leva aproximadamente um timeout, e não a soma dos timeouts de cada impressora.
+    Com POLL_TRABALHADORES, as consultas são divididas entre os processos do pool_snmp e as
+    respostas de todos eles chegam aqui em um único fluxo.
+    Leituras com até max_idade segundos são reaproveitadas sem nova consulta; as novas leituras
+    são gravadas no histórico ao final da varredura. Com respeitar_espera, impressoras em espera
+    após falhas seguidas não são consultadas: recebem uma leitura offline com o motivo.
+    """
+    novas = []
+
+    async def consultar(ip):
+        leitura = await coletar_leitura(ip, suprimentos)
+        cache_leituras.guardar(leitura)
+        novas.append(leitura)
+        return ip, leitura
+
+    perfilando = False
+    try:
+        # Dentro do try: quem interrompe a iteração ainda nas leituras do cache encerra o perfil
+        perfilando = perfil_varredura.iniciar()
+        pendentes = []
+        for ip in ips:
+            leitura = None if suprimentos or max_idade <= 0 else cache_leituras.obter(ip, max_idade)
+            if leitura is not None:
+                yield ip, leitura
+            elif respeitar_espera and not saude.disponivel(ip):
+                yield ip, LeituraImpressora(ip, erro=descrever_espera(saude.estado(ip)))
+            else:
+                pendentes.append(ip)
+
+        if pool_snmp is not None:
+            respostas = pool_snmp.consultar(pendentes, oids_leitura, supplies_oid if suprimentos else None)
+            async for ip, valores, linhas, erro in respostas:
+                leitura = montar_leitura(ip, valores, linhas, erro)
+                cache_leituras.guardar(leitura)
+                novas.append(leitura)
+                yield ip, leitura
         else:
-            for varBind in varBinds:
-                return varBind[1]  # Retorna o valor da OID
-    except Exception as e:
-        print(f"Falha ao conectar com a impressora {ip}: {e}")
-        return None
+            for tarefa in asyncio.as_completed([consultar(ip) for ip in pendentes]):
+                yield await tarefa
+    finally:
+        await registrar_leituras(novas)
+        if perfilando:
+            perfil_varredura.concluir()
+
+async def polling_periodico(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job do JobQueue: lê todas as impressoras, grava as leituras no histórico e avalia os alertas."""
+    inicio = time.perf_counter()
+    online = 0
+    total = 0
+    ips = printers.ips()
+    em_espera = sum(not saude.disponivel(ip) for ip in ips)
+    async for ip, leitura in consultar_impressoras(ips, suprimentos=ALERTAS_SUPRIMENTOS, max_idade=0):
+        total += 1
+        online += leitura.online
+        impressora = printers.por_ip(ip)
+        if ALERTAS_ATIVOS and impressora is not None:
+            alertas.avaliar(leitura, impressora.setor, f"{impressora.setor} ({ip}, NID: {impressora.nid})")
+    if ALERTAS_ATIVOS:
+        await enviar_alertas(context.bot)
+    duracao = time.perf_counter() - inicio
+    metrica_polling_duracao.observar(duracao)
+    metrica_online.definir(online)
+    metrica_em_espera.definir(em_espera)
+    print(f"Polling periódico: {online}/{total} impressoras responderam em {duracao:.1f} s "
+          f"({em_espera} em espera após falhas seguidas)")
+
+async def enviar_alertas(bot):
+    """Envia as notificações acumuladas na avaliação do polling e atualiza as métricas de alertas."""
+    pendentes = alertas.coletar()
+    for alerta in pendentes:
+        metrica_alertas.inc(regra=alerta.regra, situacao='normalizado' if alerta.resolvido else 'disparado')
+    metrica_alertas_ativos.definir(alertas.total_ativos)
+    if pendentes:
+        enviadas = await notificar(bot, pendentes, limite_alertas)
+        print(f"Alertas: {len(pendentes)} notificação(ões) enviada(s) em {enviadas} mensagem(ns)")
+
+def carregar_ultimas_leituras():
+    """Preenche o cache com a última leitura gravada de cada impressora, para responder logo após iniciar."""
+    for linha in historico.ultimas_leituras(printers.ips()):
+        cache_leituras.guardar(leitura_do_historico(linha))
+
+# Colunas do CSV enviado por '/contadores csv'
+COLUNAS_CSV_CONTADORES = ('setor', 'nid', 'ip', 'contador', 'contador_mono', 'contador_cor', 'status', 'leitura')
+
+def formatar_leitura(location, ip, nid, leitura, mostrar_idade=True):
+    """Monta a linha de resposta com o contador (e o detalhamento mono/colorido, se disponível).
+
+    Leituras reaproveitadas do cache recebem a indicação de quando foram feitas.
+    """
+    texto = f"{location} ({ip}, NID: {nid}) - Contador: {leitura.contador}"
+    if leitura.contador_mono is not None or leitura.contador_cor is not None:
+        texto += f" (Mono: {leitura.contador_mono}, Cor: {leitura.contador_cor})"
+    if mostrar_idade and leitura.idade >= 5:
+        texto += f" - leitura {formatar_idade(leitura.idade)}"
+    return texto
+
+def formatar_falha(location, ip, nid, leitura):
+    """Linha de resposta para uma impressora sem contador, com o motivo quando conhecido."""
+    texto = f"Não foi possível obter o contador para a impressora em {location} ({ip}, NID: {nid})"
+    return f"{texto}: {leitura.erro}" if leitura.erro else texto
+
+def formatar_status(location, ip, nid, leitura):
+    """Linha do contador seguida do status do dispositivo, quando a impressora informa."""
+    texto = formatar_leitura(location, ip, nid, leitura, mostrar_idade=False)
+    if leitura.status:
+        texto += f"\nStatus: {leitura.status}"
+        if leitura.status_impressora:
+            texto += f" ({leitura.status_impressora})"
+    texto += f"\nLeitura: {formatar_idade(leitura.idade)}"
+    return texto
+
+def descrever_espera(estado):
+    """Motivo exibido para uma impressora que não foi consultada por estar em espera."""
+    minutos = max(1, round((estado.proxima_tentativa - time.time()) / 60))
+    return f"em espera após {estado.falhas_consecutivas} falhas seguidas, nova tentativa em {minutos} min"
+
+def formatar_idade(segundos):
+    """Descreve a idade de uma leitura para a resposta ao usuário."""
+    if segundos < 5:
+        return "agora"
+    if segundos < 120:
+        return f"há {segundos:.0f} s"
+    return f"há {segundos / 60:.0f} min"
+
+def formatar_latencias(estatisticas):
+    """Formata o resumo de latências do cliente SNMP para exibição."""
+    if estatisticas['p50'] is None:
+        return f"{estatisticas['consultas']} consultas, {estatisticas['falhas']} falhas"
+    return (f"{estatisticas['consultas']} consultas, {estatisticas['falhas']} falhas, "
+            f"média {estatisticas['media'] * 1000:.0f} ms, p50 {estatisticas['p50'] * 1000:.0f} ms, "
+            f"p99 {estatisticas['p99'] * 1000:.0f} ms")
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Mensagem de boas-vindas e instruções sobre os comandos disponíveis."""
     await update.message.reply_text(
         "Olá! Bem-vindo ao bot de gerenciamento de impressoras. Aqui estão os comandos disponíveis:\n\n"
-        "/contadores - Mostra os contadores de todas as impressoras.\n"
+        "/contadores - Mostra os contadores de todas as impressoras (use '/contadores agora' para consultar todas novamente e '/contadores csv' para receber também um arquivo).\n"
         "/contador ip:<IP> - Mostra o contador de uma impressora específica com o endereço IP informado. Exemplo: /contador ip:192.168.0.222\n"
-        "/contador NID:<NID> - Mostra o contador de uma impressora específica com o NID informado. Exemplo: /contador NID:1234\n\n"
+        "/contador NID:<NID> - Mostra o contador de uma impressora específica com o NID informado. Exemplo: /contador NID:1234\n"
+        "/suprimentos ip:<IP> ou NID:<NID> - Mostra o status e o nível de toner de uma impressora. Exemplo: /suprimentos NID:1234\n"
+        "/historico NID:<NID> [dias] - Mostra as leituras gravadas de uma impressora (ou SETOR:<SETOR>). Exemplo: /historico NID:1234 30\n"
+        "/relatorio [DD/MM/AAAA DD/MM/AAAA | MM/AAAA] [csv|xlsx] [SETOR:<SETOR>] - Páginas impressas por impressora e setor no período. Exemplo: /relatorio 09/2026 xlsx\n\n"
         "**Atualizações de Impressoras:**\n"
         "/atualizarNID NID:<NID_ATUAL> PARA:<NOVO_NID> - Atualiza o NID de uma impressora. Exemplo: /atualizarNID NID:1234 PARA:5678\n"
         "/atualizarIP NID:<NID> PARA:<NOVO_IP> - Atualiza o IP de uma impressora. Exemplo: /atualizarIP NID:1234 PARA:192.168.0.123\n"
@@ -67,25 +606,67 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "**Novos Comandos:**\n"
         "/adicionar NID:<NID> IP:<IP> SETOR:<SETOR> - Adiciona uma nova impressora ao sistema. Exemplo: /adicionar NID:5678 IP:192.168.0.123 SETOR:Administração\n"
         "/buscar <SETOR> - Busca impressoras por setor ou parte do nome do setor. Exemplo: /buscar adm\n"
-        "/buscarErro - Lista todas as impressoras que apresentaram erro ao tentar exibir os contadores."
+        "/buscarErro - Lista as impressoras cuja última consulta falhou, com o motivo e há quantas consultas o problema ocorre.\n"
+        "/descobrir <REDE> - Procura impressoras na rede e propõe inclusões e mudanças de IP. Exemplo: /descobrir 192.168.0.0/22\n"
+        "/alertas - Lista os alertas ativos do polling (impressoras sem resposta, toner baixo).\n"
         "/comandos - Lista todos os coamdos disponíveis no bot, com exemplos."
         "/remover NID:<NID> - Remove uma impressora da lista de impressoras com base no NID"
         "/remover IP:<IP> - Remove uma impressora da lista de impressoras com base no IP"
     )
     
 async def contadores(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Mostra os contadores de todas as impressoras, agrupados em poucas mensagens.
+
+    Uma mensagem de progresso é atualizada durante a varredura; com '/contadores csv' o
+    resultado completo também é enviado como arquivo.
+    """
     try:
-        for ip, (location, nid) in printers.items():
-            contador = get_snmp_data(ip, page_counter_oid)
-            if contador is not None:
-                print(f"{location} ({ip}, NID: {nid}) - Contador: {contador}")
-                await update.message.reply_text(f"{location} ({ip}, NID: {nid}) - Contador: {contador}")
+        args = [arg.lower() for arg in context.args or []]
+        # '/contadores agora' ignora as leituras gravadas e consulta todas as impressoras,
+        # inclusive as que estão em espera após falhas seguidas
+        agora = 'agora' in args
+        max_idade = 0 if agora else idade_reaproveitavel()
+        linhas_csv = [] if 'csv' in args else None
+        # Copia a lista de IPs, pois o cadastro pode ser alterado por outro comando durante a varredura
+        ips = printers.ips()
+        resposta = RespostaEmLotes(update.message)
+        await resposta.iniciar(f"Consultando {len(ips)} impressoras...")
+        inicio = time.perf_counter()
+        total = 0
+        sem_contador = 0
+        async for ip, leitura in consultar_impressoras(ips, max_idade=max_idade, respeitar_espera=not agora):
+            impressora = printers.por_ip(ip)
+            if impressora is None:
+                continue
+            location, nid = impressora.setor, impressora.nid
+            total += 1
+            if leitura.contador is not None:
+                print(formatar_leitura(location, ip, nid, leitura))
+                await resposta.adicionar(formatar_leitura(location, ip, nid, leitura))
             else:
-                # Armazena o IP da impressora que apresentou erro
-                impressoras_com_erro.append(ip)
-                await update.message.reply_text(f"Não foi possível obter o contador para a impressora em {location} ({ip}, NID: {nid})")
+                sem_contador += 1
+                await resposta.adicionar(formatar_falha(location, ip, nid, leitura))
+            if linhas_csv is not None:
+                linhas_csv.append({
+                    'setor': location,
+                    'nid': nid,
+                    'ip': ip,
+                    'contador': leitura.contador,
+                    'contador_mono': leitura.contador_mono,
+                    'contador_cor': leitura.contador_cor,
+                    'status': leitura.status,
+                    'leitura': datetime.fromtimestamp(leitura.coletada_em).strftime('%d/%m/%Y %H:%M') if leitura.online else '',
+                })
+            await resposta.progresso(f"Consultando impressoras: {total}/{len(ips)} ({sem_contador} sem contador)")
+        await resposta.concluir(
+            f"Contadores de {total} impressoras em {time.perf_counter() - inicio:.1f} s ({sem_contador} sem contador)."
+        )
+        if linhas_csv is not None:
+            linhas_csv.sort(key=lambda linha: (linha['setor'].lower(), linha['nid']))
+            await resposta.anexar_csv(linhas_csv, list(COLUNAS_CSV_CONTADORES), f"contadores_{datetime.now():%Y%m%d_%H%M}.csv")
+        print(f"Latência SNMP: {formatar_latencias((pool_snmp or snmp_client).estatisticas())}")
     except Exception as e:
-        await update.message.reply_text(f'Ocorreu um erro ao executar o comando: {e}')
+        await responder_erro(update, "executar o comando", e)
 
 async def contador(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
@@ -94,40 +675,251 @@ async def contador(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
         if match_ip:
             ip = match_ip.group(1)
-            if ip in printers:
-                location, nid = printers[ip]
-                contador = get_snmp_data(ip, page_counter_oid)
-                if contador is not None:
-                    print(f"{location} ({ip}, NID: {nid}) - Contador: {contador}")
-                    await update.message.reply_text(f"{location} ({ip}, NID: {nid}) - Contador: {contador}")
+            impressora = printers.por_ip(ip)
+            if impressora is not None:
+                location, nid = impressora.setor, impressora.nid
+                leitura = await obter_leitura(ip)
+                if leitura.contador is not None:
+                    print(formatar_leitura(location, ip, nid, leitura))
+                    await update.message.reply_text(formatar_status(location, ip, nid, leitura))
                 else:
-                    # Armazena o IP da impressora que apresentou erro
-                    impressoras_com_erro.append(ip)
-                    await update.message.reply_text(f"Não foi possível obter o contador para a impressora em {location} ({ip}, NID: {nid})")
+                    await update.message.reply_text(formatar_falha(location, ip, nid, leitura))
             else:
                 await update.message.reply_text(f"IP {ip} não encontrado na lista de impressoras.")
         elif match_nid:
             nid = match_nid.group(1)
 
             # Find the printer with the matching NID
-            matching_printers = {ip: (location, printer_nid) for ip, (location, printer_nid) in printers.items() if printer_nid == nid}
-
-            if matching_printers:
-                ip, (location, _) = next(iter(matching_printers.items()))
-                contador = get_snmp_data(ip, page_counter_oid)
-                if contador is not None:
-                    print(f"{location} ({ip}, NID: {nid}) - Contador: {contador}")
-                    await update.message.reply_text(f"{location} ({ip}, NID: {nid}) - Contador: {contador}")
+            impressora = printers.por_nid(nid)
+
+            if impressora is not None:
+                ip, location = impressora.ip, impressora.setor
+                leitura = await obter_leitura(ip)
+                if leitura.contador is not None:
+                    print(formatar_leitura(location, ip, nid, leitura))
+                    await update.message.reply_text(formatar_status(location, ip, nid, leitura))
                 else:
-                    # Armazena o IP da impressora que apresentou erro
-                    impressoras_com_erro.append(ip)
-                    await update.message.reply_text(f"Não foi possível obter o contador para a impressora em {location} ({ip}, NID: {nid})")
+                    await update.message.reply_text(formatar_falha(location, ip, nid, leitura))
             else:
                 await update.message.reply_text(f"NID {nid} não encontrado na lista de impressoras.")
         else:
             await update.message.reply_text("Comando inválido. Use '/contador ip:xxx.xxx.xxx.xxx' ou '/contador NID:xxxx'.")
     except Exception as e:
-        await update.message.reply_text(f'Ocorreu um erro ao executar o comando: {e}')
+        await responder_erro(update, "executar o comando", e)
+
+async def consultar_suprimentos(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Mostra o status e o nível dos suprimentos (toner, cilindro etc.) de uma impressora."""
+    try:
+        match_ip = re.search(r'ip:(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})', update.message.text)
+        match_nid = re.search(r'NID:(\d+)', update.message.text)
+
+        if match_ip:
+            impressora = printers.por_ip(match_ip.group(1))
+            if impressora is None:
+                await update.message.reply_text(f"IP {match_ip.group(1)} não encontrado na lista de impressoras.")
+                return
+        elif match_nid:
+            impressora = printers.por_nid(match_nid.group(1))
+            if impressora is None:
+                await update.message.reply_text(f"NID {match_nid.group(1)} não encontrado na lista de impressoras.")
+                return
+        else:
+            await update.message.reply_text("Comando inválido. Use '/suprimentos ip:xxx.xxx.xxx.xxx' ou '/suprimentos NID:xxxx'.")
+            return
+
+        ip, location, nid = impressora.ip, impressora.setor, impressora.nid
+        leitura = await coletar_e_guardar(ip, suprimentos=True)
+        if not leitura.online:
+            await update.message.reply_text(f"Não foi possível consultar a impressora em {location} ({ip}, NID: {nid}): {leitura.erro}")
+            return
+
+        linhas = [formatar_status(location, ip, nid, leitura)]
+        if leitura.suprimentos:
+            for descricao, percentual in leitura.suprimentos:
+                linhas.append(f"{descricao}: {f'{percentual}%' if percentual is not None else 'nível desconhecido'}")
+        else:
+            linhas.append("A impressora não informou os níveis de suprimentos.")
+        await update.message.reply_text("\n".join(linhas))
+    except Exception as e:
+        await responder_erro(update, "executar o comando", e)
+
+async def consultar_historico(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Mostra as leituras gravadas de uma impressora (por IP ou NID) ou de um setor nos últimos dias."""
+    try:
+        texto = update.message.text
+        match_ip = re.search(r'ip:(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})', texto)
+        match_nid = re.search(r'NID:(\d+)', texto)
+        match_setor = re.search(r'SETOR:(.+?)(?:\s+\d+)?\s*$', texto)
+        # O número de dias é o último argumento, quando informado
+        dias = int(context.args[-1]) if len(context.args) > 1 and context.args[-1].isdigit() else 7
+
+        fim = time.time()
+        inicio = fim - dias * 86400
+
+        if match_ip:
+            linhas = await asyncio.to_thread(historico.leituras_por_ip, match_ip.group(1), inicio, fim)
+            titulo = f"IP {match_ip.group(1)}"
+        elif match_nid:
+            linhas = await asyncio.to_thread(historico.leituras_por_nid, match_nid.group(1), inicio, fim)
+            titulo = f"NID {match_nid.group(1)}"
+        elif match_setor:
+            # O setor é resolvido pelo cadastro, como nos outros comandos (parte do nome, sem acentos)
+            termo = match_setor.group(1).strip()
+            impressoras = {impressora.nid: impressora for impressora in printers.buscar_setor(termo)}
+            if not impressoras:
+                await update.message.reply_text(f"Nenhuma impressora encontrada no setor com '{termo}'.")
+                return
+            linhas = await asyncio.to_thread(historico.leituras_por_nids, impressoras, inicio, fim)
+            titulo = f"setor com '{termo}'"
+        else:
+            await update.message.reply_text("Comando inválido. Use '/historico NID:<NID> [dias]', '/historico ip:<IP> [dias]' ou '/historico SETOR:<SETOR> [dias]'.")
+            return
+
+        linhas = [linha for linha in linhas if linha['online']]
+        if not linhas:
+            await update.message.reply_text(f"Nenhuma leitura gravada para {titulo} nos últimos {dias} dias.")
+            return
+
+        mensagens = [f"Leituras de {titulo} nos últimos {dias} dias ({len(linhas)} no total):"]
+        if match_setor:
+            # Para um setor, mostra a primeira e a última leitura de cada impressora, com o setor e o IP atuais
+            por_nid = {}
+            for linha in linhas:
+                por_nid.setdefault(linha['nid'], []).append(linha)
+            for nid, leituras_nid in por_nid.items():
+                primeira, ultima = leituras_nid[0], leituras_nid[-1]
+                impressora = impressoras[nid]
+                mensagens.append(
+                    f"{impressora.setor} (NID: {nid}, IP: {impressora.ip}) - {primeira['contador']} em "
+                    f"{datetime.fromtimestamp(primeira['coletada_em']):%d/%m/%Y %H:%M}, {ultima['contador']} em "
+                    f"{datetime.fromtimestamp(ultima['coletada_em']):%d/%m/%Y %H:%M}"
+                )
+        else:
+            # Para uma impressora, mostra as leituras mais recentes
+            for linha in linhas[-15:]:
+                mensagens.append(f"{datetime.fromtimestamp(linha['coletada_em']):%d/%m/%Y %H:%M} - Contador: {linha['contador']}")
+        await responder_em_lotes(update.message, mensagens)
+    except Exception as e:
+        await responder_erro(update, "consultar o histórico", e)
+
+def periodo_relatorio(args):
+    """Interpreta o período do /relatorio: duas datas (DD/MM/AAAA), um mês (MM/AAAA) ou o mês atual."""
+    datas = [datetime.strptime(arg, '%d/%m/%Y') for arg in args if re.fullmatch(r'\d{2}/\d{2}/\d{4}', arg)]
+    meses = [datetime.strptime(arg, '%m/%Y') for arg in args if re.fullmatch(r'\d{2}/\d{4}', arg)]
+    if len(datas) >= 2:
+        # A data final é incluída por inteiro
+        return datas[0], datas[1] + timedelta(days=1)
+    if len(datas) == 1:
+        return datas[0], datetime.now()
+    inicio = meses[0] if meses else datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    proximo_mes = (inicio.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return inicio, min(proximo_mes, datetime.now())
+
+def gerar_relatorio(inicio, fim, filtro_setor=None):
+    """Calcula as páginas impressas por impressora no período a partir do histórico.
+
+    O consumo é contado por NID e as diferenças entre leituras são calculadas no SQLite; aqui só
+    são acrescentados o setor e o IP atuais de cada impressora. Retorna a lista de linhas e o
+    total por setor.
+    """
+    impressoras = printers.buscar_setor(filtro_setor) if filtro_setor else printers
+    alvos = {impressora.nid: (impressora.setor, impressora.ip) for impressora in impressoras}
+    # O período é fechado em dias inteiros; fim é exclusivo
+    dia_final = (fim - timedelta(seconds=1)).date()
+    consumo = {linha['nid']: linha for linha in historico.consumo_por_impressora(alvos, inicio.date(), dia_final)}
+
+    linhas = []
+    por_setor = {}
+    for nid, (setor, ip) in alvos.items():
+        dados = consumo.get(nid)
+        # Sem leituras no período não há como calcular a diferença
+        paginas = dados['paginas'] if dados else None
+        linhas.append({
+            'setor': setor,
+            'nid': nid,
+            'ip': ip,
+            'contador_inicial': dados['contador_inicial'] if dados else None,
+            'contador_final': dados['contador_final'] if dados else None,
+            'paginas': paginas,
+            'amostras': dados['amostras'] if dados else 0,
+            'reinicios': dados['reinicios'] if dados else 0,
+            'primeira_leitura': datetime.fromtimestamp(dados['primeira']).strftime('%d/%m/%Y %H:%M') if dados else '',
+            'ultima_leitura': datetime.fromtimestamp(dados['ultima']).strftime('%d/%m/%Y %H:%M') if dados else '',
+        })
+        por_setor[setor] = por_setor.get(setor, 0) + (paginas or 0)
+    linhas.sort(key=lambda linha: (linha['setor'].lower(), linha['nid']))
+    return linhas, por_setor
+
+def exportar_relatorio(linhas, formato):
+    """Gera o arquivo do relatório (CSV separado por ';' ou XLSX) e retorna os bytes."""
+    colunas = list(linhas[0].keys()) if linhas else ['setor', 'nid', 'ip', 'paginas']
+    if formato == 'xlsx':
+        from openpyxl import Workbook  # Dependência opcional, usada apenas na exportação XLSX
+
+        planilha = Workbook()
+        aba = planilha.active
+        aba.title = 'Relatório'
+        aba.append(colunas)
+        for linha in linhas:
+            aba.append([linha[coluna] for coluna in colunas])
+        saida = io.BytesIO()
+        planilha.save(saida)
+        return saida.getvalue()
+
+    saida = io.StringIO()
+    escritor = csv.DictWriter(saida, fieldnames=colunas, delimiter=';')
+    escritor.writeheader()
+    escritor.writerows(linhas)
+    # BOM para o Excel reconhecer a acentuação
+    return saida.getvalue().encode('utf-8-sig')
+
+async def relatorio(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Relatório de páginas impressas por impressora e por setor no período, com o arquivo em anexo."""
+    try:
+        args = context.args or []
+        formato = 'xlsx' if any(arg.lower() == 'xlsx' for arg in args) else 'csv'
+        match_setor = re.search(r'SETOR:(.+?)(?:\s+(?:csv|xlsx|\d{2}/[\d/]+))*\s*$', update.message.text, re.IGNORECASE)
+        filtro_setor = match_setor.group(1).strip() if match_setor else None
+
+        try:
+            inicio, fim = periodo_relatorio(args)
+        except ValueError:
+            await update.message.reply_text("Data inválida. Use o formato: /relatorio [DD/MM/AAAA DD/MM/AAAA | MM/AAAA] [csv|xlsx] [SETOR:<SETOR>]")
+            return
+        if fim <= inicio:
+            await update.message.reply_text("A data final deve ser posterior à data inicial.")
+            return
+
+        linhas, por_setor = await asyncio.to_thread(gerar_relatorio, inicio, fim, filtro_setor)
+        if not linhas:
+            if filtro_setor:
+                await update.message.reply_text(f"Nenhuma impressora encontrada no setor com '{filtro_setor}'.")
+            else:
+                await update.message.reply_text("Nenhuma impressora cadastrada.")
+            return
+
+        periodo = f"{inicio:%d/%m/%Y} a {(fim - timedelta(seconds=1)):%d/%m/%Y}"
+        mensagens = [f"Relatório de {periodo}", f"Total: {sum(por_setor.values())} páginas", "", "Por setor:"]
+        mensagens += [f"{setor}: {paginas} páginas" for setor, paginas in sorted(por_setor.items(), key=lambda item: -item[1])]
+        sem_dados = sum(1 for linha in linhas if linha['paginas'] is None)
+        reinicios = sum(linha['reinicios'] for linha in linhas)
+        if sem_dados:
+            mensagens.append(f"\n{sem_dados} impressora(s) sem leituras suficientes no período.")
+        if reinicios:
+            mensagens.append(f"{reinicios} reinício(s) de contador considerados no cálculo.")
+        await responder_em_lotes(update.message, mensagens)
+
+        try:
+            conteudo = await asyncio.to_thread(exportar_relatorio, linhas, formato)
+        except ImportError:
+            await update.message.reply_text("A exportação XLSX requer o pacote openpyxl. Use '/relatorio csv' ou instale com 'pip install openpyxl'.")
+            return
+        await update.message.reply_document(
+            document=conteudo,
+            filename=f"relatorio_{inicio:%Y%m%d}_{(fim - timedelta(seconds=1)):%Y%m%d}.{formato}"
+        )
+    except Exception as e:
+        await responder_erro(update, "gerar o relatório", e)
 
 async def atualizar_nid(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
@@ -138,25 +930,36 @@ async def atualizar_nid(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             new_nid = match.group(2)  # Novo NID
             
             # Encontrar a impressora correspondente ao NID atual
-            matching_printers = {ip: (location, nid) for ip, (location, nid) in printers.items() if nid == old_nid}
+            impressora = printers.por_nid(old_nid)
             
-            if matching_printers:
-                # Atualiza o NID no dicionário
-                ip, (location, _) = next(iter(matching_printers.items()))
-                printers[ip] = (location, new_nid)
+            if impressora is not None:
+                # Atualiza o NID no cadastro (recusa um NID que já pertence a outra impressora)
+                try:
+                    printers.alterar_nid(impressora, new_nid)
+                except RegistroError as e:
+                    await update.message.reply_text(str(e))
+                    return
+                # O consumo é contado por NID: o histórico acompanha a impressora. Um NID que já tem
+                # histórico (de uma impressora removida) é recusado, para não misturar os consumos.
+                try:
+                    await asyncio.to_thread(historico.renomear_nid, old_nid, new_nid)
+                except HistoricoError as e:
+                    printers.alterar_nid(impressora, old_nid)
+                    await update.message.reply_text(
+                        f"{e} Ele pertenceu a outra impressora; use um NID sem histórico. O NID não foi alterado.")
+                    return
                 
                 # Escreve a atualização de volta para o arquivo JSON
-                with open('printers.json', 'w') as file:
-                    json.dump(printers, file, indent=4)
+                salvar_impressoras()
                 
                 # Confirmação de atualização
-                await update.message.reply_text(f"O NID da impressora em {location} (IP: {ip}) foi atualizado de {old_nid} para {new_nid}.")
+                await update.message.reply_text(f"O NID da impressora em {impressora.setor} (IP: {impressora.ip}) foi atualizado de {old_nid} para {new_nid}.")
             else:
                 await update.message.reply_text(f"NID {old_nid} não encontrado na lista de impressoras.")
         else:
             await update.message.reply_text("Comando inválido. Use o formato '/atualizarNID NID:YYYY PARA:XXXX'.")
     except Exception as e:
-        await update.message.reply_text(f"Ocorreu um erro ao executar o comando: {e}")
+        await responder_erro(update, "executar o comando", e)
 
 async def atualizar_ip(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
@@ -167,27 +970,29 @@ async def atualizar_ip(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             new_ip = match.group(2)  # Novo IP
             
             # Encontrar a impressora correspondente ao NID
-            matching_printers = {ip: (location, nid_in_file) for ip, (location, nid_in_file) in printers.items() if nid_in_file == nid}
+            impressora = printers.por_nid(nid)
             
-            if matching_printers:
-                # Pega o IP atual e atualiza no dicionário
-                old_ip, (location, _) = next(iter(matching_printers.items()))
-                printers[new_ip] = (location, nid)
-                # Remove a entrada antiga
-                del printers[old_ip]
+            if impressora is not None:
+                # Pega o IP atual e atualiza no cadastro (recusa um IP que já pertence a outra impressora)
+                old_ip = impressora.ip
+                try:
+                    printers.alterar_ip(impressora, new_ip)
+                except RegistroError as e:
+                    await update.message.reply_text(str(e))
+                    return
+                esquecer_impressora(old_ip)
                 
                 # Escreve a atualização de volta para o arquivo JSON
-                with open('printers.json', 'w') as file:
-                    json.dump(printers, file, indent=4)
+                salvar_impressoras()
                 
                 # Confirmação de atualização
-                await update.message.reply_text(f"O IP da impressora NID {nid} em {location} foi atualizado de {old_ip} para {new_ip}.")
+                await update.message.reply_text(f"O IP da impressora NID {nid} em {impressora.setor} foi atualizado de {old_ip} para {new_ip}.")
             else:
                 await update.message.reply_text(f"NID {nid} não encontrado na lista de impressoras.")
         else:
             await update.message.reply_text("Comando inválido. Use o formato '/atualizarIP NID:YYYY PARA:XXX.XXX.XXX.XXX'.")
     except Exception as e:
-        await update.message.reply_text(f"Ocorreu um erro ao executar o comando: {e}")
+        await responder_erro(update, "executar o comando", e)
 
 async def atualizar_setor(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
@@ -198,36 +1003,42 @@ async def atualizar_setor(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             new_location = match.group(2)  # Novo setor
             
             # Encontrar a impressora correspondente ao NID
-            matching_printers = {ip: (location, nid_in_file) for ip, (location, nid_in_file) in printers.items() if nid_in_file == nid}
+            impressora = printers.por_nid(nid)
             
-            if matching_printers:
-                # Pega o IP e atualiza o setor (localização) no dicionário
-                ip, (_, _) = next(iter(matching_printers.items()))
-                printers[ip] = (new_location, nid)
+            if impressora is not None:
+                # Atualiza o setor (localização) no cadastro
+                printers.alterar_setor(impressora, new_location)
                 
                 # Escreve a atualização de volta para o arquivo JSON
-                with open('printers.json', 'w') as file:
-                    json.dump(printers, file, indent=4)
+                salvar_impressoras()
                 
                 # Confirmação de atualização
-                await update.message.reply_text(f"O setor da impressora NID {nid} com IP {ip} foi atualizado para {new_location}.")
+                await update.message.reply_text(f"O setor da impressora NID {nid} com IP {impressora.ip} foi atualizado para {new_location}.")
             else:
                 await update.message.reply_text(f"NID {nid} não encontrado na lista de impressoras.")
         else:
             await update.message.reply_text("Comando inválido. Use o formato '/atualizarSetor NID:YYYY PARA:Novo Setor'.")
     except Exception as e:
-        await update.message.reply_text(f"Ocorreu um erro ao executar o comando: {e}")
+        await responder_erro(update, "executar o comando", e)
 
 async def comandos(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Lista todos os comandos disponíveis no bot, enviando um por mensagem."""
+    """Lista todos os comandos disponíveis no bot, agrupados no menor número de mensagens."""
     
     # Lista de comandos com suas descrições e exemplos
     comandos_list = [
-        ("/contadores", "Mostra os contadores de todas as impressoras."),
+        ("/contadores", "Mostra os contadores de todas as impressoras, a partir das últimas leituras gravadas."),
+        ("/contadores agora", "Consulta todas as impressoras novamente antes de mostrar os contadores."),
+        ("/contadores csv", "Mostra os contadores e envia também o resultado completo em um arquivo CSV."),
         ("/contador ip:<IP>", "Mostra o contador de uma impressora específica com o endereço IP informado. Exemplo: ", 
             "/contador ip:192.168.0.222"),
         ("/contador NID:<NID>", "Mostra o contador de uma impressora específica com o NID informado. Exemplo: ", 
             "/contador NID:1234"),
+        ("/suprimentos NID:<NID>", "Mostra o status e o nível dos suprimentos (toner, cilindro) de uma impressora. Exemplo: ",
+            "/suprimentos NID:1234"),
+        ("/historico NID:<NID> [dias]", "Mostra as leituras gravadas de uma impressora (ou de um setor, com SETOR:<SETOR>). Exemplo: ",
+            "/historico NID:1234 30"),
+        ("/relatorio [DD/MM/AAAA DD/MM/AAAA | MM/AAAA] [csv|xlsx] [SETOR:<SETOR>]", "Páginas impressas por impressora e por setor no período (padrão: mês atual), com arquivo em anexo. Exemplo: ",
+            "/relatorio 01/09/2026 30/09/2026 xlsx"),
         ("/atualizarNID NID:<NID_ATUAL> PARA:<NOVO_NID>", "Atualiza o NID de uma impressora. Exemplo: ", 
             "/atualizarNID NID:1234 PARA:5678"),
         ("/atualizarIP NID:<NID> PARA:<NOVO_IP>", "Atualiza o IP de uma impressora. Exemplo: ", 
@@ -238,19 +1049,19 @@ async def comandos(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             "/adicionar NID:5678 IP:192.168.0.123 SETOR:Administração"),
         ("/buscar <SETOR>", "Busca impressoras por setor ou parte do nome do setor. Exemplo: ", 
             "/buscar adm"),
-        ("/buscarErro", "Lista todas as impressoras que apresentaram erro ao tentar exibir os contadores."),
+        ("/descobrir <REDE>", "Procura impressoras na rede e propõe inclusões e mudanças de IP no cadastro. Exemplo: ",
+            "/descobrir 192.168.0.0/22"),
+        ("/buscarErro", "Lista as impressoras cuja última consulta falhou, com o motivo e há quantas consultas o problema ocorre."),
+        ("/alertas", "Lista os alertas ativos do polling periódico: impressoras sem resposta há vários polls e suprimentos de toner abaixo do limite."),
         ("/comandos", "Lista todos os comandos disponíveis no bot, com exemplos."),
         ("/remover NID:<NID>", "Remove uma impressora da lista de impressoras com base no NID"),
         ("/remover IP:<IP>", "Remove uma impressora da lista de impressoras com base no IP"),
     ]
 
-    # Enviar cada comando e descrição em uma mensagem separada
-    for comando in comandos_list:
-        if len(comando) == 2:
-            await update.message.reply_text(f"{comando[0]} - {comando[1]}")
-        elif len(comando) == 3:
-            await update.message.reply_text(f"{comando[0]} - {comando[1]}")
-            await update.message.reply_text(f"{comando[2]}")
+    # Cada comando com a descrição (e o exemplo, quando houver), em blocos de até 4096 caracteres
+    linhas = [f"{comando[0]} - {comando[1]}" + (f"\n{comando[2]}" if len(comando) == 3 else "")
+              for comando in comandos_list]
+    await responder_em_lotes(update.message, linhas, separador="\n\n")
 
 async def adicionar_impressora(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Adiciona uma nova impressora ao arquivo printers.json."""
@@ -269,28 +1080,25 @@ async def adicionar_impressora(update: Update, context: ContextTypes.DEFAULT_TYP
         ip = match_ip.group(1)
         setor = match_setor.group(1)
 
-        # Verificar se o IP já está cadastrado
-        if ip in printers:
-            await update.message.reply_text(f"Já existe uma impressora cadastrada com o IP {ip}.")
+        # Adicionar a nova impressora ao cadastro (IP e NID já cadastrados são recusados)
+        try:
+            printers.adicionar(ip, setor, nid)
+        except RegistroError as e:
+            await update.message.reply_text(str(e))
             return
 
-        # Verificar se o NID já está cadastrado
-        for _, (existing_setor, existing_nid) in printers.items():
-            if existing_nid == nid:
-                await update.message.reply_text(f"Já existe uma impressora cadastrada com o NID {nid}.")
-                return
-
-        # Adicionar a nova impressora ao dicionário
-        printers[ip] = (setor, nid)
-
         # Atualizar o arquivo printers.json com a nova impressora
-        with open('printers.json', 'w') as file:
-            json.dump(printers, file, indent=4)
+        salvar_impressoras()
 
-        await update.message.reply_text(f"Impressora adicionada com sucesso:\nNID: {nid}\nIP: {ip}\nSetor: {setor}")
+        resposta = f"Impressora adicionada com sucesso:\nNID: {nid}\nIP: {ip}\nSetor: {setor}"
+        # O consumo é contado por NID: um NID reaproveitado herda o histórico da impressora anterior
+        if await asyncio.to_thread(historico.tem_historico, nid):
+            resposta += (f"\n\nAtenção: o NID {nid} já tem histórico de leituras (de uma impressora removida). "
+                         "O /relatorio e o /historico juntam esse histórico ao desta impressora.")
+        await update.message.reply_text(resposta)
 
     except Exception as e:
-        await update.message.reply_text(f"Ocorreu um erro ao adicionar a impressora: {e}")
+        await responder_erro(update, "adicionar a impressora", e)
 
 async def buscar_setor(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Busca impressoras pelo setor (ou parte dele) e retorna os dados correspondentes."""
@@ -305,36 +1113,171 @@ async def buscar_setor(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
         # Buscar impressoras que contenham parte do nome do setor
         resultados = [
-            f"Setor: {info[0]}, NID: {info[1]}, IP: {ip}"
-            for ip, info in printers.items() if setor.lower() in info[0].lower()
+            f"Setor: {impressora.setor}, NID: {impressora.nid}, IP: {impressora.ip}"
+            for impressora in printers.buscar_setor(setor)
         ]
 
         # Verificar se encontrou impressoras
         if resultados:
-            await update.message.reply_text("\n\n".join(resultados))
+            await responder_em_lotes(update.message, resultados, separador="\n\n")
         else:
             await update.message.reply_text(f"Nenhuma impressora encontrada no setor com '{setor}'.")
 
     except Exception as e:
-        await update.message.reply_text(f"Ocorreu um erro ao buscar impressoras: {e}")
+        await responder_erro(update, "buscar impressoras", e)
 
 async def buscar_erro(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Lista as impressoras que apresentaram problemas ao exibir os contadores."""
+    """Lista as impressoras cuja última consulta falhou, com o número de falhas seguidas e o motivo."""
     try:
-        if impressoras_com_erro:
-            # Monta uma mensagem com as impressoras que apresentaram erro
-            mensagens = []
-            for ip in impressoras_com_erro:
-                setor, nid = printers[ip]
-                mensagens.append(f"Setor: {setor}, NID: {nid}, IP: {ip}")
-            
+        # Monta uma mensagem por impressora ainda cadastrada, das que falham há mais tempo
+        mensagens = []
+        for ip, estado in saude.com_falha():
+            impressora = printers.por_ip(ip)
+            if impressora is None:
+                continue
+            texto = (f"Setor: {impressora.setor}, NID: {impressora.nid}, IP: {ip}\n"
+                     f"{estado.falhas_consecutivas} falha(s) seguida(s), última {formatar_idade(time.time() - estado.ultima_falha)}: {estado.ultimo_erro}\n"
+                     f"Última leitura com sucesso: {formatar_idade(time.time() - estado.ultimo_sucesso) if estado.ultimo_sucesso else 'nenhuma desde o início do bot'}")
+            if estado.em_espera:
+                texto += f"\nPolling {descrever_espera(estado)}"
+            mensagens.append(texto)
+
+        if mensagens:
             # Responde com a lista de impressoras com erro
-            await update.message.reply_text("\n\n".join(mensagens))
+            await responder_em_lotes(update.message, mensagens, separador="\n\n")
         else:
             await update.message.reply_text("Nenhuma impressora apresentou problemas recentemente.")
     
     except Exception as e:
-        await update.message.reply_text(f"Ocorreu um erro ao buscar impressoras com problema: {e}")
+        await responder_erro(update, "buscar impressoras com problema", e)
+
+async def listar_alertas(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Lista os alertas ativos do polling periódico, dos mais antigos aos mais recentes."""
+    try:
+        if not ALERTAS_ATIVOS:
+            await update.message.reply_text(
+                "Os alertas estão desativados. Defina ALERTA_CHATS (ou chats no alertas.json) para ativá-los.")
+            return
+        linhas = [f"{texto} ({formatar_idade(time.time() - desde)})" for _, _, desde, texto in alertas.ativos()]
+        if linhas:
+            await responder_em_lotes(update.message, linhas)
+        else:
+            await update.message.reply_text("Nenhum alerta ativo.")
+
+    except Exception as e:
+        await responder_erro(update, "listar os alertas", e)
+
+# Uma descoberta por vez: cada uma já usa DESCOBERTA_CONCORRENCIA consultas simultâneas
+descoberta_em_andamento = asyncio.Lock()
+
+def descrever_dispositivo(dispositivo):
+    """Fabricante, nome e descrição (resumida) de um dispositivo encontrado na descoberta."""
+    partes = [parte for parte in (dispositivo.fabricante, dispositivo.nome) if parte]
+    if dispositivo.descricao:
+        partes.append(dispositivo.descricao if len(dispositivo.descricao) <= 60 else dispositivo.descricao[:57] + '...')
+    partes.append(f"série {dispositivo.serie}" if dispositivo.serie else "sem número de série")
+    return ', '.join(partes)
+
+# Candidatas listadas, no máximo, para cada possível mudança de IP
+MAX_CANDIDATAS = 5
+
+def descrever_possivel_mudanca(dispositivo, candidatas):
+    """Impressora encontrada fora do cadastro, as cadastradas que podem ser ela e os comandos possíveis."""
+    linhas = [f"{dispositivo.ip} - {descrever_dispositivo(dispositivo)}"]
+    if len(candidatas) == 1:
+        impressora = candidatas[0]
+        linhas.append(f"Pode ser {impressora.setor} ({impressora.ip}, NID: {impressora.nid}), que não respondeu:")
+        linhas.append(f"/atualizarIP NID:{impressora.nid} PARA:{dispositivo.ip}")
+    else:
+        nomes = [f"{impressora.setor} ({impressora.ip}, NID: {impressora.nid})" for impressora in candidatas[:MAX_CANDIDATAS]]
+        if len(candidatas) > MAX_CANDIDATAS:
+            nomes.append(f"e mais {len(candidatas) - MAX_CANDIDATAS}")
+        linhas.append(f"Pode ser uma destas, que não responderam: {', '.join(nomes)}")
+        linhas.append(f"/atualizarIP NID:<NID> PARA:{dispositivo.ip}")
+    linhas.append(f"Se for uma impressora nova: /adicionar NID:<NID> IP:{dispositivo.ip} SETOR:<SETOR>")
+    return "\n".join(linhas)
+
+async def descobrir(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Varre uma sub-rede procurando impressoras e propõe inclusões e mudanças de IP no cadastro."""
+    try:
+        if not context.args:
+            await update.message.reply_text("Comando inválido. Use o formato: /descobrir <REDE>, por exemplo /descobrir 192.168.0.0/22")
+            return
+        try:
+            rede, ips = expandir_rede(context.args[0], DESCOBERTA_MAX_ENDERECOS)
+        except DescobertaError as e:
+            await update.message.reply_text(str(e))
+            return
+        if descoberta_em_andamento.locked():
+            await update.message.reply_text("Já existe uma descoberta em andamento. Aguarde ela terminar.")
+            return
+
+        async with descoberta_em_andamento:
+            resposta = RespostaEmLotes(update.message, separador="\n\n")
+            await resposta.iniciar(f"Varrendo {len(ips)} endereços de {rede}...")
+            # Séries vistas nas descobertas anteriores, antes de gravar as desta
+            series = await asyncio.to_thread(historico.series)
+            sonda = SondaSnmp(
+                community='public',
+                porta=SNMP_PORTA,
+                timeout=DESCOBERTA_TIMEOUT,
+                retries=DESCOBERTA_RETRIES,
+                concorrencia=DESCOBERTA_CONCORRENCIA,
+                taxa_maxima=DESCOBERTA_TAXA
+            )
+            inicio = time.perf_counter()
+            encontrados = []
+            consultados = 0
+            async with sonda:
+                async for _, dispositivo in varrer(sonda, ips):
+                    consultados += 1
+                    if dispositivo is not None:
+                        encontrados.append(dispositivo)
+                    await resposta.progresso(
+                        f"Varrendo {rede}: {consultados}/{len(ips)} endereços, {len(encontrados)} com SNMP, "
+                        f"{sum(d.impressora for d in encontrados)} impressoras"
+                    )
+            duracao = time.perf_counter() - inicio
+
+            agora = time.time()
+            await asyncio.to_thread(historico.registrar_series,
+                                    [(d.ip, d.serie, agora) for d in encontrados if d.impressora and d.serie])
+            proposta = propor(encontrados, printers, series, rede)
+
+            if proposta.mudancas_ip:
+                await resposta.adicionar("Impressoras cadastradas que mudaram de IP (mesmo número de série):")
+                for impressora, dispositivo in proposta.mudancas_ip:
+                    await resposta.adicionar(
+                        f"{impressora.setor} (NID: {impressora.nid}): {impressora.ip} -> {dispositivo.ip}, {descrever_dispositivo(dispositivo)}\n"
+                        f"/atualizarIP NID:{impressora.nid} PARA:{dispositivo.ip}"
+                    )
+            if proposta.possiveis_mudancas:
+                await resposta.adicionar(
+                    "Possíveis mudanças de IP (impressoras fora do cadastro enquanto impressoras cadastradas nesta "
+                    "rede, sem número de série conhecido, não responderam):")
+                for dispositivo, candidatas in proposta.possiveis_mudancas:
+                    await resposta.adicionar(descrever_possivel_mudanca(dispositivo, candidatas))
+            if proposta.novas:
+                await resposta.adicionar("Impressoras fora do cadastro:")
+                for dispositivo in proposta.novas:
+                    await resposta.adicionar(
+                        f"{dispositivo.ip} - {descrever_dispositivo(dispositivo)}\n"
+                        f"/adicionar NID:<NID> IP:{dispositivo.ip} SETOR:<SETOR>"
+                    )
+            if proposta.sem_resposta:
+                await resposta.adicionar("Impressoras cadastradas nesta rede que não responderam:")
+                await resposta.adicionar("\n".join(
+                    f"{impressora.setor} ({impressora.ip}, NID: {impressora.nid})" for impressora in proposta.sem_resposta))
+
+            resumo = (f"Descoberta em {rede} concluída em {duracao:.1f} s: {len(ips)} endereços, "
+                      f"{len(encontrados)} com SNMP, {proposta.cadastradas} impressoras já cadastradas, "
+                      f"{len(proposta.novas)} novas, {len(proposta.mudancas_ip)} mudanças de IP, "
+                      f"{len(proposta.possiveis_mudancas)} possíveis mudanças de IP, "
+                      f"{len(proposta.sem_resposta)} cadastradas sem resposta.")
+            print(resumo)
+            await resposta.concluir(resumo)
+    except Exception as e:
+        await responder_erro(update, "executar a descoberta", e)
 
 async def remover_impressora(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Remove uma impressora da lista de impressoras com base no NID ou IP."""
@@ -347,16 +1290,12 @@ async def remover_impressora(update: Update, context: ContextTypes.DEFAULT_TYPE)
             nid = match_nid.group(1)
 
             # Procurar e remover a impressora pelo NID
-            printer_to_remove = None
-            for ip, (location, printer_nid) in list(printers.items()):
-                if printer_nid == nid:
-                    printer_to_remove = ip
-                    break
-
-            if printer_to_remove:
-                del printers[printer_to_remove]
-                with open('printers.json', 'w') as file:
-                    json.dump(printers, file, indent=4)
+            impressora = printers.por_nid(nid)
+
+            if impressora is not None:
+                printers.remover(impressora.ip)
+                esquecer_impressora(impressora.ip)
+                salvar_impressoras()
                 await update.message.reply_text(f"Impressora com NID {nid} removida com sucesso.")
             else:
                 await update.message.reply_text(f"Impressora com NID {nid} não encontrada.")
@@ -366,9 +1305,9 @@ async def remover_impressora(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
             # Procurar e remover a impressora pelo IP
             if ip in printers:
-                del printers[ip]
-                with open('printers.json', 'w') as file:
-                    json.dump(printers, file, indent=4)
+                printers.remover(ip)
+                esquecer_impressora(ip)
+                salvar_impressoras()
                 await update.message.reply_text(f"Impressora com IP {ip} removida com sucesso.")
             else:
                 await update.message.reply_text(f"Impressora com IP {ip} não encontrada.")
@@ -376,25 +1315,164 @@ async def remover_impressora(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await update.message.reply_text("Comando inválido. Use o formato: /remover NID:<NID> ou /remover IP:<IP>")
     
     except Exception as e:
-        await update.message.reply_text(f"Ocorreu um erro ao remover a impressora: {e}")
+        await responder_erro(update, "remover a impressora", e)
+
+class RequisicaoMedida(HTTPXRequest):
+    """HTTPXRequest que registra a duração e os erros de cada chamada à API do Telegram."""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        metodo = url.rsplit('/', 1)[-1]
+        inicio = time.perf_counter()
+        try:
+            codigo, conteudo = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            metrica_telegram_erros.inc(metodo=metodo)
+            raise
+        finally:
+            metrica_telegram_envio.observar(time.perf_counter() - inicio, metodo=metodo)
+        if codigo >= 400:
+            metrica_telegram_erros.inc(metodo=metodo)
+        return codigo, conteudo
+
+# Comando em execução na tarefa atual, definido por instrumentar() para a contagem de erros
+comando_atual = contextvars.ContextVar('comando_atual', default=None)
+
+async def responder_erro(update: Update, acao, erro) -> None:
+    """Responde o erro de um comando ao usuário e o conta em impressoras_comando_erros_total."""
+    comando = comando_atual.get()
+    if comando is not None:
+        metrica_comando_erros.inc(comando=comando)
+    await update.message.reply_text(f"Ocorreu um erro ao {acao}: {erro}")
+
+def instrumentar(nome, handler):
+    """Envolve um handler de comando medindo sua duração e contando os erros.
+
+    Os handlers tratam as próprias exceções e as respondem com responder_erro(), que faz a
+    contagem; as que escapam do handler são contadas aqui.
+    """
+    @functools.wraps(handler)
+    async def medido(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        token = comando_atual.set(nome)
+        with metrica_comando_duracao.medir(comando=nome):
+            try:
+                return await handler(update, context)
+            except Exception:
+                metrica_comando_erros.inc(comando=nome)
+                raise
+            finally:
+                comando_atual.reset(token)
+    return medido
+
+async def registrar_erro(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Error handler do Application: imprime as exceções não tratadas pelos handlers."""
+    print(f"Erro não tratado ao processar {update}: {context.error}")
+
+servidor_metricas = None
+
+async def iniciar(application: Application) -> None:
+    """Carrega as últimas leituras gravadas, abre o endpoint de métricas e agenda o polling periódico."""
+    global servidor_metricas
+    carregar_ultimas_leituras()
+    iniciar_trabalhadores()
+    if METRICAS_PORTA > 0:
+        servidor_metricas = iniciar_servidor(metricas, METRICAS_PORTA, METRICAS_HOST, perfil_varredura)
+        print(f"Métricas disponíveis em http://{METRICAS_HOST}:{METRICAS_PORTA}/metrics")
+    agendar_polling(application)
+    agendar_limpeza(application)
+    concluir_inicializacao()
+
+async def limpar_historico(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job do JobQueue: apaga do histórico as leituras mais antigas que HISTORICO_RETENCAO_DIAS."""
+    limite = time.time() - HISTORICO_RETENCAO_DIAS * 86400
+    try:
+        apagadas = await asyncio.to_thread(historico.remover_antigas, limite)
+    except Exception as e:
+        print(f"Falha ao apagar leituras antigas do histórico: {e}")
+        return
+    if apagadas:
+        print(f"{apagadas} leituras com mais de {HISTORICO_RETENCAO_DIAS:g} dias apagadas do histórico.")
+
+def agendar_limpeza(application: Application) -> None:
+    """Agenda a limpeza diária do histórico, se HISTORICO_RETENCAO_DIAS estiver definido."""
+    if HISTORICO_RETENCAO_DIAS <= 0:
+        return
+    if application.job_queue is None:
+        print('Limpeza do histórico desativada: instale python-telegram-bot[job-queue] para usar o JobQueue.')
+        return
+    application.job_queue.run_repeating(limpar_historico, interval=86400, first=60, name='limpeza_historico')
+
+def agendar_polling(application: Application) -> None:
+    """Agenda o polling periódico, se ele estiver ativado."""
+    if POLL_INTERVALO <= 0:
+        if ALERTAS_ATIVOS:
+            print('Alertas desativados: eles dependem do polling periódico (POLL_INTERVALO > 0).')
+        return
+    if application.job_queue is None:
+        print('Polling periódico desativado: instale python-telegram-bot[job-queue] para usar o JobQueue.')
+        return
+    if ALERTAS_ATIVOS:
+        toner = f"{alertas.padrao.toner_minimo:g}%" if alertas.padrao.toner_minimo > 0 else "desativado"
+        print(f"Alertas ativos (offline: {alertas.padrao.offline_ciclos} polls, toner: {toner}, "
+              f"contador: {alertas.padrao.paginas_hora} páginas/hora; ajustes em {ALERTAS_ARQUIVO})")
+        if ALERTAS_SUPRIMENTOS:
+            print("A regra de toner está ativa: o polling lê também os suprimentos de cada impressora.")
+    application.job_queue.run_repeating(polling_periodico, interval=POLL_INTERVALO, first=10, name='polling')
+
+def concluir_inicializacao():
+    """Registra quanto o bot levou para ficar pronto e grava o perfil da inicialização, se pedido."""
+    global perfil_inicializacao
+    segundos = time.perf_counter() - INICIO_PROCESSO
+    metrica_inicializacao.definir(segundos)
+    print(f"Bot pronto em {segundos:.2f} s")
+    if perfil_inicializacao is not None:
+        perfil_inicializacao.disable()
+        gravar_perfil(perfil_inicializacao, 'perfil_inicializacao', 'Perfil da inicialização')
+        perfil_inicializacao = None
+
+async def encerrar(application: Application) -> None:
+    """Grava o cadastro pendente e libera os clientes SNMP, o histórico e as métricas quando o bot é encerrado."""
+    if servidor_metricas is not None:
+        servidor_metricas.shutdown()
+    if pool_snmp is not None:
+        pool_snmp.fechar()
+    arquivo_impressoras.fechar()
+    snmp_client.fechar()
+    historico.fechar()
 
 def main() -> None:
-    application = Application.builder().token(TOKEN).build()
+    if not TOKEN:
+        raise ValueError("O token do bot não foi encontrado. Verifique seu arquivo .env.")
+    preparar()
+
+    # concurrent_updates permite que outros comandos sejam atendidos enquanto /contadores está em andamento
+    # RequisicaoMedida alimenta as métricas de envio; o pool maior acompanha o concurrent_updates
+    application = (Application.builder().token(TOKEN).concurrent_updates(True)
+                   .request(RequisicaoMedida(connection_pool_size=256))
+                   .post_init(iniciar).post_shutdown(encerrar).build())
 
     # Handlers para comandos
-    application.add_handler(CommandHandler('start', start))
-    application.add_handler(CommandHandler('comandos', comandos))
-    application.add_handler(CommandHandler('contadores', contadores))
-    application.add_handler(CommandHandler('contador', contador))
-    application.add_handler(CommandHandler('atualizarNID', atualizar_nid))
-    application.add_handler(CommandHandler('atualizarIP', atualizar_ip))
-    application.add_handler(CommandHandler('atualizarSetor', atualizar_setor))
-    application.add_handler(CommandHandler('adicionar', adicionar_impressora))
-    application.add_handler(CommandHandler('buscar', buscar_setor))
-    application.add_handler(CommandHandler('buscarErro', buscar_erro))
-    application.add_handler(CommandHandler('remover', remover_impressora))
+    application.add_handler(CommandHandler('start', instrumentar('start', start)))
+    application.add_handler(CommandHandler('comandos', instrumentar('comandos', comandos)))
+    application.add_handler(CommandHandler('contadores', instrumentar('contadores', contadores)))
+    application.add_handler(CommandHandler('contador', instrumentar('contador', contador)))
+    application.add_handler(CommandHandler('suprimentos', instrumentar('suprimentos', consultar_suprimentos)))
+    application.add_handler(CommandHandler('historico', instrumentar('historico', consultar_historico)))
+    application.add_handler(CommandHandler('relatorio', instrumentar('relatorio', relatorio)))
+    application.add_handler(CommandHandler('atualizarNID', instrumentar('atualizarNID', atualizar_nid)))
+    application.add_handler(CommandHandler('atualizarIP', instrumentar('atualizarIP', atualizar_ip)))
+    application.add_handler(CommandHandler('atualizarSetor', instrumentar('atualizarSetor', atualizar_setor)))
+    application.add_handler(CommandHandler('adicionar', instrumentar('adicionar', adicionar_impressora)))
+    application.add_handler(CommandHandler('buscar', instrumentar('buscar', buscar_setor)))
+    application.add_handler(CommandHandler('buscarErro', instrumentar('buscarErro', buscar_erro)))
+    application.add_handler(CommandHandler('descobrir', instrumentar('descobrir', descobrir)))
+    application.add_handler(CommandHandler('alertas', instrumentar('alertas', listar_alertas)))
+    application.add_handler(CommandHandler('remover', instrumentar('remover', remover_impressora)))
+
+    application.add_error_handler(registrar_erro)
 
     application.run_polling()
 
 if __name__ == '__main__':
+    # Necessário para os trabalhadores do polling distribuído no executável do PyInstaller
+    multiprocessing.freeze_support()
     main()
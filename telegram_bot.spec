@@ -1,37 +1,89 @@
 # -*- mode: python ; coding: utf-8 -*-
+# pyinstaller telegram_bot.spec gera um executável único (dist/telegram_bot). Com
+# PYINSTALLER_ONEDIR=1, gera uma pasta (dist/telegram_bot/): o executável único descompacta o
+# pacote inteiro em uma pasta temporária a cada execução, e esse é o maior custo da inicialização.
+import os
+import sys
 
+sys.path.insert(0, SPECPATH)
+import mibs
+
+ONEDIR = os.getenv('PYINSTALLER_ONEDIR', '0') == '1'
+
+# O engine SNMP carrega as MIBs pré-compiladas; as fontes dos mesmos módulos vão junto, caso o
+# arquivo precise ser gerado de novo
+arquivo_mibs = os.path.join(SPECPATH, 'mibs_engine.bin')
+mibs.compilar(arquivo_mibs)
+datas = [(arquivo_mibs, '.')]
+for caminho in mibs.fontes().values():
+    destino = 'pysnmp/smi/mibs/instances' if os.path.basename(caminho).startswith('__') else 'pysnmp/smi/mibs'
+    datas.append((caminho, destino))
 
 a = Analysis(
     ['telegram_bot.py'],
     pathex=[],
     binaries=[],
-    datas=[],
+    datas=datas,
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=[
+        # Compilador de MIBs do pysnmp: o bot só usa OIDs numéricas
+        'pysmi', 'lark', 'ply',
+        # Biblioteca padrão e ferramentas que o bot não usa
+        'tkinter', 'unittest', 'pydoc', 'doctest', 'lib2to3', 'setuptools', 'pkg_resources',
+    ],
     noarchive=False,
 )
 pyz = PYZ(a.pure)
 
-exe = EXE(
-    pyz,
-    a.scripts,
-    a.binaries,
-    a.datas,
-    [],
-    name='telegram_bot',
-    debug=False,
-    bootloader_ignore_signals=False,
-    strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
-    console=True,
-    disable_windowed_traceback=False,
-    argv_emulation=False,
-    target_arch=None,
-    codesign_identity=None,
-    entitlements_file=None,
-)
+# Sem UPX: as bibliotecas comprimidas precisam ser descomprimidas a cada inicialização
+if ONEDIR:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        [],
+        exclude_binaries=True,
+        name='telegram_bot',
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        upx=False,
+        console=True,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+    )
+    coll = COLLECT(
+        exe,
+        a.binaries,
+        a.datas,
+        strip=False,
+        upx=False,
+        upx_exclude=[],
+        name='telegram_bot',
+    )
+else:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        a.binaries,
+        a.datas,
+        [],
+        name='telegram_bot',
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        upx=False,
+        upx_exclude=[],
+        runtime_tmpdir=None,
+        console=True,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+    )
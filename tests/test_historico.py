@@ -0,0 +1,56 @@
+from datetime import date
+import time
+
+import pytest
+
+from historico import HistoricoError, HistoricoLeituras
+
+
+def leitura(nid, coletada_em, contador, ip='10.0.0.1', serie=None):
+    return {'ip': ip, 'nid': nid, 'setor': 'TI', 'coletada_em': coletada_em, 'contador': contador,
+            'contador_mono': None, 'contador_cor': None, 'status': 'ok', 'online': 1, 'serie': serie}
+
+
+@pytest.fixture
+def historico(tmp_path):
+    historico = HistoricoLeituras(str(tmp_path / 'historico.db'))
+    yield historico
+    historico.fechar()
+
+
+def paginas(historico, nid):
+    hoje = date.today()
+    return {linha['nid']: linha['paginas'] for linha in historico.consumo_por_impressora([nid], hoje, hoje)}.get(nid)
+
+
+def test_consumo_continua_apos_mudanca_de_ip(historico):
+    agora = time.time() - 60
+    historico.registrar([leitura('1', agora, 100), leitura('1', agora + 10, 150)])
+    historico.registrar([leitura('1', agora + 20, 170, ip='10.0.0.2')])
+    assert paginas(historico, '1') == 70
+
+
+def test_troca_de_serie_recomeca_a_contagem(historico):
+    agora = time.time() - 60
+    historico.registrar([leitura('1', agora, 100, serie='A'), leitura('1', agora + 10, 40, serie='B'),
+                         leitura('1', agora + 20, 45, serie='B')])
+    assert paginas(historico, '1') == 5
+
+
+def test_renomear_nid_transfere_o_consumo(historico):
+    agora = time.time() - 60
+    historico.registrar([leitura('1', agora, 100), leitura('1', agora + 10, 150)])
+    historico.renomear_nid('1', '2')
+    historico.registrar([leitura('2', agora + 20, 160)])
+    assert paginas(historico, '2') == 60
+    assert not historico.tem_historico('1')
+
+
+def test_renomear_nid_recusa_nid_com_historico(historico):
+    agora = time.time() - 60
+    historico.registrar([leitura('1', agora, 100), leitura('1', agora + 10, 150)])
+    historico.registrar([leitura('2', agora, 500, ip='10.0.0.9'), leitura('2', agora + 10, 530, ip='10.0.0.9')])
+    with pytest.raises(HistoricoError):
+        historico.renomear_nid('1', '2')
+    assert paginas(historico, '1') == 50
+    assert paginas(historico, '2') == 30
@@ -0,0 +1,34 @@
+import time
+
+from saude import SaudeImpressoras
+
+
+def test_backoff_limitado_apos_milhares_de_falhas():
+    # Uma impressora desligada por semanas acumula milhares de falhas seguidas
+    saude = SaudeImpressoras(base=300.0, maximo=3600.0, limiar=2)
+    for _ in range(5000):
+        saude.registrar_falha('10.0.0.1', 'timeout')
+    estado = saude.estado('10.0.0.1')
+    assert estado.falhas_consecutivas == 5000
+    assert estado.proxima_tentativa - estado.ultima_falha == 3600.0
+    assert not saude.disponivel('10.0.0.1')
+
+
+def test_backoff_exponencial_ate_o_maximo():
+    saude = SaudeImpressoras(base=300.0, maximo=3600.0, limiar=2)
+    esperas = []
+    for _ in range(7):
+        saude.registrar_falha('10.0.0.1', 'timeout')
+        estado = saude.estado('10.0.0.1')
+        esperas.append(max(estado.proxima_tentativa - estado.ultima_falha, 0.0))
+    assert esperas == [0.0, 300.0, 600.0, 1200.0, 2400.0, 3600.0, 3600.0]
+
+
+def test_sucesso_zera_a_espera():
+    saude = SaudeImpressoras()
+    for _ in range(3000):
+        saude.registrar_falha('10.0.0.1', 'timeout')
+    saude.registrar_sucesso('10.0.0.1')
+    assert saude.disponivel('10.0.0.1')
+    assert saude.estado('10.0.0.1').falhas_consecutivas == 0
+    assert saude.estado('10.0.0.1').ultimo_sucesso <= time.time()
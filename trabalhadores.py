@@ -0,0 +1,255 @@
+"""Polling SNMP distribuído entre processos, para frotas grandes (experimental).
+
+Em um único processo, codificar e decodificar os PDUs no pysnmp custa cerca de 2,5 ms de CPU por
+impressora (medido com o benchmark_snmp.py), e com muitas consultas simultâneas isso ocupa um núcleo
+inteiro antes de a rede ser o limite. O PoolSnmp divide as impressoras de cada varredura entre processos
+trabalhadores (por hash do IP ou por sub-rede /24); cada trabalhador tem o próprio SnmpClient, com
+engine, socket UDP e dispatcher próprios, e devolve as respostas em lotes pequenos por uma fila
+local assim que elas chegam. O processo do bot junta os lotes de todos os trabalhadores em um único
+fluxo, e continua sendo o único a interpretar as leituras, atualizar a saúde e gravar o histórico.
+
+Os valores são convertidos para int/str no trabalhador, para que só tipos simples atravessem a fila.
+
+Os trabalhadores só aceleram a varredura se houver núcleos livres: em uma máquina de um núcleo, 4
+trabalhadores com 32 consultas simultâneas cada levaram o mesmo tempo que um único processo com 128
+(10,6 s e 9,8 s para 2000 impressoras simuladas). O ganho em máquinas de vários núcleos ainda não
+foi medido, por isso o modo é experimental e fica desligado por padrão (POLL_TRABALHADORES=0).
+"""
+from collections import defaultdict, deque
+import asyncio
+import ipaddress
+import itertools
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+import zlib
+
+from snmp_client import SnmpClient, resumir_latencias
+
+# Um lote de respostas é enviado ao atingir este tamanho ou esta idade, o que vier primeiro
+TAMANHO_LOTE = 64
+INTERVALO_LOTE = 0.05
+
+PARTICOES = ('hash', 'sub-rede')
+
+
+def _simples(valor):
+    """Converte um valor do pysnmp em int ou str (None continua None)."""
+    from pyasn1.type import univ  # Só roda nos trabalhadores, que já carregaram o pysnmp
+    if valor is None:
+        return None
+    if isinstance(valor, univ.Integer):
+        return int(valor)
+    try:
+        return str(valor)
+    except UnicodeDecodeError:
+        return valor.prettyPrint()
+
+
+def _ao_concluir(futuros, funcao):
+    """Chama funcao() quando todos os futures terminarem."""
+    restantes = [len(futuros)]
+    lock = threading.Lock()
+
+    def concluido(_):
+        with lock:
+            restantes[0] -= 1
+            fim = restantes[0] == 0
+        if fim:
+            funcao()
+
+    for futuro in futuros:
+        futuro.add_done_callback(concluido)
+
+
+def _receber_pedidos(cliente, pedidos, prontos):
+    """Thread do trabalhador: envia ao SnmpClient cada IP dos pedidos recebidos do bot."""
+    while True:
+        pedido = pedidos.get()
+        if pedido is None:
+            prontos.put(None)
+            return
+        lote, ips, oids, subarvore = pedido
+        prontos.put((lote, len(ips)))
+        for ip in ips:
+            futuros = [cliente.submeter(ip, oids)]
+            if subarvore:
+                futuros.append(cliente.submeter_walk(ip, subarvore))
+            _ao_concluir(futuros, lambda lote=lote, ip=ip, futuros=futuros: prontos.put((lote, ip, futuros)))
+
+
+def _resultado(cliente, ip, futuros):
+    valores = futuros[0].result()
+    linhas = futuros[1].result() if len(futuros) > 1 else None
+    return (
+        ip,
+        None if valores is None else {oid: _simples(valor) for oid, valor in valores.items()},
+        None if linhas is None else [(oid, _simples(valor)) for oid, valor in linhas],
+        cliente.ultimo_erro(ip) if valores is None else None,
+    )
+
+
+def executar_trabalhador(indice, pedidos, respostas, configuracao):
+    """Processo trabalhador: consulta os IPs recebidos e devolve (índice, lote, resultados, observações).
+
+    `resultados` é uma lista de (ip, valores, linhas_da_subárvore, erro), ou None quando o lote
+    terminou neste trabalhador; `observações` são as (ip, segundos, sucesso, erro) de cada
+    consulta, para as estatísticas e métricas do bot.
+    """
+    # Ctrl+C no terminal chega a todos os processos; quem encerra os trabalhadores é o bot
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    observacoes = deque()
+    cliente = SnmpClient(observador=lambda *observacao: observacoes.append(observacao), **configuracao)
+    prontos = queue.SimpleQueue()
+    threading.Thread(target=_receber_pedidos, args=(cliente, pedidos, prontos), daemon=True).start()
+
+    restantes = {}  # lote -> IPs ainda sem resposta
+    saida = defaultdict(list)  # lote -> resultados ainda não enviados
+    ultimo_envio = time.monotonic()
+    encerrar = False
+    while not encerrar or restantes:
+        try:
+            item = prontos.get(timeout=INTERVALO_LOTE)
+        except queue.Empty:
+            item = False
+        if item is None:
+            encerrar = True
+        elif item and len(item) == 2:
+            lote, quantidade = item
+            restantes[lote] = restantes.get(lote, 0) + quantidade
+        elif item:
+            lote, ip, futuros = item
+            saida[lote].append(_resultado(cliente, ip, futuros))
+            restantes[lote] -= 1
+
+        agora = time.monotonic()
+        cheio = any(len(resultados) >= TAMANHO_LOTE for resultados in saida.values())
+        terminados = [lote for lote, quantidade in restantes.items() if quantidade == 0]
+        if saida and (cheio or terminados or agora - ultimo_envio >= INTERVALO_LOTE):
+            lotes_observacoes = [observacoes.popleft() for _ in range(len(observacoes))]
+            for lote, resultados in saida.items():
+                respostas.put((indice, lote, resultados, lotes_observacoes))
+                lotes_observacoes = []
+            saida.clear()
+            ultimo_envio = agora
+        for lote in terminados:
+            respostas.put((indice, lote, None, []))
+            del restantes[lote]
+    cliente.fechar()
+
+
+class PoolSnmp:
+    """Trabalhadores SNMP em processos separados, com a mesma interface de varredura para o bot.
+
+    `configuracao` são os argumentos do SnmpClient de cada trabalhador (community, port, timeout,
+    retries, concorrencia). A concorrência vale por trabalhador.
+    """
+
+    def __init__(self, trabalhadores, particao='hash', observador=None, historico_latencias=5000, **configuracao):
+        if particao not in PARTICOES:
+            raise ValueError(f"Partição inválida: {particao}. Use {' ou '.join(PARTICOES)}.")
+        self.trabalhadores = trabalhadores
+        self.particao = particao
+        self.observador = observador
+        self.configuracao = configuracao
+        self.latencias = deque(maxlen=historico_latencias)
+        self.total_consultas = 0
+        self.total_falhas = 0
+        self._lotes = {}  # lote -> (loop, asyncio.Queue) da varredura que espera as respostas
+        self._contador = itertools.count(1)
+        # spawn: o processo do bot já tem threads (dispatcher SNMP, servidor de métricas), e fork
+        # copiaria locks possivelmente ocupados por elas. Cada trabalhador importa de novo o módulo
+        # principal do bot (como __mp_main__), que por isso não abre arquivos nem o histórico no import
+        contexto = multiprocessing.get_context('spawn')
+        self._respostas = contexto.Queue()
+        self._pedidos = [contexto.Queue() for _ in range(trabalhadores)]
+        self._processos = [
+            contexto.Process(target=executar_trabalhador, args=(indice, self._pedidos[indice], self._respostas, configuracao),
+                             name=f'snmp-trabalhador-{indice}', daemon=True)
+            for indice in range(trabalhadores)
+        ]
+        for processo in self._processos:
+            processo.start()
+        self._leitor = threading.Thread(target=self._ler_respostas, name='snmp-trabalhadores', daemon=True)
+        self._leitor.start()
+
+    def trabalhador_do_ip(self, ip):
+        """Índice do trabalhador responsável pelo IP (estável entre execuções)."""
+        chave = ip
+        if self.particao == 'sub-rede':
+            try:
+                chave = str(ipaddress.IPv4Network(f"{ip}/24", strict=False))
+            except ValueError:
+                pass
+        return zlib.crc32(chave.encode()) % self.trabalhadores
+
+    def _ler_respostas(self):
+        while True:
+            mensagem = self._respostas.get()
+            if mensagem is None:
+                return
+            indice, lote, resultados, observacoes = mensagem
+            for ip, segundos, sucesso, erro in observacoes:
+                self.latencias.append((ip, segundos, sucesso))
+                self.total_consultas += 1
+                self.total_falhas += not sucesso
+                if self.observador is not None:
+                    try:
+                        self.observador(ip, segundos, sucesso, erro)
+                    except Exception as e:
+                        print(f"Falha ao registrar a consulta SNMP de {ip}: {e}")
+            destino = self._lotes.get(lote)
+            if destino is not None:
+                loop, fila = destino
+                loop.call_soon_threadsafe(fila.put_nowait, (indice, resultados))
+
+    async def consultar(self, ips, oids, subarvore=None):
+        """Consulta os IPs nos trabalhadores e entrega (ip, valores, linhas, erro) conforme chegam.
+
+        `valores` é o dicionário oid -> int/str (None para OIDs ausentes) ou None sem resposta;
+        `linhas` é a lista de (oid, valor) da subárvore, quando pedida.
+        """
+        grupos = defaultdict(list)
+        for ip in ips:
+            grupos[self.trabalhador_do_ip(ip)].append(ip)
+        if not grupos:
+            return
+        lote = next(self._contador)
+        fila = asyncio.Queue()
+        self._lotes[lote] = (asyncio.get_running_loop(), fila)
+        try:
+            for indice, grupo in grupos.items():
+                self._pedidos[indice].put((lote, grupo, list(oids), subarvore))
+            restantes = set(grupos)
+            while restantes:
+                try:
+                    indice, resultados = await asyncio.wait_for(fila.get(), timeout=5)
+                except asyncio.TimeoutError:
+                    mortos = [indice for indice in restantes if not self._processos[indice].is_alive()]
+                    if mortos:
+                        raise RuntimeError(f"Trabalhador SNMP {mortos[0]} terminou inesperadamente.")
+                    continue
+                if resultados is None:
+                    restantes.discard(indice)  # Fim do lote neste trabalhador
+                    continue
+                for resultado in resultados:
+                    yield resultado
+        finally:
+            self._lotes.pop(lote, None)
+
+    def estatisticas(self):
+        return resumir_latencias(self.latencias, self.total_consultas, self.total_falhas)
+
+    def fechar(self):
+        """Encerra os trabalhadores e a thread que lê as respostas."""
+        for pedidos in self._pedidos:
+            pedidos.put(None)
+        limite = time.monotonic() + 5
+        for processo in self._processos:
+            processo.join(timeout=max(0.1, limite - time.monotonic()))
+            if processo.is_alive():
+                processo.terminate()
+        self._respostas.put(None)
+        self._leitor.join(timeout=1)